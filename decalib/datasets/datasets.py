@@ -45,24 +45,30 @@ def video2sequence(video_path, sample_step=10):
     print('video frames are stored in {}'.format(videofolder))
     return imagepath_list
 
+def list_images(testpath, sample_step=10):
+    '''
+        testpath: folder, imagepath_list, image path, video path (split into frames)
+    '''
+    if isinstance(testpath, list):
+        imagepath_list = testpath
+    elif os.path.isdir(testpath): 
+        imagepath_list = glob(testpath + '/*.jpg') +  glob(testpath + '/*.png') + glob(testpath + '/*.bmp')
+    elif os.path.isfile(testpath) and (testpath[-3:] in ['jpg', 'png', 'bmp']):
+        imagepath_list = [testpath]
+    elif os.path.isfile(testpath) and (testpath[-3:] in ['mp4', 'csv', 'vid', 'ebm']):
+        imagepath_list = video2sequence(testpath, sample_step)
+    else:
+        print(f'please check the test path: {testpath}')
+        exit()
+    # print('total {} images'.format(len(imagepath_list)))
+    return sorted(imagepath_list)
+
 class TestData(Dataset):
     def __init__(self, testpath, iscrop=True, crop_size=224, scale=1.25, face_detector='fan', sample_step=10):
         '''
             testpath: folder, imagepath_list, image path, video path
         '''
-        if isinstance(testpath, list):
-            self.imagepath_list = testpath
-        elif os.path.isdir(testpath): 
-            self.imagepath_list = glob(testpath + '/*.jpg') +  glob(testpath + '/*.png') + glob(testpath + '/*.bmp')
-        elif os.path.isfile(testpath) and (testpath[-3:] in ['jpg', 'png', 'bmp']):
-            self.imagepath_list = [testpath]
-        elif os.path.isfile(testpath) and (testpath[-3:] in ['mp4', 'csv', 'vid', 'ebm']):
-            self.imagepath_list = video2sequence(testpath, sample_step)
-        else:
-            print(f'please check the test path: {testpath}')
-            exit()
-        # print('total {} images'.format(len(self.imagepath_list)))
-        self.imagepath_list = sorted(self.imagepath_list)
+        self.imagepath_list = list_images(testpath, sample_step)
         self.crop_size = crop_size
         self.scale = scale
         self.iscrop = iscrop
@@ -101,6 +107,7 @@ class TestData(Dataset):
             image = image[:,:,:3]
 
         h, w, _ = image.shape
+        kpt = None
         if self.iscrop:
             # provide kpt as txt file, or mat file (for AFLW2000)
             kpt_matpath = os.path.splitext(imagepath)[0]+'.mat'
@@ -136,8 +143,17 @@ class TestData(Dataset):
 
         dst_image = warp(image, tform.inverse, output_shape=(self.resolution_inp, self.resolution_inp))
         dst_image = dst_image.transpose(2,0,1)
-        return {'image': torch.tensor(dst_image).float(),
+        data = {'image': torch.tensor(dst_image).float(),
                 'imagename': imagename,
                 'tform': torch.tensor(tform.params).float(),
                 'original_image': torch.tensor(image.transpose(2,0,1)).float(),
-                }
\ No newline at end of file
+                }
+        # landmarks in the cropped image, normalized to [-1,1] like the DECA landmarks
+        # NaN without a keypoint file, the keys are always there so that samples can be collated
+        if kpt is not None:
+            landmarks = tform(kpt[:,:2])/self.resolution_inp*2 - 1
+        else:
+            landmarks = np.full([68, 2], np.nan)
+        data['landmarks'] = torch.tensor(landmarks).float()
+        data['landmarks_valid'] = kpt is not None
+        return data
\ No newline at end of file
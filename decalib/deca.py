@@ -14,6 +14,8 @@
 # For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
 
 import os, sys
+import contextlib
+import threading
 import torch
 import torchvision
 import torch.nn.functional as F
@@ -25,17 +27,64 @@ from skimage.io import imread
 import cv2
 import pickle
 from .utils.renderer import SRenderY, set_rasterizer
+from .utils.topology import Topology, DenseMesh
+from .utils.assets import load_assets, subset
 from .models.encoders import ResnetEncoder
 from .models.FLAME import FLAME, FLAMETex
 from .models.decoders import Generator
+from .fitting import LandmarkFitter
 from .utils import util
+from .utils import rig
+from .utils import checkpoint
+from .utils import inference
+from .utils import quantization
+from .utils import export
 from .utils.rotation_converter import batch_euler2axis
 from .utils.tensor_cropper import transform_points
 from .datasets import datasets
 from .utils.config import cfg
 torch.backends.cudnn.benchmark = True
 
+def _batch_slice(x, batch_size, start, end):
+    ''' samples start:end of the tensors with batch_size samples in x (tensor, dict or None), the rest is shared
+    '''
+    if isinstance(x, dict):
+        return {key: _batch_slice(value, batch_size, start, end) for key, value in x.items()}
+    if torch.is_tensor(x) and x.dim() > 0 and x.shape[0] == batch_size:
+        return x[start:end]
+    return x
+
+def _batch_cat(dicts):
+    return {key: torch.cat([d[key] for d in dicts], dim=0) for key in dicts[0]}
+
+def _raster_floats(channels):
+    ''' float32 values per pixel of one rasterization of channels attributes: the depth, face index and barycentric
+    buffers (7 with the pytorch3d distances), the attributes gathered at the 3 corners, the interpolated ones and alpha
+    '''
+    return 7 + 3*channels + channels + 1
+
 class DECA(nn.Module):
+    # components are created on first access (or by warmup), attribute -> component
+    _lazy_attributes = {
+        '_assets': 'assets',
+        'topology': 'topology',
+        'E_flame': 'E_flame',
+        'E_detail': 'E_detail',
+        'D_detail': 'D_detail',
+        'flame': 'flame',
+        'flametex': 'flametex',
+        'render': 'render',
+        'uv_face_eye_mask': 'uv_masks',
+        'uv_face_mask': 'uv_masks',
+        'fixed_uv_dis': 'uv_masks',
+        'mean_texture': 'uv_masks',
+        'dense_template': 'dense_mesh',
+        'dense_mesh': 'dense_mesh',
+    }
+    # options that can differ between instances sharing their components
+    variant_options = ['use_tex', 'extract_tex', 'use_detail', 'precision', 'rasterizer_type']
+    components = ['assets', 'topology', 'E_flame', 'E_detail', 'D_detail', 'flame', 'flametex', 'render', 'uv_masks', 'dense_mesh']
+
     def __init__(self, config=None, device='cuda'):
         super(DECA, self).__init__()
         if config is None:
@@ -45,26 +94,127 @@ class DECA(nn.Module):
         self.device = device
         self.image_size = self.cfg.dataset.image_size
         self.uv_size = self.cfg.model.uv_size
-
+        self._built = set()
+        self._build_lock = threading.RLock()
+        self._weights_source = None
+        # instance the components are shared with, see variant
+        self._base = None
+        self._decode_chunk_size = None
+        self._shared_weights = {}
         self._create_model(self.cfg.model)
-        self._setup_renderer(self.cfg.model)
 
-    def _setup_renderer(self, model_cfg):
+    def __getattr__(self, name):
+        try:
+            return super(DECA, self).__getattr__(name)
+        except AttributeError:
+            component = DECA._lazy_attributes.get(name)
+            if component is None or component in self._built or not self._enabled(component):
+                raise
+        self._build(component)
+        return getattr(self, name)
+
+    def _enabled(self, component):
+        if component in ['E_detail', 'D_detail']:
+            return self.use_detail
+        if component == 'flametex':
+            return self.cfg.model.use_tex
+        return True
+
+    def _build(self, component):
+        with self._build_lock:
+            if component in self._built:
+                return
+            if self._base is None or not self._share(component):
+                getattr(self, '_build_' + component)()
+            self._built.add(component)
+
+    def variant(self, **options):
+        ''' DECA with other inference options, a view over the networks, FLAME, assets and renderer buffers of this instance
+        options: use_tex, extract_tex, use_detail, precision (cfg.model) and rasterizer_type (cfg)
+        Components are taken from this instance on first use: optimize_for_inference or quantize this instance
+        before using its variants. Variants encode and decode without gradients, the modules of this instance are not modified.
+        '''
+        config = self.cfg.clone()
+        for key, value in options.items():
+            if key not in DECA.variant_options:
+                raise ValueError(f'{key} cannot differ between variants, expected one of {DECA.variant_options}')
+            if key in config.model:
+                config.model[key] = value
+            else:
+                config[key] = value
+        variant = DECA(config=config, device=self.device)
+        # not registered as a submodule, the shared components are
+        variant.__dict__['_base'] = self
+        return variant
+
+    def _share(self, component):
+        ''' component of the base instance, when it is enabled there
+        '''
+        base = self._base
+        if component == 'render' and base.cfg.rasterizer_type != self.cfg.rasterizer_type:
+            set_rasterizer(self.cfg.rasterizer_type)
+            render = base.render.with_rasterizer(self.cfg.rasterizer_type, self.cfg.rasterizer_cache_path)
+            render.autotune()
+            self.render = render
+            return True
+        if not base._enabled(component):
+            return False
+        base._build(component)
+        for name, attribute_component in DECA._lazy_attributes.items():
+            if attribute_component == component:
+                setattr(self, name, getattr(base, name))
+        return True
+
+    def warmup(self, components=None):
+        ''' create the components up front instead of on first use
+        components: names from DECA.components, all enabled components if None
+        Returns: the names of the components that are ready
+        '''
+        if components is None:
+            components = [component for component in DECA.components if self._enabled(component)]
+        for component in components:
+            if component not in DECA.components:
+                raise ValueError(f'unknown component {component}, expected one of {DECA.components}')
+            if not self._enabled(component):
+                raise ValueError(f'{component} is disabled by the config')
+            self._build(component)
+        return list(components)
+
+    def _build_assets(self):
+        # static assets, mapped from the compiled bundle when it is up to date
+        self._assets = load_assets(self.cfg.model, self.cfg.model.get('asset_bundle_path') or None)
+
+    def _build_topology(self):
+        # head mesh connectivity, shared by FLAME, the renderer and the detail mesh
+        assets = self._assets
+        self.topology = Topology(torch.as_tensor(assets['topology/faces']), num_verts=assets['topology/verts'].shape[0],
+                                 uvcoords=torch.as_tensor(assets['topology/uvcoords']), uvfaces=torch.as_tensor(assets['topology/uvfaces']),
+                                 template=torch.as_tensor(assets['topology/verts']))
+
+    def _build_render(self):
+        model_cfg = self.cfg.model
         set_rasterizer(self.cfg.rasterizer_type)
-        self.render = SRenderY(self.image_size, obj_filename=model_cfg.topology_path, uv_size=model_cfg.uv_size, rasterizer_type=self.cfg.rasterizer_type).to(self.device)
+        render = SRenderY(self.image_size, obj_filename=model_cfg.topology_path, uv_size=model_cfg.uv_size, rasterizer_type=self.cfg.rasterizer_type,
+                          rasterizer_cache_path=self.cfg.rasterizer_cache_path, topology=self.topology,
+                          lod_levels=model_cfg.lod_levels).to(self.device)
+        render.autotune()
+        # assigned once ready, __getattr__ returns set attributes without the build lock
+        self.render = render
+
+    def _build_uv_masks(self):
+        assets = self._assets
         # face mask for rendering details
-        mask = imread(model_cfg.face_eye_mask_path).astype(np.float32)/255.; mask = torch.from_numpy(mask[:,:,0])[None,None,:,:].contiguous()
-        self.uv_face_eye_mask = F.interpolate(mask, [model_cfg.uv_size, model_cfg.uv_size]).to(self.device)
-        mask = imread(model_cfg.face_mask_path).astype(np.float32)/255.; mask = torch.from_numpy(mask[:,:,0])[None,None,:,:].contiguous()
-        self.uv_face_mask = F.interpolate(mask, [model_cfg.uv_size, model_cfg.uv_size]).to(self.device)
+        self.uv_face_eye_mask = torch.as_tensor(assets['uv_face_eye_mask']).to(self.device)
+        self.uv_face_mask = torch.as_tensor(assets['uv_face_mask']).to(self.device)
         # displacement correction
-        fixed_dis = np.load(model_cfg.fixed_displacement_path)
-        self.fixed_uv_dis = torch.tensor(fixed_dis).float().to(self.device)
+        self.fixed_uv_dis = torch.as_tensor(assets['fixed_uv_dis']).to(self.device)
         # mean texture
-        mean_texture = imread(model_cfg.mean_tex_path).astype(np.float32)/255.; mean_texture = torch.from_numpy(mean_texture.transpose(2,0,1))[None,:,:,:].contiguous()
-        self.mean_texture = F.interpolate(mean_texture, [model_cfg.uv_size, model_cfg.uv_size]).to(self.device)
+        self.mean_texture = torch.as_tensor(assets['mean_texture']).to(self.device)
+
+    def _build_dense_mesh(self):
         # dense mesh template, for save detail mesh
-        self.dense_template = np.load(model_cfg.dense_template_path, allow_pickle=True, encoding='latin1').item()
+        self.dense_template = subset(self._assets, 'dense_template/')
+        self.dense_mesh = DenseMesh(self.dense_template, self.topology.num_verts).to(self.device)
 
     def _create_model(self, model_cfg):
         # set up parameters
@@ -73,31 +223,83 @@ class DECA(nn.Module):
         self.n_cond = model_cfg.n_exp + 3 # exp + jaw pose
         self.num_list = [model_cfg.n_shape, model_cfg.n_tex, model_cfg.n_exp, model_cfg.n_pose, model_cfg.n_cam, model_cfg.n_light]
         self.param_dict = {i:model_cfg.get('n_' + i) for i in model_cfg.param_list}
+        # detail networks are skipped by coarse-only configs
+        self.use_detail = model_cfg.get('use_detail', True)
+        self.precision = model_cfg.get('precision', 'fp32')
+
+    def _build_E_flame(self):
+        self.E_flame = self._load_weights('E_flame', ResnetEncoder(outsize=self.n_param).to(self.device))
+
+    def _build_E_detail(self):
+        self.E_detail = self._load_weights('E_detail', ResnetEncoder(outsize=self.n_detail).to(self.device))
+
+    def use_shared_weights(self, shared_weights):
+        ''' networks created from now on use the tensors of shared_weights (module -> state dict) instead of loading their own,
+        e.g. pool.shared_weights in shared memory
+        '''
+        self._shared_weights = shared_weights
 
-        # encoders
-        self.E_flame = ResnetEncoder(outsize=self.n_param).to(self.device) 
-        self.E_detail = ResnetEncoder(outsize=self.n_detail).to(self.device)
-        # decoders
-        self.flame = FLAME(model_cfg).to(self.device)
-        if model_cfg.use_tex:
-            self.flametex = FLAMETex(model_cfg).to(self.device)
-        self.D_detail = Generator(latent_dim=self.n_detail+self.n_cond, out_channels=1, out_scale=model_cfg.max_z, sample_mode = 'bilinear').to(self.device)
-        # resume model
+    def _load_weights(self, module, network):
+        ''' network with the weights of module, in eval mode
+        the caller assigns it only then: __getattr__ returns set attributes without taking the build lock
+        '''
+        if module in self._shared_weights:
+            util.share_state_dict(network, self._shared_weights[module])
+        elif module in ['E_flame', 'E_detail'] and self.cfg.get('quantized_modelpath', ''):
+            network = self._load_quantized(module, network)
+        else:
+            self._load_pretrained(module, network)
+        return network.eval()
+
+    def _load_quantized(self, module, network):
+        ''' int8 encoder saved by save_quantized, cpu only
+        '''
+        quantized_path = self.cfg.quantized_modelpath
+        if torch.device(self.device).type != 'cpu':
+            raise ValueError('the quantized encoders run on cpu only')
+        if 'quantized_checkpoint' not in self.__dict__:
+            print(f'quantized model found. load {quantized_path}')
+            self.quantized_checkpoint = torch.load(quantized_path)
+            self.quantization_backend = self.quantized_checkpoint['backend']
+        encoder = quantization.quantized_encoder(network.eval(), backend=self.quantization_backend, image_size=self.image_size)
+        encoder.load_state_dict(self.quantized_checkpoint[module])
+        return encoder
+
+    def _build_D_detail(self):
+        self.D_detail = self._load_weights('D_detail', Generator(latent_dim=self.n_detail+self.n_cond, out_channels=1, out_scale=self.cfg.model.max_z, sample_mode = 'bilinear').to(self.device))
+
+    def _build_flame(self):
+        self.flame = FLAME(self.cfg.model, topology=self.topology, assets=subset(self._assets, 'flame/')).to(self.device)
+
+    def _build_flametex(self):
+        self.flametex = FLAMETex(self.cfg.model, assets=subset(self._assets, 'flametex/')).to(self.device)
+
+    def _load_pretrained(self, module, network):
+        ''' resume a network from the pretrained model
+        '''
         model_path = self.cfg.pretrained_modelpath
-        if os.path.exists(model_path):
-            print(f'trained model found. load {model_path}')
-            checkpoint = torch.load(model_path)
-            self.checkpoint = checkpoint
-            util.copy_state_dict(self.E_flame.state_dict(), checkpoint['E_flame'])
-            util.copy_state_dict(self.E_detail.state_dict(), checkpoint['E_detail'])
-            util.copy_state_dict(self.D_detail.state_dict(), checkpoint['D_detail'])
+        tensor_path = self.cfg.get('pretrained_tensorpath', '')
+        if checkpoint.is_converted(model_path, tensor_path):
+            # maps only this module
+            source = tensor_path
+            state_dict = checkpoint.load_modules(tensor_path, [module])[module]
+        elif os.path.exists(model_path):
+            source = model_path
+            # the whole checkpoint, kept until every enabled network got its weights
+            if 'checkpoint' not in self.__dict__:
+                self.checkpoint = torch.load(model_path)
+            state_dict = self.checkpoint[module]
+            if all(name in self._built or name == module for name in ['E_flame', 'E_detail', 'D_detail'] if self._enabled(name)):
+                del self.checkpoint
         else:
+            source = None
             print(f'please check model path: {model_path}')
             # exit()
-        # eval mode
-        self.E_flame.eval()
-        self.E_detail.eval()
-        self.D_detail.eval()
+        if source is not None:
+            if self._weights_source != source:
+                print(f'trained model found. load {source}')
+                self._weights_source = source
+            util.copy_state_dict(network.state_dict(), state_dict)
 
     def decompose_code(self, code, num_dict):
         ''' Convert a flattened parameter vector to a dictionary of parameters
@@ -123,7 +325,7 @@ class DECA(nn.Module):
         uv_z = uv_z*self.uv_face_eye_mask
         uv_detail_vertices = uv_coarse_vertices + uv_z*uv_coarse_normals + self.fixed_uv_dis[None,None,:,:]*uv_coarse_normals.detach()
         dense_vertices = uv_detail_vertices.permute(0,2,3,1).reshape([batch_size, -1, 3])
-        uv_detail_normals = util.vertex_normals(dense_vertices, self.render.dense_faces.expand(batch_size, -1, -1))
+        uv_detail_normals = self.render.dense_topology.vertex_normals(dense_vertices)
         uv_detail_normals = uv_detail_normals.reshape([batch_size, uv_coarse_vertices.shape[2], uv_coarse_vertices.shape[3], 3]).permute(0,3,1,2)
         uv_detail_normals = uv_detail_normals*self.uv_face_eye_mask + uv_coarse_normals*(1.-self.uv_face_eye_mask)
         return uv_detail_normals
@@ -135,35 +337,196 @@ class DECA(nn.Module):
         vis68 = (normals68[:,:,2:] < 0.1).float()
         return vis68
 
+    def _run(self, network, inputs):
+        ''' networks run in self.precision, their outputs are fp32 for FLAME and the renderer
+        '''
+        with inference.autocast(self.device, self.precision):
+            outputs = network(inputs)
+        return outputs.float()
+
     # @torch.no_grad()
+    def _grad_context(self):
+        ''' variants are inference views, no graph through the modules they share with their base
+        '''
+        return torch.no_grad() if self._base is not None else contextlib.nullcontext()
+
     def encode(self, images, use_detail=True):
-        if use_detail:
-            # use_detail is for training detail model, need to set coarse model as eval mode
-            with torch.no_grad():
-                parameters = self.E_flame(images)
-        else:
-            parameters = self.E_flame(images)
-        codedict = self.decompose_code(parameters, self.param_dict)
-        codedict['images'] = images
-        if use_detail:
-            detailcode = self.E_detail(images)
-            codedict['detail'] = detailcode
-        if self.cfg.model.jaw_type == 'euler':
-            posecode = codedict['pose']
-            euler_jaw_pose = posecode[:,3:].clone() # x for yaw (open mouth), y for pitch (left ang right), z for roll
-            posecode[:,3:] = batch_euler2axis(euler_jaw_pose)
-            codedict['pose'] = posecode
-            codedict['euler_jaw_pose'] = euler_jaw_pose  
+        with self._grad_context():
+            use_detail = use_detail and self.use_detail
+            if use_detail:
+                # use_detail is for training detail model, need to set coarse model as eval mode
+                with torch.no_grad():
+                    parameters = self._run(self.E_flame, images)
+            else:
+                parameters = self._run(self.E_flame, images)
+            codedict = self.decompose_code(parameters, self.param_dict)
+            codedict['images'] = images
+            if use_detail:
+                detailcode = self._run(self.E_detail, images)
+                codedict['detail'] = detailcode
+            if self.cfg.model.jaw_type == 'euler':
+                euler_jaw_pose = codedict['pose'][:,3:].clone() # x for yaw (open mouth), y for pitch (left ang right), z for roll
+                codedict['pose'] = torch.cat([codedict['pose'][:,:3], batch_euler2axis(euler_jaw_pose)], dim=1)
+                codedict['euler_jaw_pose'] = euler_jaw_pose
+            return codedict
+
+    def bind_identity(self, codedict):
+        ''' cache the FLAME identity of codedict['shape'], for animating the same faces with
+        many expressions/poses. decode uses codedict['identity'] instead of codedict['shape'] afterwards,
+        as long as codedict['shape'] keeps the bound values
+        '''
+        identity = self.flame.bind_identity(codedict['shape'])
+        identity['shape'] = codedict['shape'].detach().clone()
+        codedict['identity'] = identity
         return codedict
 
+    def _identity(self, codedict):
+        ''' the bound identity of codedict, None if there is none or codedict['shape'] changed since bind_identity
+        '''
+        identity = codedict.get('identity')
+        if identity is None:
+            return None
+        shape = codedict['shape']
+        if identity['shape'].shape != shape.shape or not torch.equal(identity['shape'], shape.detach()):
+            return None
+        return identity
+
+    def decode_landmarks(self, codedict):
+        ''' landmarks only, FLAME is evaluated on the landmark vertices and nothing is rendered
+        '''
+        with self._grad_context():
+            identity = self._identity(codedict)
+            if identity is not None:
+                landmarks2d, landmarks3d = self.flame.forward_landmarks(expression_params=codedict['exp'], pose_params=codedict['pose'], identity=identity)
+            else:
+                landmarks2d, landmarks3d = self.flame.forward_landmarks(shape_params=codedict['shape'], expression_params=codedict['exp'], pose_params=codedict['pose'])
+            landmarks3d_world = landmarks3d.clone()
+            landmarks2d = util.batch_orth_proj(landmarks2d, codedict['cam'])[:,:,:2]; landmarks2d[:,:,1:] = -landmarks2d[:,:,1:]
+            landmarks3d = util.batch_orth_proj(landmarks3d, codedict['cam']); landmarks3d[:,:,1:] = -landmarks3d[:,:,1:]
+            opdict = {
+                'landmarks2d': landmarks2d,
+                'landmarks3d': landmarks3d,
+                'landmarks3d_world': landmarks3d_world,
+            }
+            return opdict
+
+    def fit_landmarks(self, landmarks, codedict=None, **kwargs):
+        ''' refine shape/exp/pose/cam of a batch of faces against 68 2D landmarks, see fitting.LandmarkFitter
+        landmarks: [bz, 68, 2] or [bz, 68, 3], normalized to [-1,1] in the cropped image (TestData 'landmarks' where 'landmarks_valid')
+        codedict: initialization, e.g. from encode
+        '''
+        fitter = LandmarkFitter(self.flame, **kwargs)
+        return fitter.fit(landmarks, codedict)
+
+    def decode_memory(self, rendering=True, return_vis=True, use_detail=True, h=None, w=None):
+        ''' estimated peak memory of decode per sample, in bytes, by stage
+        counts of the float32 tensors alive at the peak of every stage, see demos/benchmark_decode.py for the check
+        against the measured peak
+        '''
+        use_detail = use_detail and self.use_detail
+        h = h or self.image_size; w = w or self.image_size
+        n_verts, n_faces = self.topology.num_verts, self.topology.num_faces
+        uv_pixels = self.uv_size*self.uv_size
+        # FLAME: shaped, pose corrective, posed, skinned, projected vertices and two normal sets (3 each),
+        # the 4x4 skinning transform and homogeneous coordinates per vertex, face normals for the vertex normals
+        flame_floats = n_verts*(7*3 + 16 + 4) + n_faces*3*3*2
+        # SRenderY.forward: 12 face attributes (uv, transformed normals, vertices, normals) and their parts,
+        # images from the rasterization: grid 2, albedo 3+3, pos mask 1, shading 3, image 3, normal image 3
+        render_floats = n_faces*3*12*2 + h*w*(_raster_floats(12) + 18)
+        # render_shape: 15 face attributes (color added), shading 3+3, shaded 3, masks 2, shape image 3+3, grid 2
+        shape_floats = n_faces*3*15*2 + h*w*(_raster_floats(15) + 19)
+        # D_detail peaks at its last upsampling (32 channels in, 16 out of the conv and the bn);
+        # displacement2normal: uv rasterization, coarse vertices and normals, displacement, detail vertices (3 terms),
+        # normals of the 2 triangles per uv pixel, detail normals
+        detail_floats = uv_pixels*max(32 + 16 + 16, _raster_floats(3) + 3 + 1 + 3*3 + 2*3*3 + 3)
+        # texture extraction: uv rasterization of the projected vertices, sampled image and blended texture
+        texture_floats = uv_pixels*(_raster_floats(3) + 3 + 3*2)
+        stages = {'flame': flame_floats*4, 'albedo': uv_pixels*3*4}
+        if rendering:
+            stages['render'] = render_floats*4
+        if use_detail:
+            stages['detail'] = detail_floats*4
+        if return_vis:
+            # shape images, with and without details, and the 2 landmark images
+            stages['vis'] = ((2 if use_detail else 1)*shape_floats + texture_floats + 2*h*w*3)*4
+        if torch.is_grad_enabled():
+            # activations kept for backward
+            stages = {key: value*3 for key, value in stages.items()}
+        return stages
+
+    def decode_memory_budget(self):
+        ''' bytes available to one decode call, None for no limit
+        cfg.model.decode_memory_budget in MB, 0: 80% of the free memory of a cuda device, no limit on cpu
+        memory cached by the allocator but not in use counts as free
+        '''
+        budget = self.cfg.model.get('decode_memory_budget', 0)
+        if budget > 0:
+            return budget*2**20
+        device = torch.device(self.device)
+        if device.type == 'cuda':
+            free, _ = torch.cuda.mem_get_info(device)
+            free += torch.cuda.memory_reserved(device) - torch.cuda.memory_allocated(device)
+            return free*0.8
+        return None
+
+    def decode_chunk_size(self, batch_size, rendering=True, return_vis=True, use_detail=True, h=None, w=None):
+        ''' largest chunk of the batch that fits into the memory budget, chunks of a batch have equal sizes
+        '''
+        budget = self.decode_memory_budget()
+        if budget is None:
+            return batch_size
+        per_sample = sum(self.decode_memory(rendering=rendering, return_vis=return_vis, use_detail=use_detail, h=h, w=w).values())
+        chunk_size = max(1, min(batch_size, int(budget//per_sample)))
+        n_chunks = (batch_size + chunk_size - 1)//chunk_size
+        chunk_size = (batch_size + n_chunks - 1)//n_chunks
+        if chunk_size != self._decode_chunk_size:
+            # logged when it changes
+            print(f'decode: chunks of {chunk_size} samples, {per_sample/2**20:.1f} MB per sample, budget {budget/2**20:.0f} MB')
+            self._decode_chunk_size = chunk_size
+        return chunk_size
+
     # @torch.no_grad()
     def decode(self, codedict, rendering=True, iddict=None, vis_lmk=True, return_vis=True, use_detail=True,
-                render_orig=False, original_image=None, tform=None):
+                render_orig=False, original_image=None, tform=None, vis_size=None):
+        ''' batch decoding, split into chunks that fit into the memory budget (see decode_chunk_size)
+        vis_size: size of the shape renderings in visdict, image_size if None.
+            Small previews (up to the sizes of cfg.model.lod_levels) are rendered with decimated meshes
+        '''
+        with self._grad_context():
+            return self._decode_chunks(codedict, rendering=rendering, iddict=iddict, vis_lmk=vis_lmk, return_vis=return_vis, use_detail=use_detail,
+                                       render_orig=render_orig, original_image=original_image, tform=tform, vis_size=vis_size)
+
+    def _decode_chunks(self, codedict, rendering=True, iddict=None, vis_lmk=True, return_vis=True, use_detail=True,
+                       render_orig=False, original_image=None, tform=None, vis_size=None):
+        batch_size = codedict['images'].shape[0]
+        h, w = original_image.shape[2:] if (return_vis and render_orig and original_image is not None and tform is not None) else (None, None)
+        chunk_size = self.decode_chunk_size(batch_size, rendering=rendering, return_vis=return_vis, use_detail=use_detail, h=h, w=w)
+        kwargs = {'rendering': rendering, 'vis_lmk': vis_lmk, 'return_vis': return_vis, 'use_detail': use_detail, 'render_orig': render_orig,
+                  'vis_size': vis_size}
+        if chunk_size >= batch_size:
+            return self._decode(codedict, iddict=iddict, original_image=original_image, tform=tform, **kwargs)
+        outputs = []
+        for start in range(0, batch_size, chunk_size):
+            end = start + chunk_size
+            outputs.append(self._decode(_batch_slice(codedict, batch_size, start, end), iddict=_batch_slice(iddict, batch_size, start, end),
+                                        original_image=_batch_slice(original_image, batch_size, start, end),
+                                        tform=_batch_slice(tform, batch_size, start, end), **kwargs))
+        if return_vis:
+            return _batch_cat([opdict for opdict, _ in outputs]), _batch_cat([visdict for _, visdict in outputs])
+        return _batch_cat(outputs)
+
+    def _decode(self, codedict, rendering=True, iddict=None, vis_lmk=True, return_vis=True, use_detail=True,
+                render_orig=False, original_image=None, tform=None, vis_size=None):
+        use_detail = use_detail and self.use_detail
         images = codedict['images']
         batch_size = images.shape[0]
         
         ## decode
-        verts, landmarks2d, landmarks3d = self.flame(shape_params=codedict['shape'], expression_params=codedict['exp'], pose_params=codedict['pose'])
+        identity = self._identity(codedict)
+        if identity is not None:
+            verts, landmarks2d, landmarks3d = self.flame(expression_params=codedict['exp'], pose_params=codedict['pose'], identity=identity)
+        else:
+            verts, landmarks2d, landmarks3d = self.flame(shape_params=codedict['shape'], expression_params=codedict['exp'], pose_params=codedict['pose'])
         if self.cfg.model.use_tex:
             albedo = self.flametex(codedict['tex'])
         else:
@@ -192,9 +555,11 @@ class DECA(nn.Module):
             landmarks3d = transform_points(landmarks3d, tform, points_scale, [h, w])
             background = original_image
             images = original_image
+            vis_h, vis_w = h, w
         else:
             h, w = self.image_size, self.image_size
             background = None
+            vis_h = vis_w = vis_size or self.image_size
 
         if rendering:
             # ops = self.render(verts, trans_verts, albedo, codedict['light'])
@@ -204,20 +569,20 @@ class DECA(nn.Module):
             opdict['rendered_images'] = ops['images']
             opdict['alpha_images'] = ops['alpha_images']
             opdict['normal_images'] = ops['normal_images']
+            opdict['normals'] = ops['normals']
         
         if self.cfg.model.use_tex:
             opdict['albedo'] = albedo
             
         if use_detail:
-            uv_z = self.D_detail(torch.cat([codedict['pose'][:,3:], codedict['exp'], codedict['detail']], dim=1))
+            uv_z = self._run(self.D_detail, torch.cat([codedict['pose'][:,3:], codedict['exp'], codedict['detail']], dim=1))
             if iddict is not None:
-                uv_z = self.D_detail(torch.cat([iddict['pose'][:,3:], iddict['exp'], codedict['detail']], dim=1))
+                uv_z = self._run(self.D_detail, torch.cat([iddict['pose'][:,3:], iddict['exp'], codedict['detail']], dim=1))
             uv_detail_normals = self.displacement2normal(uv_z, verts, ops['normals'])
             uv_shading = self.render.add_SHlight(uv_detail_normals, codedict['light'])
             uv_texture = albedo*uv_shading
 
             opdict['uv_texture'] = uv_texture 
-            opdict['normals'] = ops['normals']
             opdict['uv_detail_normals'] = uv_detail_normals
             opdict['displacement_map'] = uv_z+self.fixed_uv_dis[None,None,:,:]
         
@@ -228,9 +593,12 @@ class DECA(nn.Module):
 
         if return_vis:
             ## render shape
-            shape_images, _, grid, alpha_images = self.render.render_shape(verts, trans_verts, h=h, w=w, images=background, return_grid=True)
-            detail_normal_images = F.grid_sample(uv_detail_normals, grid, align_corners=False)*alpha_images
-            shape_detail_images = self.render.render_shape(verts, trans_verts, detail_normal_images=detail_normal_images, h=h, w=w, images=background)
+            shape_images, _, grid, alpha_images = self.render.render_shape(verts, trans_verts, h=vis_h, w=vis_w, images=background, return_grid=True)
+            if use_detail:
+                detail_normal_images = F.grid_sample(uv_detail_normals, grid, align_corners=False)*alpha_images
+                shape_detail_images = self.render.render_shape(verts, trans_verts, detail_normal_images=detail_normal_images, h=vis_h, w=vis_w, images=background)
+            else:
+                uv_texture = albedo
             
             ## extract texture
             ## TODO: current resolution 256x256, support higher resolution, and add visibility
@@ -251,8 +619,9 @@ class DECA(nn.Module):
                 'landmarks2d': util.tensor_vis_landmarks(images, landmarks2d),
                 'landmarks3d': util.tensor_vis_landmarks(images, landmarks3d),
                 'shape_images': shape_images,
-                'shape_detail_images': shape_detail_images
             }
+            if use_detail:
+                visdict['shape_detail_images'] = shape_detail_images
             if self.cfg.model.use_tex:
                 visdict['rendered_images'] = ops['images']
 
@@ -266,49 +635,112 @@ class DECA(nn.Module):
         image range should be [0,1]
         dim: 2 for horizontal. 1 for vertical
         '''
-        assert dim == 1 or dim==2
-        grids = {}
-        for key in visdict:
-            _,_,h,w = visdict[key].shape
-            if dim == 2:
-                new_h = size; new_w = int(w*size/h)
-            elif dim == 1:
-                new_h = int(h*size/w); new_w = size
-            grids[key] = torchvision.utils.make_grid(F.interpolate(visdict[key], [new_h, new_w]).detach().cpu())
-        grid = torch.cat(list(grids.values()), dim)
-        grid_image = (grid.numpy().transpose(1,2,0).copy()*255)[:,:,[2,1,0]]
-        grid_image = np.minimum(np.maximum(grid_image, 0), 255).astype(np.uint8)
-        return grid_image
+        return util.tensor2grid(visdict, size=size, dim=dim)
     
+    def _dense_meshes(self, opdict, n):
+        ''' detail meshes of the first n samples, upsampled at once on the device, as numpy
+        '''
+        dense_vertices, dense_colors = self.dense_mesh(opdict['verts'][:n], opdict['normals'][:n], opdict['displacement_map'][:n], opdict['uv_texture_gt'][:n])
+        dense_vertices = dense_vertices.cpu().numpy()
+        dense_colors = (dense_colors*255.).clamp(0, 255).to(torch.uint8).cpu().numpy()
+        dense_faces = self.dense_mesh.faces.cpu().numpy()
+        return dense_vertices, dense_colors, dense_faces
+
     def save_obj(self, filename, opdict):
         '''
+        filename: path of the mesh of the first sample, or a list with one path per sample
         vertices: [nv, 3], tensor
         texture: [3, h, w], tensor
         '''
-        i = 0
-        vertices = opdict['verts'][i].cpu().numpy()
-        faces = self.render.faces[0].cpu().numpy()
-        texture = util.tensor2image(opdict['uv_texture_gt'][i])
-        uvcoords = self.render.raw_uvcoords[0].cpu().numpy()
-        uvfaces = self.render.uvfaces[0].cpu().numpy()
-        # save coarse mesh, with texture and normal map
-        normal_map = util.tensor2image(opdict['uv_detail_normals'][i]*0.5 + 0.5)
-        util.write_obj(filename, vertices, faces, 
-                        texture=texture, 
-                        uvcoords=uvcoords, 
-                        uvfaces=uvfaces, 
-                        normal_map=normal_map)
-        # upsample mesh, save detailed mesh
-        texture = texture[:,:,[2,1,0]]
-        normals = opdict['normals'][i].cpu().numpy()
-        displacement_map = opdict['displacement_map'][i].cpu().numpy().squeeze()
-        dense_vertices, dense_colors, dense_faces = util.upsample_mesh(vertices, normals, faces, displacement_map, texture, self.dense_template)
-        util.write_obj(filename.replace('.obj', '_detail.obj'), 
-                        dense_vertices, 
-                        dense_faces,
-                        colors = dense_colors,
-                        inverse_face_order=True)
+        filenames = [filename] if isinstance(filename, str) else filename
+        n = len(filenames)
+        # coarse-only decoding (use_detail off): the coarse mesh without normal map, no detail mesh
+        detail = 'displacement_map' in opdict
+        if detail:
+            dense_vertices, dense_colors, dense_faces = self._dense_meshes(opdict, n)
+        faces = self.topology.faces.cpu().numpy()
+        uvcoords = self.topology.uvcoords.cpu().numpy()
+        uvfaces = self.topology.uvfaces.cpu().numpy()
+        vertices = opdict['verts'][:n].cpu().numpy()
+        for i, filename in enumerate(filenames):
+            # save coarse mesh, with texture and normal map
+            texture = util.tensor2image(opdict['uv_texture_gt'][i])
+            normal_map = util.tensor2image(opdict['uv_detail_normals'][i]*0.5 + 0.5) if detail else None
+            util.write_obj(filename, vertices[i], faces, 
+                            texture=texture, 
+                            uvcoords=uvcoords, 
+                            uvfaces=uvfaces, 
+                            normal_map=normal_map)
+            if not detail:
+                continue
+            # save detailed mesh
+            util.write_obj(filename.replace('.obj', '_detail.obj'), 
+                            dense_vertices[i], 
+                            dense_faces,
+                            colors = dense_colors[i],
+                            inverse_face_order=True)
     
+    def save_glb(self, filename, opdict, quantize=False):
+        '''
+        one binary glTF per mesh instead of obj + mtl + pngs, for viewers and transfer
+        filename: path of the mesh of the first sample, or a list with one path per sample
+        the coarse mesh embeds texture and normal map, the detail mesh (_detail.glb) has vertex colors
+        coarse-only decoding (use_detail off) writes the coarse mesh without normal map, and no detail mesh
+        quantize: int16 positions and int8 normals
+        '''
+        filenames = [filename] if isinstance(filename, str) else filename
+        n = len(filenames)
+        detail = 'displacement_map' in opdict
+        if detail:
+            dense_vertices, dense_colors, dense_faces = self._dense_meshes(opdict, n)
+        faces = self.topology.faces.cpu().numpy()
+        uvcoords = self.topology.uvcoords.cpu().numpy()
+        uvfaces = self.topology.uvfaces.cpu().numpy()
+        vertices = opdict['verts'][:n].cpu().numpy()
+        if 'normals' in opdict:
+            normals = opdict['normals'][:n].cpu().numpy()
+        else:
+            # decoded without rendering
+            normals = self.topology.vertex_normals(opdict['verts'][:n]).cpu().numpy()
+        for i, filename in enumerate(filenames):
+            util.write_glb(filename, vertices[i], faces,
+                           normals=normals[i],
+                           texture=util.tensor2image(opdict['uv_texture_gt'][i]),
+                           uvcoords=uvcoords,
+                           uvfaces=uvfaces,
+                           normal_map=util.tensor2image(opdict['uv_detail_normals'][i]*0.5 + 0.5) if detail else None,
+                           quantize=quantize)
+            if not detail:
+                continue
+            # same face order as the _detail.obj
+            util.write_glb(filename.replace('.glb', '_detail.glb'), dense_vertices[i], dense_faces,
+                           colors=dense_colors[i],
+                           quantize=quantize)
+
+    def save_rig(self, filename, codedict, i=0, dtype=np.float16):
+        ''' blendshape rig of the identity of codedict['shape'][i], for animation without FLAME, see utils/rig.py
+        '''
+        flame_rig = self.flame.rig(codedict['shape'][i:i+1])
+        rig.save_rig(filename,
+                     flame_rig['vertices'][0].cpu().numpy(),
+                     flame_rig['basis'][0].cpu().numpy(),
+                     flame_rig['root'][0].cpu().numpy(),
+                     self.flame.faces_tensor.cpu().numpy(),
+                     dtype=dtype)
+
+    def infer(self, images, use_detail=True, rendering=True, return_vis=False):
+        ''' encode and decode without gradients, re-entrant: one DECA can serve several threads.
+        The inputs and the model are not written to, components are created under a lock.
+        Returns: codedict, opdict (and visdict if return_vis)
+        '''
+        with torch.no_grad():
+            codedict = self.encode(images, use_detail=use_detail)
+            outputs = self.decode(codedict, rendering=rendering, return_vis=return_vis, use_detail=use_detail)
+        if return_vis:
+            opdict, visdict = outputs
+            return codedict, opdict, visdict
+        return codedict, outputs
+
     def run(self, imagepath, iscrop=True):
         ''' An api for running deca given an image path
         '''
@@ -318,7 +750,82 @@ class DECA(nn.Module):
         opdict, visdict = self.decode(codedict)
         return codedict, opdict, visdict
 
+    def quantize(self, calibration, backend='fbgemm'):
+        ''' replace the encoders by int8 copies for cpu inference, see utils/quantization.py
+        calibration: list of image batches, e.g. quantization.calibration_batches(inputpath)
+        '''
+        if torch.device(self.device).type != 'cpu':
+            raise ValueError('the quantized encoders run on cpu only')
+        self.quantization_backend = backend
+        for name in ['E_flame', 'E_detail']:
+            if self._enabled(name):
+                setattr(self, name, quantization.quantize_encoder(getattr(self, name), calibration, backend=backend, image_size=self.image_size))
+        return self
+
+    def save_quantized(self, filename):
+        ''' quantized encoders, loaded by DECA when cfg.quantized_modelpath is filename
+        '''
+        quantized_dict = {name: getattr(self, name).state_dict() for name in ['E_flame', 'E_detail'] if self._enabled(name)}
+        quantized_dict['backend'] = self.quantization_backend
+        torch.save(quantized_dict, filename)
+
+    def optimize_for_inference(self, channels_last=True, jit=True):
+        ''' replace the encoders and the detail generator by inference copies, see utils/inference.py:
+        batchnorm folded into the convs, channels-last, traced and frozen (conv + activation fusion).
+        The networks cannot be trained or saved with model_dict afterwards.
+        '''
+        images = torch.randn(1, 3, self.image_size, self.image_size, device=self.device)
+        example_inputs = {'E_flame': images, 'E_detail': images,
+                          'D_detail': torch.randn(1, self.n_detail+self.n_cond, device=self.device)}
+        for name in ['E_flame', 'E_detail', 'D_detail']:
+            if not self._enabled(name):
+                continue
+            setattr(self, name, inference.optimize_module(getattr(self, name), example_inputs[name], channels_last=channels_last, jit=jit))
+        return self
+
+    def graphs(self, batch_size=1):
+        ''' tensor-only forwards of the encoders, the detail generator and FLAME, see utils/export.py
+        Returns: name -> (module, example inputs, input names, output names)
+        '''
+        images = torch.randn(batch_size, 3, self.image_size, self.image_size, device=self.device)
+        codes = {key: torch.zeros(batch_size, self.param_dict[key], device=self.device) for key in ['shape', 'exp', 'pose']}
+        graphs = {
+            'E_flame': (export.CoarseEncoderGraph(self.E_flame, self.param_dict, self.cfg.model.jaw_type), (images,), ['images'], list(self.param_dict)),
+            'FLAME': (export.FLAMEGraph(self.flame), (codes['shape'], codes['exp'], codes['pose']), ['shape', 'exp', 'pose'], ['vertices', 'landmarks2d', 'landmarks3d']),
+        }
+        if self.use_detail:
+            detail = torch.zeros(batch_size, self.n_detail, device=self.device)
+            graphs['E_detail'] = (self.E_detail, (images,), ['images'], ['detail'])
+            graphs['D_detail'] = (export.DetailDecoderGraph(self.D_detail), (codes['pose'], codes['exp'], detail), ['pose', 'exp', 'detail'], ['displacement'])
+        return graphs
+
+    def export_graphs(self, savefolder, formats=['torchscript', 'onnx']):
+        ''' write every graph as savefolder/<name>.pt (TorchScript) and/or savefolder/<name>.onnx
+        Returns: name -> {format: path}
+        '''
+        os.makedirs(savefolder, exist_ok=True)
+        paths = {}
+        for name, (graph, example_inputs, input_names, output_names) in self.graphs().items():
+            paths[name] = {}
+            if 'torchscript' in formats:
+                paths[name]['torchscript'] = os.path.join(savefolder, name + '.pt')
+                export.export_torchscript(graph, example_inputs, paths[name]['torchscript'])
+            if 'onnx' in formats:
+                paths[name]['onnx'] = os.path.join(savefolder, name + '.onnx')
+                export.export_onnx(graph, example_inputs, paths[name]['onnx'], input_names, output_names)
+        return paths
+
+    def compile_for_inference(self, mode='default', dynamic=True):
+        ''' torch.compile the encoders, the detail generator and FLAME, encode and decode then run the compiled modules
+        '''
+        for name in ['E_flame', 'E_detail', 'D_detail', 'flame']:
+            if self._enabled(name):
+                setattr(self, name, torch.compile(getattr(self, name), mode=mode, dynamic=dynamic))
+        return self
+
     def model_dict(self):
+        if not self.use_detail:
+            return {'E_flame': self.E_flame.state_dict()}
         return {
             'E_flame': self.E_flame.state_dict(),
             'E_detail': self.E_detail.state_dict(),
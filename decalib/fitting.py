@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+from time import time
+import torch
+
+from .utils import util
+
+def landmark_weights(device='cpu'):
+    ''' weights of the 68 landmarks, same as lossfunc.weighted_landmark_loss
+    '''
+    weights = torch.ones((68,), device=device)
+    weights[5:7] = 2
+    weights[10:12] = 2
+    # nose points
+    weights[27:36] = 1.5
+    weights[30] = 3
+    weights[31] = 3
+    weights[35] = 3
+    # inner mouth
+    weights[60:68] = 1.5
+    weights[48:60] = 1.5
+    weights[48] = 3
+    weights[54] = 3
+    return weights
+
+class LandmarkFitter(object):
+    ''' Refines FLAME codes of many faces at once against 68 2D landmarks
+    All faces are optimized in one batch with Adam. The loss of each face only depends on its own codes
+    and Adam updates every element independently, so the batch behaves like separate per-face solves.
+    A face stops updating once its relative loss change is below tol, the whole solve stops when
+    every face converged or after n_iters.
+    Only the landmark vertices are skinned (FLAME.forward_landmarks), which keeps it fast on cpu.
+    '''
+    def __init__(self, flame, n_iters=200, lr=0.01, tol=1e-5, reg_shape=1e-4, reg_exp=1e-4, reg_jaw_pose=0.,
+                 params=['shape', 'exp', 'pose', 'cam']):
+        self.flame = flame
+        self.n_iters = n_iters
+        self.lr = lr
+        self.tol = tol
+        self.reg_shape = reg_shape
+        self.reg_exp = reg_exp
+        self.reg_jaw_pose = reg_jaw_pose
+        self.params = params
+
+    def project(self, codedict):
+        landmarks2d, _ = self.flame.forward_landmarks(shape_params=codedict['shape'], expression_params=codedict['exp'], pose_params=codedict['pose'])
+        landmarks2d = util.batch_orth_proj(landmarks2d, codedict['cam'])[:,:,:2]
+        landmarks2d = torch.cat([landmarks2d[:,:,:1], -landmarks2d[:,:,1:]], dim=2)
+        return landmarks2d
+
+    def losses(self, codedict, landmarks, weights):
+        ''' per face loss, [bz]
+        '''
+        predicted_landmarks = self.project(codedict)
+        error = ((predicted_landmarks - landmarks[:,:,:2])**2).sum(-1)
+        losses = (error*weights).sum(1)/weights.sum(1)
+        losses = losses + self.reg_shape*(codedict['shape']**2).sum(1) + self.reg_exp*(codedict['exp']**2).sum(1)
+        losses = losses + self.reg_jaw_pose*(codedict['pose'][:,3:]**2).sum(1)
+        return losses
+
+    def fit(self, landmarks, codedict=None):
+        '''
+        landmarks: [bz, 68, 2] in the cropped image, normalized to [-1,1] like opdict['landmarks2d'],
+            or [bz, 68, 3] with a confidence per landmark
+        codedict: initial codes, e.g. from DECA.encode. FLAME mean face in front of the camera if None
+        Returns:
+            codedict: fitted codes (new tensors, the input codedict is not modified)
+            stats: per face 'loss', 'error' (mean landmark distance, normalized units),
+                'n_iters' and 'converged', plus 'time' of the whole solve
+        '''
+        start = time()
+        device = landmarks.device
+        batch_size = landmarks.shape[0]
+        n_shape = self.flame.n_shape; n_exp = self.flame.shapedirs.shape[-1] - n_shape
+        if codedict is None:
+            codedict = {
+                'shape': torch.zeros([batch_size, n_shape], device=device),
+                'exp': torch.zeros([batch_size, n_exp], device=device),
+                'pose': torch.zeros([batch_size, 6], device=device),
+                'cam': torch.tensor([8., 0., 0.], device=device)[None,:].repeat(batch_size, 1),
+            }
+        weights = landmark_weights(device)[None,:].expand(batch_size, -1)
+        if landmarks.shape[-1] == 3:
+            weights = weights*landmarks[:,:,2]
+
+        variables = {}
+        for key in ['shape', 'exp', 'pose', 'cam']:
+            variables[key] = codedict[key].detach().clone().requires_grad_(key in self.params)
+        optimizer = torch.optim.Adam([variables[key] for key in self.params], lr=self.lr)
+
+        converged = torch.zeros(batch_size, dtype=torch.bool, device=device)
+        n_iters = torch.full([batch_size], self.n_iters, dtype=torch.long, device=device)
+        prev_losses = None
+        with torch.enable_grad():
+            for i in range(self.n_iters):
+                optimizer.zero_grad()
+                losses = self.losses(variables, landmarks, weights)
+                losses.sum().backward()
+                # converged faces keep their codes: Adam momentum would still move them, so they are restored after the step
+                active = ~converged[:,None]
+                previous = {key: variables[key].detach().clone() for key in self.params}
+                optimizer.step()
+                with torch.no_grad():
+                    for key in self.params:
+                        variables[key].copy_(torch.where(active, variables[key], previous[key]))
+
+                losses = losses.detach()
+                if prev_losses is not None:
+                    newly_converged = ~converged & ((prev_losses - losses).abs() <= self.tol*prev_losses.clamp(min=1e-12))
+                    n_iters[newly_converged] = i + 1
+                    converged = converged | newly_converged
+                    if bool(converged.all()):
+                        break
+                prev_losses = losses
+        with torch.no_grad():
+            losses = self.losses(variables, landmarks, weights)
+            error = (self.project(variables) - landmarks[:,:,:2]).norm(dim=-1).mean(1)
+
+        fitted_codedict = {key: codedict[key] for key in codedict}
+        for key in ['shape', 'exp', 'pose', 'cam']:
+            fitted_codedict[key] = variables[key].detach()
+        stats = {
+            'loss': losses,
+            'error': error,
+            'n_iters': n_iters,
+            'converged': converged,
+            'time': time() - start,
+        }
+        return fitted_codedict, stats
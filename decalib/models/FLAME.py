@@ -19,7 +19,8 @@ import numpy as np
 import pickle
 import torch.nn.functional as F
 
-from .lbs import lbs, batch_rodrigues, vertices2landmarks, rot_mat_to_euler
+from .lbs import lbs_shaped, blend_shapes, vertices2joints, batch_rodrigues, vertices2landmarks, rot_mat_to_euler
+from ..utils.topology import Topology
 
 def to_tensor(array, dtype=torch.float32):
     if 'torch.tensor' not in str(type(array)):
@@ -34,36 +35,70 @@ class Struct(object):
         for key, val in kwargs.items():
             setattr(self, key, val)
 
+def load_flame_assets(config):
+    """ FLAME model and landmark embedding as numpy arrays in their final dtype,
+        the shape and expression components already cut to n_shape and n_exp
+    """
+    with open(config.flame_model_path, 'rb') as f:
+        ss = pickle.load(f, encoding='latin1')
+        flame_model = Struct(**ss)
+    shapedirs = to_np(flame_model.shapedirs)
+    num_pose_basis = flame_model.posedirs.shape[-1]
+    parents = to_np(flame_model.kintree_table[0], dtype=np.int64); parents[0] = -1
+    lmk_embeddings = np.load(config.flame_lmk_embedding_path, allow_pickle=True, encoding='latin1')
+    lmk_embeddings = lmk_embeddings[()]
+    return {
+        'v_template': to_np(flame_model.v_template),
+        'faces': to_np(flame_model.f, dtype=np.int64),
+        'shapedirs': np.concatenate([shapedirs[:,:,:config.n_shape], shapedirs[:,:,300:300+config.n_exp]], 2),
+        'posedirs': to_np(np.reshape(flame_model.posedirs, [-1, num_pose_basis]).T),
+        'J_regressor': to_np(flame_model.J_regressor),
+        'parents': parents,
+        'lbs_weights': to_np(flame_model.weights),
+        'lmk_faces_idx': to_np(lmk_embeddings['static_lmk_faces_idx'], dtype=np.int64),
+        'lmk_bary_coords': to_np(lmk_embeddings['static_lmk_bary_coords']),
+        'dynamic_lmk_faces_idx': to_np(lmk_embeddings['dynamic_lmk_faces_idx'], dtype=np.int64),
+        'dynamic_lmk_bary_coords': to_np(lmk_embeddings['dynamic_lmk_bary_coords']),
+        'full_lmk_faces_idx': to_np(lmk_embeddings['full_lmk_faces_idx'], dtype=np.int64),
+        'full_lmk_bary_coords': to_np(lmk_embeddings['full_lmk_bary_coords']),
+    }
+
 class FLAME(nn.Module):
     """
     borrowed from https://github.com/soubhiksanyal/FLAME_PyTorch/blob/master/FLAME.py
     Given flame parameters this class generates a differentiable FLAME function
     which outputs the a mesh and 2D/3D facial landmarks
     """
-    def __init__(self, config):
+    def __init__(self, config, topology=None, assets=None):
         super(FLAME, self).__init__()
         print("creating the FLAME Decoder")
-        with open(config.flame_model_path, 'rb') as f:
-            ss = pickle.load(f, encoding='latin1')
-            flame_model = Struct(**ss)
+        # numpy arrays of load_flame_assets, e.g. mapped from the compiled asset bundle
+        if assets is None:
+            assets = load_flame_assets(config)
+        asset = lambda key, dtype=torch.float32: torch.as_tensor(assets[key], dtype=dtype)
 
         self.dtype = torch.float32
-        self.register_buffer('faces_tensor', to_tensor(to_np(flame_model.f, dtype=np.int64), dtype=torch.long))
         # The vertices of the template model
-        self.register_buffer('v_template', to_tensor(to_np(flame_model.v_template), dtype=self.dtype))
+        self.register_buffer('v_template', asset('v_template'))
+        # faces, shared with the renderer if the given topology is the same mesh
+        faces = asset('faces', dtype=torch.long)
+        if topology is None or not torch.equal(topology.faces.cpu(), faces):
+            if topology is not None:
+                print('the given topology differs from the FLAME faces, use the FLAME faces')
+            topology = Topology(faces, num_verts=self.v_template.shape[0])
+        self.topology = topology
         # The shape components and expression
-        shapedirs = to_tensor(to_np(flame_model.shapedirs), dtype=self.dtype)
-        shapedirs = torch.cat([shapedirs[:,:,:config.n_shape], shapedirs[:,:,300:300+config.n_exp]], 2)
-        self.register_buffer('shapedirs', shapedirs)
+        self.register_buffer('shapedirs', asset('shapedirs'))
         # The pose components
-        num_pose_basis = flame_model.posedirs.shape[-1]
-        posedirs = np.reshape(flame_model.posedirs, [-1, num_pose_basis]).T
-        self.register_buffer('posedirs', to_tensor(to_np(posedirs), dtype=self.dtype))
+        self.register_buffer('posedirs', asset('posedirs'))
         # 
-        self.register_buffer('J_regressor', to_tensor(to_np(flame_model.J_regressor), dtype=self.dtype))
-        parents = to_tensor(to_np(flame_model.kintree_table[0])).long(); parents[0] = -1
-        self.register_buffer('parents', parents)
-        self.register_buffer('lbs_weights', to_tensor(to_np(flame_model.weights), dtype=self.dtype))
+        self.register_buffer('J_regressor', asset('J_regressor'))
+        # precomposed joint regression, joints come straight from the betas
+        self.n_shape = config.n_shape
+        self.register_buffer('J_template', vertices2joints(self.J_regressor, self.v_template[None])[0])
+        self.register_buffer('J_shapedirs', torch.einsum('ji,ikl->jkl', [self.J_regressor, self.shapedirs]))
+        self.register_buffer('parents', asset('parents', dtype=torch.long))
+        self.register_buffer('lbs_weights', asset('lbs_weights'))
 
         # Fixing Eyeball and neck rotation
         default_eyball_pose = torch.zeros([1, 6], dtype=self.dtype, requires_grad=False)
@@ -74,14 +109,12 @@ class FLAME(nn.Module):
                                                           requires_grad=False))
 
         # Static and Dynamic Landmark embeddings for FLAME
-        lmk_embeddings = np.load(config.flame_lmk_embedding_path, allow_pickle=True, encoding='latin1')
-        lmk_embeddings = lmk_embeddings[()]
-        self.register_buffer('lmk_faces_idx', torch.from_numpy(lmk_embeddings['static_lmk_faces_idx']).long())
-        self.register_buffer('lmk_bary_coords', torch.from_numpy(lmk_embeddings['static_lmk_bary_coords']).to(self.dtype))
-        self.register_buffer('dynamic_lmk_faces_idx', lmk_embeddings['dynamic_lmk_faces_idx'].long())
-        self.register_buffer('dynamic_lmk_bary_coords', lmk_embeddings['dynamic_lmk_bary_coords'].to(self.dtype))
-        self.register_buffer('full_lmk_faces_idx', torch.from_numpy(lmk_embeddings['full_lmk_faces_idx']).long())
-        self.register_buffer('full_lmk_bary_coords', torch.from_numpy(lmk_embeddings['full_lmk_bary_coords']).to(self.dtype))
+        self.register_buffer('lmk_faces_idx', asset('lmk_faces_idx', dtype=torch.long))
+        self.register_buffer('lmk_bary_coords', asset('lmk_bary_coords'))
+        self.register_buffer('dynamic_lmk_faces_idx', asset('dynamic_lmk_faces_idx', dtype=torch.long))
+        self.register_buffer('dynamic_lmk_bary_coords', asset('dynamic_lmk_bary_coords'))
+        self.register_buffer('full_lmk_faces_idx', asset('full_lmk_faces_idx', dtype=torch.long))
+        self.register_buffer('full_lmk_bary_coords', asset('full_lmk_bary_coords'))
 
         neck_kin_chain = []; NECK_IDX=1
         curr_idx = torch.tensor(NECK_IDX, dtype=torch.long)
@@ -89,7 +122,30 @@ class FLAME(nn.Module):
             neck_kin_chain.append(curr_idx)
             curr_idx = self.parents[curr_idx]
         self.register_buffer('neck_kin_chain', torch.stack(neck_kin_chain))
+
+        # neck and eye poses are fixed at zero, only the jaw rotation drives the pose correctives
+        # posedirs rows are [neck, jaw, left eye, right eye] x 9
+        JAW_IDX = 2
+        self.jaw_pose_joints = [JAW_IDX-1]
+        self.register_buffer('posedirs_jaw', self.posedirs.view(self.parents.shape[0]-1, 9, -1)[JAW_IDX-1])
+
+        # the vertices used by any landmark, for evaluating landmarks only (see forward_landmarks)
+        num_verts = self.v_template.shape[0]
+        lmk_faces = torch.cat([self.lmk_faces_idx.view(-1), self.dynamic_lmk_faces_idx.view(-1), self.full_lmk_faces_idx.view(-1)])
+        lmk_verts_idx = torch.unique(self.faces_tensor[lmk_faces])
+        vertex_map = torch.zeros(num_verts, dtype=torch.long); vertex_map[lmk_verts_idx] = torch.arange(lmk_verts_idx.shape[0])
+        self.register_buffer('lmk_verts_idx', lmk_verts_idx)
+        # faces indexing the landmark vertices, only valid for the landmark faces
+        self.register_buffer('lmk_faces', vertex_map[self.faces_tensor])
+        self.register_buffer('lmk_v_template', self.v_template[lmk_verts_idx])
+        self.register_buffer('lmk_shapedirs', self.shapedirs[lmk_verts_idx])
+        self.register_buffer('lmk_posedirs_jaw', self.posedirs_jaw.view(9, num_verts, 3)[:, lmk_verts_idx].reshape(9, -1))
+        self.register_buffer('lmk_lbs_weights', self.lbs_weights[lmk_verts_idx])
         
+    @property
+    def faces_tensor(self):
+        return self.topology.faces
+
     def _find_dynamic_lmk_idx_and_bcoords(self, pose, dynamic_lmk_faces_idx,
                                           dynamic_lmk_b_coords,
                                           neck_kin_chain, dtype=torch.float32):
@@ -172,30 +228,89 @@ class FLAME(nn.Module):
                                        self.full_lmk_bary_coords.repeat(vertices.shape[0], 1, 1))
         return landmarks3d
 
-    def forward(self, shape_params=None, expression_params=None, pose_params=None, eye_pose_params=None):
+    def bind_identity(self, shape_params):
         """
+            Precomputes the shaped template and its joints for fixed identities,
+            so that animating them only evaluates the expression, pose correctives and skinning
             Input:
                 shape_params: N X number of shape parameters
-                expression_params: N X number of expression parameters
-                pose_params: N X number of pose parameters (6)
-            return:d
-                vertices: N X V X 3
-                landmarks: N X number of landmarks X 3
+            return:
+                identity: dict, pass it to forward instead of shape_params,
+                    with N=1 it is shared by every frame in the batch
         """
-        batch_size = shape_params.shape[0]
+        v_shaped = self.v_template + blend_shapes(shape_params, self.shapedirs[:,:,:self.n_shape])
+        joints = vertices2joints(self.J_regressor, v_shaped)
+        return {'v_shaped': v_shaped, 'joints': joints}
+
+    def rig(self, shape_params):
+        """
+            Linearized blendshape rig of fixed identities, see utils/rig.py
+            Input:
+                shape_params: N X number of shape parameters
+            return:
+                rig: dict with
+                    vertices: N X V X 3, neutral mesh
+                    basis: N X (V * 3) X (number of expression parameters + 9),
+                        expression blend shapes, then the jaw skinning and pose correctives per entry of R_jaw - I
+                    root: N X 3, root joint
+        """
+        JAW_IDX = 2
+        identity = self.bind_identity(shape_params)
+        v_shaped, joints = identity['v_shaped'], identity['joints']
+        batch_size, num_verts = v_shaped.shape[:2]
+        exp_basis = self.shapedirs[:,:,self.n_shape:].reshape(num_verts*3, -1).expand(batch_size, -1, -1)
+        # skinning: v + w_jaw * (R - I)(v - j), column a*3+b moves coordinate a by w_jaw * (v - j)_b
+        offsets = self.lbs_weights[None,:,JAW_IDX,None]*(v_shaped - joints[:,JAW_IDX:JAW_IDX+1])
+        skin_basis = torch.einsum('ac,bvd->bvacd', [torch.eye(3, dtype=self.dtype, device=v_shaped.device), offsets])
+        jaw_basis = skin_basis.reshape(batch_size, num_verts*3, 9) + self.posedirs_jaw.t()
+        return {
+            'vertices': v_shaped,
+            'basis': torch.cat([exp_basis, jaw_basis], dim=2),
+            'root': joints[:,0],
+        }
+
+    def save_numpy(self, filename):
+        """
+            Writes the buffers needed by the torch-free decoder (models/flame_numpy.py) as npz,
+            eye pose is fixed at zero so only the jaw pose correctives are kept
+        """
+        JAW_IDX = 2
+        to_numpy = lambda tensor: tensor.detach().cpu().numpy()
+        np.savez(filename,
+                 version=np.array(1),
+                 n_shape=np.array(self.n_shape),
+                 jaw_idx=np.array(JAW_IDX),
+                 v_template=to_numpy(self.v_template),
+                 shapedirs=to_numpy(self.shapedirs),
+                 posedirs_jaw=to_numpy(self.posedirs_jaw),
+                 J_template=to_numpy(self.J_template),
+                 J_shapedirs=to_numpy(self.J_shapedirs),
+                 parents=to_numpy(self.parents),
+                 lbs_weights=to_numpy(self.lbs_weights),
+                 faces=to_numpy(self.faces_tensor),
+                 lmk_faces_idx=to_numpy(self.lmk_faces_idx),
+                 lmk_bary_coords=to_numpy(self.lmk_bary_coords),
+                 dynamic_lmk_faces_idx=to_numpy(self.dynamic_lmk_faces_idx),
+                 dynamic_lmk_bary_coords=to_numpy(self.dynamic_lmk_bary_coords),
+                 full_lmk_faces_idx=to_numpy(self.full_lmk_faces_idx).reshape(-1),
+                 full_lmk_bary_coords=to_numpy(self.full_lmk_bary_coords).reshape(-1, 3),
+                 neck_kin_chain=to_numpy(self.neck_kin_chain))
+
+    def _full_pose(self, batch_size, pose_params=None, eye_pose_params=None):
         if pose_params is None:
             pose_params = self.eye_pose.expand(batch_size, -1)
         if eye_pose_params is None:
             eye_pose_params = self.eye_pose.expand(batch_size, -1)
-        betas = torch.cat([shape_params, expression_params], dim=1)
-        full_pose = torch.cat([pose_params[:, :3], self.neck_pose.expand(batch_size, -1), pose_params[:, 3:], eye_pose_params], dim=1)
-        template_vertices = self.v_template.unsqueeze(0).expand(batch_size, -1, -1)
+        return torch.cat([pose_params[:, :3], self.neck_pose.expand(batch_size, -1), pose_params[:, 3:], eye_pose_params], dim=1)
 
-        vertices, _ = lbs(betas, full_pose, template_vertices,
-                          self.shapedirs, self.posedirs,
-                          self.J_regressor, self.parents,
-                          self.lbs_weights, dtype=self.dtype)
+    def _joints(self, batch_size, shape_params=None, expression_params=None, identity=None):
+        if identity is not None:
+            return identity['joints'].expand(batch_size, -1, -1) + torch.einsum('bl,jkl->bjk', [expression_params, self.J_shapedirs[:,:,self.n_shape:]])
+        betas = torch.cat([shape_params, expression_params], dim=1)
+        return self.J_template + torch.einsum('bl,jkl->bjk', [betas, self.J_shapedirs])
 
+    def _landmarks(self, vertices, full_pose, faces):
+        batch_size = vertices.shape[0]
         lmk_faces_idx = self.lmk_faces_idx.unsqueeze(dim=0).expand(batch_size, -1)
         lmk_bary_coords = self.lmk_bary_coords.unsqueeze(dim=0).expand(batch_size, -1, -1)
         
@@ -206,15 +321,111 @@ class FLAME(nn.Module):
         lmk_faces_idx = torch.cat([dyn_lmk_faces_idx, lmk_faces_idx], 1)
         lmk_bary_coords = torch.cat([dyn_lmk_bary_coords, lmk_bary_coords], 1)
 
-        landmarks2d = vertices2landmarks(vertices, self.faces_tensor,
+        landmarks2d = vertices2landmarks(vertices, faces,
                                        lmk_faces_idx,
                                        lmk_bary_coords)
         bz = vertices.shape[0]
-        landmarks3d = vertices2landmarks(vertices, self.faces_tensor,
+        landmarks3d = vertices2landmarks(vertices, faces,
                                        self.full_lmk_faces_idx.repeat(bz, 1),
                                        self.full_lmk_bary_coords.repeat(bz, 1, 1))
+        return landmarks2d, landmarks3d
+
+    def forward(self, shape_params=None, expression_params=None, pose_params=None, eye_pose_params=None, identity=None):
+        """
+            Input:
+                shape_params: N X number of shape parameters
+                expression_params: N X number of expression parameters
+                pose_params: N X number of pose parameters (6)
+                identity: output of bind_identity, replaces shape_params
+            return:d
+                vertices: N X V X 3
+                landmarks: N X number of landmarks X 3
+        """
+        if identity is not None:
+            batch_size = expression_params.shape[0]
+        else:
+            batch_size = shape_params.shape[0]
+        full_pose = self._full_pose(batch_size, pose_params, eye_pose_params)
+
+        if identity is not None:
+            v_shaped = identity['v_shaped'].expand(batch_size, -1, -1) + blend_shapes(expression_params, self.shapedirs[:,:,self.n_shape:])
+        else:
+            betas = torch.cat([shape_params, expression_params], dim=1)
+            v_shaped = self.v_template + blend_shapes(betas, self.shapedirs)
+        joints = self._joints(batch_size, shape_params, expression_params, identity)
+        if eye_pose_params is None:
+            vertices, _ = lbs_shaped(v_shaped, joints, full_pose,
+                                     self.posedirs_jaw, self.parents,
+                                     self.lbs_weights, dtype=self.dtype,
+                                     active_joints=self.jaw_pose_joints)
+        else:
+            vertices, _ = lbs_shaped(v_shaped, joints, full_pose,
+                                     self.posedirs, self.parents,
+                                     self.lbs_weights, dtype=self.dtype)
+
+        landmarks2d, landmarks3d = self._landmarks(vertices, full_pose, self.faces_tensor)
         return vertices, landmarks2d, landmarks3d
 
+    def forward_landmarks(self, shape_params=None, expression_params=None, pose_params=None, identity=None):
+        """
+            Landmarks only: blend shapes and skinning are evaluated on the vertices
+            of the landmark faces (static, dynamic contour and full 68), not the whole mesh.
+            Eye pose is fixed at zero.
+            Input:
+                see forward
+            return:
+                landmarks2d: N X number of landmarks X 3
+                landmarks3d: N X 68 X 3
+        """
+        if identity is not None:
+            batch_size = expression_params.shape[0]
+        else:
+            batch_size = shape_params.shape[0]
+        full_pose = self._full_pose(batch_size, pose_params)
+
+        if identity is not None:
+            v_shaped = identity['v_shaped'][:, self.lmk_verts_idx].expand(batch_size, -1, -1) + \
+                            blend_shapes(expression_params, self.lmk_shapedirs[:,:,self.n_shape:])
+        else:
+            betas = torch.cat([shape_params, expression_params], dim=1)
+            v_shaped = self.lmk_v_template + blend_shapes(betas, self.lmk_shapedirs)
+        joints = self._joints(batch_size, shape_params, expression_params, identity)
+        vertices, _ = lbs_shaped(v_shaped, joints, full_pose,
+                                 self.lmk_posedirs_jaw, self.parents,
+                                 self.lmk_lbs_weights, dtype=self.dtype,
+                                 active_joints=self.jaw_pose_joints)
+        return self._landmarks(vertices, full_pose, self.lmk_faces)
+
+def load_flametex_assets(config):
+    """ texture space as float32 numpy arrays, texture_mean [1, 1, N], texture_basis [1, N, n_tex]
+    """
+    if config.tex_type == 'BFM':
+        mu_key = 'MU'
+        pc_key = 'PC'
+        n_pc = 199
+        tex_path = config.tex_path
+        tex_space = np.load(tex_path)
+        texture_mean = tex_space[mu_key].reshape(1, -1)
+        texture_basis = tex_space[pc_key].reshape(-1, n_pc)
+
+    elif config.tex_type == 'FLAME':
+        mu_key = 'mean'
+        pc_key = 'tex_dir'
+        n_pc = 200
+        tex_path = config.flame_tex_path
+        tex_space = np.load(tex_path)
+        texture_mean = tex_space[mu_key].reshape(1, -1)/255.
+        texture_basis = tex_space[pc_key].reshape(-1, n_pc)/255.
+    else:
+        print('texture type ', config.tex_type, 'not exist!')
+        raise NotImplementedError
+
+    n_tex = config.n_tex
+    return {
+        'texture_mean': texture_mean.astype(np.float32)[None,...],
+        'texture_basis': np.ascontiguousarray(texture_basis[:,:n_tex]).astype(np.float32)[None,...],
+    }
+
 class FLAMETex(nn.Module):
     """
     FLAME texture:
@@ -222,35 +433,12 @@ class FLAMETex(nn.Module):
     FLAME texture converted from BFM:
     https://github.com/TimoBolkart/BFM_to_FLAME
     """
-    def __init__(self, config):
+    def __init__(self, config, assets=None):
         super(FLAMETex, self).__init__()
-        if config.tex_type == 'BFM':
-            mu_key = 'MU'
-            pc_key = 'PC'
-            n_pc = 199
-            tex_path = config.tex_path
-            tex_space = np.load(tex_path)
-            texture_mean = tex_space[mu_key].reshape(1, -1)
-            texture_basis = tex_space[pc_key].reshape(-1, n_pc)
-
-        elif config.tex_type == 'FLAME':
-            mu_key = 'mean'
-            pc_key = 'tex_dir'
-            n_pc = 200
-            tex_path = config.flame_tex_path
-            tex_space = np.load(tex_path)
-            texture_mean = tex_space[mu_key].reshape(1, -1)/255.
-            texture_basis = tex_space[pc_key].reshape(-1, n_pc)/255.
-        else:
-            print('texture type ', config.tex_type, 'not exist!')
-            raise NotImplementedError
-
-        n_tex = config.n_tex
-        num_components = texture_basis.shape[1]
-        texture_mean = torch.from_numpy(texture_mean).float()[None,...]
-        texture_basis = torch.from_numpy(texture_basis[:,:n_tex]).float()[None,...]
-        self.register_buffer('texture_mean', texture_mean)
-        self.register_buffer('texture_basis', texture_basis)
+        if not assets:
+            assets = load_flametex_assets(config)
+        self.register_buffer('texture_mean', torch.as_tensor(assets['texture_mean']))
+        self.register_buffer('texture_basis', torch.as_tensor(assets['texture_basis']))
 
     def forward(self, texcode):
         '''
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+''' FLAME decoder in numpy, no torch and no FLAME pickle
+It reads the asset written by FLAME.save_numpy and reproduces FLAME.forward (eye pose at zero).
+'''
+import numpy as np
+
+from ..utils.rig import batch_rodrigues
+
+FLAME_NUMPY_VERSION = 1
+
+class FLAMENumpy(object):
+    def __init__(self, asset_path):
+        with np.load(asset_path) as data:
+            asset = {key: data[key] for key in data.files}
+        assert int(asset['version']) == FLAME_NUMPY_VERSION, f'unsupported FLAME asset version {int(asset["version"])}'
+        self.v_template = asset['v_template']
+        self.shapedirs = asset['shapedirs']
+        self.posedirs_jaw = asset['posedirs_jaw']
+        self.J_template = asset['J_template']
+        self.J_shapedirs = asset['J_shapedirs']
+        self.parents = asset['parents']
+        self.lbs_weights = asset['lbs_weights']
+        self.faces = asset['faces']
+        self.lmk_faces_idx = asset['lmk_faces_idx']
+        self.lmk_bary_coords = asset['lmk_bary_coords']
+        self.dynamic_lmk_faces_idx = asset['dynamic_lmk_faces_idx']
+        self.dynamic_lmk_bary_coords = asset['dynamic_lmk_bary_coords']
+        self.full_lmk_faces_idx = asset['full_lmk_faces_idx']
+        self.full_lmk_bary_coords = asset['full_lmk_bary_coords']
+        self.neck_kin_chain = asset['neck_kin_chain']
+        self.n_shape = int(asset['n_shape'])
+        self.jaw_idx = int(asset['jaw_idx'])
+
+    def _rigid_transform(self, rot_mats, joints):
+        ''' same as lbs.batch_rigid_transform, relative transforms [N, J, 4, 4]
+        '''
+        batch_size, num_joints = joints.shape[:2]
+        rel_joints = joints.copy()
+        rel_joints[:, 1:] -= joints[:, self.parents[1:]]
+        transforms_mat = np.zeros([batch_size, num_joints, 4, 4], dtype=np.float32)
+        transforms_mat[:, :, :3, :3] = rot_mats
+        transforms_mat[:, :, :3, 3] = rel_joints
+        transforms_mat[:, :, 3, 3] = 1
+        transform_chain = [transforms_mat[:, 0]]
+        for i in range(1, num_joints):
+            transform_chain.append(np.matmul(transform_chain[self.parents[i]], transforms_mat[:, i]))
+        transforms = np.stack(transform_chain, axis=1)
+        rel_transforms = transforms.copy()
+        rel_transforms[:, :, :3, 3] -= np.matmul(transforms[:, :, :3, :3], joints[..., None])[..., 0]
+        return rel_transforms
+
+    def _landmarks(self, vertices, rot_mats):
+        batch_size = vertices.shape[0]
+        # contour landmarks depend on the head rotation around y
+        rel_rot_mat = np.eye(3, dtype=np.float32)[None]
+        for idx in self.neck_kin_chain:
+            rel_rot_mat = np.matmul(rot_mats[:, idx], rel_rot_mat)
+        sy = np.sqrt(rel_rot_mat[:, 0, 0]**2 + rel_rot_mat[:, 1, 0]**2)
+        y_rot_angle = np.round(np.minimum(np.arctan2(-rel_rot_mat[:, 2, 0], sy)*180.0/np.pi, 39)).astype(np.int64)
+        y_rot_angle = np.where(y_rot_angle < 0, np.where(y_rot_angle < -39, 78, 39 - y_rot_angle), y_rot_angle)
+        lmk_faces_idx = np.concatenate([self.dynamic_lmk_faces_idx[y_rot_angle],
+                                        np.broadcast_to(self.lmk_faces_idx, (batch_size,) + self.lmk_faces_idx.shape)], axis=1)
+        lmk_bary_coords = np.concatenate([self.dynamic_lmk_bary_coords[y_rot_angle],
+                                          np.broadcast_to(self.lmk_bary_coords, (batch_size,) + self.lmk_bary_coords.shape)], axis=1)
+        batch_idx = np.arange(batch_size)[:, None, None]
+        landmarks2d = np.einsum('blfi,blf->bli', vertices[batch_idx, self.faces[lmk_faces_idx]], lmk_bary_coords)
+        landmarks3d = np.einsum('blfi,lf->bli', vertices[:, self.faces[self.full_lmk_faces_idx]], self.full_lmk_bary_coords)
+        return landmarks2d, landmarks3d
+
+    def forward(self, shape_params, expression_params, pose_params):
+        '''
+        shape_params: [N, n_shape], expression_params: [N, n_exp], pose_params: [N, 6] (global, jaw)
+        Returns:
+            vertices: [N, V, 3], landmarks2d: [N, L, 3], landmarks3d: [N, 68, 3]
+        '''
+        betas = np.concatenate([shape_params, expression_params], axis=1).astype(np.float32)
+        pose_params = np.asarray(pose_params, dtype=np.float32)
+        batch_size = betas.shape[0]
+        num_joints = self.parents.shape[0]
+        v_shaped = self.v_template + np.einsum('bl,vkl->bvk', betas, self.shapedirs)
+        joints = self.J_template + np.einsum('bl,jkl->bjk', betas, self.J_shapedirs)
+        # neck and eyes at zero
+        full_pose = np.zeros([batch_size, num_joints, 3], dtype=np.float32)
+        full_pose[:, 0] = pose_params[:, :3]
+        full_pose[:, self.jaw_idx] = pose_params[:, 3:]
+        rot_mats = batch_rodrigues(full_pose.reshape(-1, 3)).reshape(batch_size, num_joints, 3, 3)
+        pose_feature = (rot_mats[:, self.jaw_idx] - np.eye(3, dtype=np.float32)).reshape(batch_size, 9)
+        v_posed = v_shaped + np.matmul(pose_feature, self.posedirs_jaw).reshape(batch_size, -1, 3)
+        # skinning
+        A = self._rigid_transform(rot_mats, joints)
+        T = np.einsum('vj,bjkl->bvkl', self.lbs_weights, A[:, :, :3])
+        vertices = np.einsum('bvkl,bvl->bvk', T[..., :3], v_posed) + T[..., 3]
+        landmarks2d, landmarks3d = self._landmarks(vertices, rot_mats)
+        return vertices, landmarks2d, landmarks3d
+
+    __call__ = forward
@@ -177,9 +177,6 @@ def lbs(betas, pose, v_template, shapedirs, posedirs, J_regressor, parents,
             The joints of the model
     '''
 
-    batch_size = max(betas.shape[0], pose.shape[0])
-    device = betas.device
-
     # Add shape contribution
     v_shaped = v_template + blend_shapes(betas, shapedirs)
 
@@ -187,6 +184,41 @@ def lbs(betas, pose, v_template, shapedirs, posedirs, J_regressor, parents,
     # NxJx3 array
     J = vertices2joints(J_regressor, v_shaped)
 
+    return lbs_shaped(v_shaped, J, pose, posedirs, parents, lbs_weights,
+                      pose2rot=pose2rot, dtype=dtype)
+
+
+def lbs_shaped(v_shaped, J, pose, posedirs, parents, lbs_weights,
+               pose2rot=True, dtype=torch.float32, active_joints=None):
+    ''' Poses an already shaped mesh, the part of lbs after the shape blend shapes
+        and the joint regression. Lets callers cache the shaped template and joints
+        of a fixed identity.
+
+        Parameters
+        ----------
+        v_shaped : torch.tensor BxVx3
+            The template mesh with the shape blend shapes applied
+        J : torch.tensor BxJx3
+            The joints regressed from v_shaped
+        pose, posedirs, parents, lbs_weights, pose2rot, dtype:
+            see lbs
+        active_joints: list, optional
+            Indices of the non-root joints that can rotate. The pose correctives
+            of all other joints are zero and skipped, posedirs must then only
+            contain the rows of the active joints, (len(active_joints) * 9)x(V * 3)
+
+        Returns
+        -------
+        verts: torch.tensor BxVx3
+            The vertices of the mesh after applying the shape and pose
+            displacements.
+        joints: torch.tensor BxJx3
+            The joints of the model
+    '''
+
+    batch_size = max(v_shaped.shape[0], pose.shape[0])
+    device = v_shaped.device
+
     # 3. Add pose blend shapes
     # N x J x 3 x 3
     ident = torch.eye(3, dtype=dtype, device=device)
@@ -194,12 +226,17 @@ def lbs(betas, pose, v_template, shapedirs, posedirs, J_regressor, parents,
         rot_mats = batch_rodrigues(
             pose.view(-1, 3), dtype=dtype).view([batch_size, -1, 3, 3])
 
-        pose_feature = (rot_mats[:, 1:, :, :] - ident).view([batch_size, -1])
+        pose_feature = rot_mats[:, 1:, :, :]
+        if active_joints is not None:
+            pose_feature = pose_feature[:, active_joints]
+        pose_feature = (pose_feature - ident).view([batch_size, -1])
         # (N x P) x (P, V * 3) -> N x V x 3
         pose_offsets = torch.matmul(pose_feature, posedirs) \
             .view(batch_size, -1, 3)
     else:
         pose_feature = pose[:, 1:].view(batch_size, -1, 3, 3) - ident
+        if active_joints is not None:
+            pose_feature = pose_feature[:, active_joints]
         rot_mats = pose.view(batch_size, -1, 3, 3)
 
         pose_offsets = torch.matmul(pose_feature.view(batch_size, -1),
@@ -213,7 +250,7 @@ def lbs(betas, pose, v_template, shapedirs, posedirs, J_regressor, parents,
     # W is N x V x (J + 1)
     W = lbs_weights.unsqueeze(dim=0).expand([batch_size, -1, -1])
     # (N x V x (J + 1)) x (N x (J + 1) x 16)
-    num_joints = J_regressor.shape[0]
+    num_joints = J.shape[1]
     T = torch.matmul(W, A.view(batch_size, num_joints, 16)) \
         .view(batch_size, -1, 4, 4)
 
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+''' Multi-process cpu inference over a list of images
+The networks are loaded once into shared memory, every worker process maps them instead of loading a copy.
+Each worker is pinned to its own cores with as many intra-op threads, detects, crops and reconstructs
+the images it pulls from a common queue, and runs a handler on the result (e.g. saving).
+'''
+import os
+import queue
+import traceback
+from time import time
+import torch
+import torch.multiprocessing as mp
+
+from .deca import DECA
+from .utils.renderer import check_rasterizer
+from .datasets import datasets
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+def shared_weights(config):
+    ''' state dicts of the networks of DECA(config) in shared memory, module -> state dict
+    quantized networks keep packed weights, they are loaded by every worker
+    '''
+    deca = DECA(config=config, device='cpu')
+    networks = [name for name in ['E_flame', 'E_detail', 'D_detail'] if deca._enabled(name)]
+    deca.warmup(networks)
+    weights = {}
+    for name in networks:
+        state_dict = getattr(deca, name).state_dict()
+        if all(torch.is_tensor(value) for value in state_dict.values()):
+            weights[name] = {key: value.share_memory_() for key, value in state_dict.items()}
+    return weights
+
+def _worker(rank, config, weights, cores, imagepaths, data_options, handler, handler_args, tasks, results):
+    ''' results: ('ready', None, error, 0, rank) after the setup, then ('start', index, ...) and ('done', index, error, seconds, rank) per image
+    '''
+    try:
+        if len(cores) > 0 and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cores)
+        torch.set_num_threads(max(1, len(cores)))
+        torch.set_num_interop_threads(1)
+        deca = DECA(config=config, device='cpu')
+        deca.use_shared_weights(weights)
+        testdata = datasets.TestData(imagepaths, **data_options)
+    except Exception:
+        results.put(('ready', None, traceback.format_exc(), 0, rank))
+        return
+    results.put(('ready', None, None, 0, rank))
+    while True:
+        index = tasks.get()
+        if index is None:
+            break
+        results.put(('start', index, None, 0, rank))
+        start = time()
+        try:
+            data = testdata[index]
+            handler(deca, data, *handler_args)
+            results.put(('done', index, None, time() - start, rank))
+        except Exception:
+            results.put(('done', index, traceback.format_exc(), time() - start, rank))
+
+class InferencePool(object):
+    ''' handler(deca, data, *handler_args) runs in a worker for every image, data is the TestData sample.
+    handler must be importable by the workers (a module level function), they are started with spawn.
+    The workers run on cpu: config.rasterizer_type has to be 'pytorch3d' or 'auto'.
+    '''
+    def __init__(self, config, handler, handler_args=(), n_workers=None, threads_per_worker=None,
+                 iscrop=True, face_detector='fan', poll_interval=1.0):
+        check_rasterizer(config.rasterizer_type, 'cpu')
+        self.config = config
+        self.handler = handler
+        self.handler_args = tuple(handler_args)
+        cores = available_cores()
+        if threads_per_worker is None:
+            # resnet50 stops scaling well beyond a few threads, more processes use the cores better
+            threads_per_worker = 4 if n_workers is None else max(1, len(cores)//n_workers)
+        if n_workers is None:
+            n_workers = max(1, len(cores)//threads_per_worker)
+        self.n_workers = n_workers
+        # contiguous core ids, so that a worker stays on one socket
+        self.cores = [cores[i*threads_per_worker:(i+1)*threads_per_worker] for i in range(n_workers)]
+        self.data_options = {'iscrop': iscrop, 'face_detector': face_detector}
+        # seconds between checks that the workers are still alive
+        self.poll_interval = poll_interval
+
+    def run(self, testpath, sample_step=10):
+        ''' testpath: anything TestData accepts. Yields (imagepath, error or None, seconds, worker) as images finish
+        The image a worker was on when it died (e.g. killed when out of memory) is reported as an error,
+        the images left are reported as errors once no worker is alive.
+        '''
+        # videos are split into frames once, here
+        imagepaths = datasets.list_images(testpath, sample_step)
+        context = mp.get_context('spawn')
+        tasks = context.Queue()
+        results = context.Queue()
+        weights = shared_weights(self.config)
+        workers = [context.Process(target=_worker, args=(rank, self.config, weights, self.cores[rank], imagepaths, self.data_options,
+                                                         self.handler, self.handler_args, tasks, results), daemon=True)
+                   for rank in range(self.n_workers)]
+        for worker in workers:
+            worker.start()
+        for index in range(len(imagepaths)):
+            tasks.put(index)
+        for _ in workers:
+            tasks.put(None)
+        remaining = set(range(len(imagepaths)))
+        # rank -> index being processed, rank -> setup error
+        current = {}
+        setup_errors = {}
+        try:
+            while len(remaining) > 0:
+                try:
+                    kind, index, error, seconds, rank = results.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    for rank, worker in enumerate(workers):
+                        if not worker.is_alive() and current.get(rank) is not None:
+                            index = current.pop(rank)
+                            remaining.discard(index)
+                            yield imagepaths[index], f'worker {rank} died with exit code {worker.exitcode}', 0., rank
+                    if not any(worker.is_alive() for worker in workers) and results.empty():
+                        reason = '\n'.join(setup_errors.values()) or f'exit codes {[worker.exitcode for worker in workers]}'
+                        for index in sorted(remaining):
+                            yield imagepaths[index], f'no worker left: {reason}', 0., None
+                        remaining.clear()
+                    continue
+                if kind == 'ready':
+                    if error is not None:
+                        setup_errors[rank] = f'worker {rank} failed to start:\n{error}'
+                        print(setup_errors[rank])
+                elif kind == 'start':
+                    current[rank] = index
+                elif index in remaining:
+                    current[rank] = None
+                    remaining.discard(index)
+                    yield imagepaths[index], error, seconds, rank
+        finally:
+            for worker in workers:
+                worker.join(timeout=10)
+                if worker.is_alive():
+                    worker.terminate()
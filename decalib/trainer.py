@@ -54,7 +54,8 @@ class Trainer(object):
         # training stage: coarse and detail
         self.train_detail = self.cfg.train.train_detail
 
-        # deca model
+        # deca model, every component is needed for training
+        model.warmup()
         self.deca = model.to(self.device)
         self.configure_optimizers()
         self.load_checkpoint()
@@ -246,7 +247,7 @@ class Trainer(object):
             uv_gt = F.grid_sample(torch.cat([images, masks], dim=1), uv_pverts.permute(0,2,3,1)[:,:,:,:2], mode='bilinear', align_corners=False)
             uv_texture_gt = uv_gt[:,:3,:,:].detach(); uv_mask_gt = uv_gt[:,3:,:,:].detach()
             # self-occlusion
-            normals = util.vertex_normals(trans_verts, self.deca.render.faces.expand(batch_size, -1, -1))
+            normals = self.deca.render.topology.vertex_normals(trans_verts)
             uv_pnorm = self.deca.render.world2uv(normals)
             uv_mask = (uv_pnorm[:,[-1],:,:] < -0.05).float().detach()
             ## combine masks
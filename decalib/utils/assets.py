@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+''' Static DECA assets, processed once and compiled into a single memory-mapped bundle
+Everything is stored at uv_size and in its final dtype: uv masks, fixed displacement, mean texture,
+dense template, head topology, FLAME with its landmark embedding and the texture space.
+The manifest records the settings and the size, mtime and sha1 of every source file,
+a bundle whose sources or settings changed is ignored.
+'''
+import os
+import hashlib
+import numpy as np
+import torch
+import torch.nn.functional as F
+from skimage.io import imread
+
+from . import util
+from . import tensorfile
+from ..models.FLAME import load_flame_assets, load_flametex_assets
+
+BUNDLE_VERSION = 1
+# used by DenseMesh and util.upsample_mesh
+DENSE_TEMPLATE_KEYS = ['img_size', 'f', 'x_coords', 'y_coords', 'valid_pixel_ids', 'valid_pixel_3d_faces', 'valid_pixel_b_coords']
+
+def _sources(model_cfg):
+    sources = {
+        'topology': model_cfg.topology_path,
+        'dense_template': model_cfg.dense_template_path,
+        'fixed_displacement': model_cfg.fixed_displacement_path,
+        'flame_model': model_cfg.flame_model_path,
+        'flame_lmk_embedding': model_cfg.flame_lmk_embedding_path,
+        'face_mask': model_cfg.face_mask_path,
+        'face_eye_mask': model_cfg.face_eye_mask_path,
+        'mean_tex': model_cfg.mean_tex_path,
+    }
+    # the texture space is optional (use_tex), it is bundled when it was downloaded
+    tex_path = model_cfg.tex_path if model_cfg.tex_type == 'BFM' else model_cfg.get('flame_tex_path', '')
+    if os.path.exists(tex_path):
+        sources['tex'] = tex_path
+    return sources
+
+def _settings(model_cfg):
+    return {'version': BUNDLE_VERSION, 'uv_size': model_cfg.uv_size, 'n_shape': model_cfg.n_shape,
+            'n_exp': model_cfg.n_exp, 'n_tex': model_cfg.n_tex, 'tex_type': model_cfg.tex_type}
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def _load_uv_map(path, uv_size, channels):
+    image = imread(path).astype(np.float32)/255.
+    image = torch.from_numpy(image.transpose(2,0,1)[channels])[None,:,:,:].contiguous()
+    return F.interpolate(image, [uv_size, uv_size]).numpy()
+
+def build_assets(model_cfg):
+    ''' loads and processes the assets from their source files
+    Returns: dict of name -> numpy array, FLAME, texture space and dense template under 'flame/', 'flametex/', 'dense_template/'
+    '''
+    uv_size = model_cfg.uv_size
+    assets = {
+        'uv_face_eye_mask': _load_uv_map(model_cfg.face_eye_mask_path, uv_size, [0]),
+        'uv_face_mask': _load_uv_map(model_cfg.face_mask_path, uv_size, [0]),
+        'fixed_uv_dis': np.load(model_cfg.fixed_displacement_path).astype(np.float32),
+        'mean_texture': _load_uv_map(model_cfg.mean_tex_path, uv_size, [0,1,2]),
+    }
+    verts, uvcoords, faces, uvfaces = util.load_obj(model_cfg.topology_path, cache_dir=model_cfg.get('topology_cache_dir') or None)
+    assets.update({'topology/verts': verts.numpy(), 'topology/uvcoords': uvcoords.numpy(),
+                   'topology/faces': faces.numpy(), 'topology/uvfaces': uvfaces.numpy()})
+    dense_template = np.load(model_cfg.dense_template_path, allow_pickle=True, encoding='latin1').item()
+    for key in DENSE_TEMPLATE_KEYS:
+        assets['dense_template/' + key] = np.asarray(dense_template[key])
+    for key, value in load_flame_assets(model_cfg).items():
+        assets['flame/' + key] = value
+    if 'tex' in _sources(model_cfg):
+        for key, value in load_flametex_assets(model_cfg).items():
+            assets['flametex/' + key] = value
+    return assets
+
+def compile_assets(model_cfg, bundle_path):
+    ''' one-time step, writes the processed assets and the manifest to bundle_path
+    '''
+    sources = {}
+    for name, path in _sources(model_cfg).items():
+        sources[name] = _file_stat(path)
+        with open(path, 'rb') as f:
+            sources[name]['sha1'] = hashlib.sha1(f.read()).hexdigest()
+    assets = build_assets(model_cfg)
+    os.makedirs(os.path.dirname(os.path.abspath(bundle_path)), exist_ok=True)
+    tensorfile.save_arrays(bundle_path, assets, metadata={'settings': _settings(model_cfg), 'sources': sources})
+    return assets
+
+def bundle_is_valid(model_cfg, bundle_path):
+    ''' same settings and unchanged source files (size and mtime, no hashing at startup)
+    '''
+    if not bundle_path or not os.path.exists(bundle_path):
+        return False
+    try:
+        manifest = tensorfile.load_metadata(bundle_path)
+    except ValueError:
+        return False
+    if manifest.get('settings') != _settings(model_cfg):
+        return False
+    for name, path in _sources(model_cfg).items():
+        source = manifest['sources'].get(name)
+        if source is None or not os.path.exists(path):
+            return False
+        stat = _file_stat(path)
+        if source['path'] != stat['path'] or source['size'] != stat['size'] or source['mtime'] != stat['mtime']:
+            return False
+    return True
+
+def load_assets(model_cfg, bundle_path=None):
+    ''' maps the bundle if it is up to date, otherwise processes the source files
+    '''
+    if bundle_is_valid(model_cfg, bundle_path):
+        return tensorfile.load_arrays(bundle_path)
+    if bundle_path:
+        print(f'asset bundle {bundle_path} is missing or outdated, loading the source files. run demos/compile_assets.py for a faster start')
+    return build_assets(model_cfg)
+
+def subset(assets, prefix):
+    ''' arrays under prefix, with the prefix removed
+    '''
+    return {name[len(prefix):]: array for name, array in assets.items() if name.startswith(prefix)}
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+''' deca_model.tar as a flat tensor file (see tensorfile.py), one entry per parameter: '<module>/<parameter name>'
+The header lists the parameters of every module, loading maps the file and reads only the requested modules.
+'''
+import os
+import torch
+
+from . import tensorfile
+
+MODULES = ['E_flame', 'E_detail', 'D_detail']
+
+def convert_checkpoint(model_path, out_path, modules=MODULES):
+    ''' one-time conversion of a torch checkpoint, records the size and mtime of the source
+    '''
+    checkpoint = torch.load(model_path, map_location='cpu')
+    arrays = {}
+    index = {}
+    for module in modules:
+        if module not in checkpoint:
+            continue
+        index[module] = []
+        for key, value in checkpoint[module].items():
+            arrays[f'{module}/{key}'] = value.detach().cpu().numpy()
+            index[module].append(key)
+    stat = os.stat(model_path)
+    source = {'path': os.path.abspath(model_path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+    tensorfile.save_arrays(out_path, arrays, metadata={'modules': index, 'source': source})
+    return index
+
+def is_converted(model_path, tensor_path):
+    ''' the tensor file exists and was converted from the current model_path (or model_path is gone)
+    '''
+    if not tensor_path or not os.path.exists(tensor_path):
+        return False
+    try:
+        source = tensorfile.load_metadata(tensor_path)['source']
+    except (ValueError, KeyError):
+        return False
+    if not os.path.exists(model_path):
+        return True
+    stat = os.stat(model_path)
+    return source['size'] == stat.st_size and source['mtime'] == stat.st_mtime
+
+def load_modules(tensor_path, modules):
+    '''
+    Returns: dict module -> state dict of cpu tensors sharing the mapped (copy-on-write) file
+    '''
+    arrays = tensorfile.load_arrays(tensor_path, names=[module + '/' for module in modules])
+    state_dicts = {module: {} for module in modules}
+    for name, array in arrays.items():
+        module, key = name.split('/', 1)
+        state_dicts[module][key] = torch.from_numpy(array)
+    return state_dicts
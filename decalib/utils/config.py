@@ -14,24 +14,37 @@ cfg.device = 'cuda'
 cfg.device_id = '0'
 
 cfg.pretrained_modelpath = os.path.join(cfg.deca_dir, 'data', 'deca_model.tar')
+# memory-mapped conversion of pretrained_modelpath (demos/convert_checkpoint.py), used when it is up to date
+cfg.pretrained_tensorpath = os.path.join(cfg.deca_dir, 'data', 'deca_model.tensors')
+# int8 encoders saved by DECA.save_quantized (demos/quantize_encoders.py), replace the fp32 encoders when set. cpu only
+cfg.quantized_modelpath = ''
 cfg.output_dir = ''
-cfg.rasterizer_type = 'pytorch3d'
+cfg.rasterizer_type = 'pytorch3d' # pytorch3d, standard, or auto (time both and pick the faster one per batch size and resolution)
+cfg.rasterizer_cache_path = os.path.join(cfg.deca_dir, 'data', 'rasterizer_autotune.json')
 # ---------------------------------------------------------------------------- #
 # Options for Face model
 # ---------------------------------------------------------------------------- #
 cfg.model = CN()
 cfg.model.topology_path = os.path.join(cfg.deca_dir, 'data', 'head_template.obj')
+# parsed obj arrays, keyed by file hash and memory-mapped on later starts, '' to always parse
+cfg.model.topology_cache_dir = os.path.join(cfg.deca_dir, 'data', 'cache')
+# processed static assets in one memory-mapped file, written by demos/compile_assets.py, '' to always load the source files
+cfg.model.asset_bundle_path = os.path.join(cfg.deca_dir, 'data', 'deca_assets.bundle')
 # texture data original from http://files.is.tue.mpg.de/tbolkart/FLAME/FLAME_texture_data.zip
 cfg.model.dense_template_path = os.path.join(cfg.deca_dir, 'data', 'texture_data_256.npy')
 cfg.model.fixed_displacement_path = os.path.join(cfg.deca_dir, 'data', 'fixed_displacement_256.npy')
 cfg.model.flame_model_path = os.path.join(cfg.deca_dir, 'data', 'generic_model.pkl') 
 cfg.model.flame_lmk_embedding_path = os.path.join(cfg.deca_dir, 'data', 'landmark_embedding.npy') 
+# FLAME buffers for the torch-free decoder (models/flame_numpy.py), written by FLAME.save_numpy
+cfg.model.flame_numpy_path = os.path.join(cfg.deca_dir, 'data', 'flame_numpy.npz')
 cfg.model.face_mask_path = os.path.join(cfg.deca_dir, 'data', 'uv_face_mask.png') 
 cfg.model.face_eye_mask_path = os.path.join(cfg.deca_dir, 'data', 'uv_face_eye_mask.png') 
 cfg.model.mean_tex_path = os.path.join(cfg.deca_dir, 'data', 'mean_texture.jpg') 
 cfg.model.tex_path = os.path.join(cfg.deca_dir, 'data', 'FLAME_albedo_from_BFM.npz') 
 cfg.model.tex_type = 'BFM' # BFM, FLAME, albedoMM
 cfg.model.uv_size = 256
+# decimated head meshes for small previews: [[max render size, clustering grid size], ...], [] to always render the full mesh
+cfg.model.lod_levels = [[64, 24], [128, 48]]
 cfg.model.param_list = ['shape', 'tex', 'exp', 'pose', 'cam', 'light']
 cfg.model.n_shape = 100
 cfg.model.n_tex = 50
@@ -44,7 +57,13 @@ cfg.model.jaw_type = 'aa' # default use axis angle, another option: euler. Note
 # face recognition model
 cfg.model.fr_model_path = os.path.join(cfg.deca_dir, 'data', 'resnet50_ft_weight.pkl')
 
+# precision of the encoders and the detail generator at inference: fp32, bf16 or fp16 (autocast). FLAME and rendering stay fp32
+cfg.model.precision = 'fp32'
+# memory of one decode call in MB, larger batches are decoded in chunks. 0: 80% of the free memory of a cuda device, no limit on cpu
+cfg.model.decode_memory_budget = 0
+
 ## details
+cfg.model.use_detail = True # False for coarse-only deployments, E_detail and D_detail are not created nor loaded
 cfg.model.n_detail = 128
 cfg.model.max_z = 0.01
 
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+''' Tensor-in, tensor-out forwards of the heavy DECA stages, for tracing, export and torch.compile
+No dicts, no in-place slicing, no numpy: the batch dimension stays dynamic.
+E_detail is exported as is, E_flame, D_detail and FLAME through the wrappers below.
+'''
+import torch
+import torch.nn as nn
+
+from .rotation_converter import batch_euler2axis
+
+class CoarseEncoderGraph(nn.Module):
+    ''' E_flame with the code split: images -> codes in the order of num_dict (light is [bz, 9, 3])
+    '''
+    def __init__(self, encoder, num_dict, jaw_type='aa'):
+        super(CoarseEncoderGraph, self).__init__()
+        self.encoder = encoder
+        self.names = list(num_dict)
+        self.sizes = [int(num_dict[key]) for key in self.names]
+        self.jaw_type = jaw_type
+
+    def forward(self, images):
+        parameters = self.encoder(images)
+        codes = list(torch.split(parameters, self.sizes, dim=1))
+        for i, name in enumerate(self.names):
+            if name == 'light':
+                codes[i] = codes[i].reshape(-1, 9, 3)
+            if name == 'pose' and self.jaw_type == 'euler':
+                codes[i] = torch.cat([codes[i][:,:3], batch_euler2axis(codes[i][:,3:])], dim=1)
+        return tuple(codes)
+
+class DetailDecoderGraph(nn.Module):
+    ''' D_detail conditioned on jaw pose and expression: pose, exp, detail -> displacement [bz, 1, uv_size, uv_size]
+    '''
+    def __init__(self, generator):
+        super(DetailDecoderGraph, self).__init__()
+        self.generator = generator
+
+    def forward(self, pose, exp, detail):
+        return self.generator(torch.cat([pose[:,3:], exp, detail], dim=1))
+
+class FLAMEGraph(nn.Module):
+    ''' FLAME with zero eye pose: shape, exp, pose -> vertices, landmarks2d, landmarks3d
+    '''
+    def __init__(self, flame):
+        super(FLAMEGraph, self).__init__()
+        self.flame = flame
+
+    def forward(self, shape, exp, pose):
+        return self.flame(shape_params=shape, expression_params=exp, pose_params=pose)
+
+def export_torchscript(graph, example_inputs, filename):
+    with torch.no_grad():
+        traced = torch.jit.trace(graph.eval(), example_inputs, check_trace=False)
+    traced.save(filename)
+    return traced
+
+def export_onnx(graph, example_inputs, filename, input_names, output_names, opset_version=17):
+    ''' dynamic batch dimension on every input and output
+    '''
+    dynamic_axes = {name: {0: 'batch'} for name in input_names + output_names}
+    with torch.no_grad():
+        torch.onnx.export(graph.eval(), example_inputs, filename, input_names=input_names, output_names=output_names,
+                          dynamic_axes=dynamic_axes, opset_version=opset_version)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+''' Inference-only rewrites of the DECA networks (ResnetEncoder, Generator)
+fold_batchnorm merges eval BatchNorm into the preceding conv/linear layer,
+optimize_module additionally converts to channels-last, and traces and freezes the network
+so that TorchScript fuses conv + activation where the backend supports it.
+The results cannot be trained anymore.
+autocast runs the networks in reduced precision (bf16/fp16), FLAME and the renderer stay in fp32.
+'''
+import copy
+import contextlib
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+PRECISIONS = {'fp32': None, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+def autocast(device, precision):
+    ''' autocast context for precision on the device type of device (cpu or cuda), no-op for fp32
+    '''
+    if precision not in PRECISIONS:
+        raise ValueError(f'unknown precision {precision}, expected one of {list(PRECISIONS)}')
+    if PRECISIONS[precision] is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=torch.device(device).type, dtype=PRECISIONS[precision])
+
+def _bn_scale_shift(bn):
+    scale = bn.weight/torch.sqrt(bn.running_var + bn.eps)
+    shift = bn.bias - bn.running_mean*scale
+    return scale, shift
+
+def _fold_linear_bn(linear, bn, positions):
+    ''' linear output reshaped to [bz, C, positions] followed by bn over C
+    '''
+    scale, shift = _bn_scale_shift(bn)
+    scale = scale.repeat_interleave(positions)
+    shift = shift.repeat_interleave(positions)
+    fused = copy.deepcopy(linear)
+    fused.weight.data = linear.weight.data*scale[:,None]
+    fused.bias.data = linear.bias.data*scale + shift
+    return fused
+
+def _fold_sequential(sequential):
+    ''' conv followed by bn inside a Sequential, the bn is replaced by Identity
+    '''
+    for i in range(len(sequential) - 1):
+        conv, bn = sequential[i], sequential[i+1]
+        if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+            sequential[i] = fuse_conv_bn_eval(conv, bn)
+            sequential[i+1] = nn.Identity()
+
+def fold_batchnorm(model):
+    ''' folds every BatchNorm2d of an eval model into the layer before it, in place
+    resnet: convK/bnK attribute pairs and the downsample Sequential. Generator: the conv blocks,
+    and the first bn into l1 (bilinear upsampling is per-channel linear and commutes with it)
+    '''
+    for module in list(model.modules()):
+        if isinstance(module, nn.Sequential):
+            _fold_sequential(module)
+        for name, child in list(module.named_children()):
+            if name.startswith('bn') and isinstance(child, nn.BatchNorm2d):
+                conv = getattr(module, 'conv' + name[2:], None)
+                if isinstance(conv, nn.Conv2d):
+                    setattr(module, 'conv' + name[2:], fuse_conv_bn_eval(conv, child))
+                    setattr(module, name, nn.Identity())
+        if hasattr(module, 'l1') and hasattr(module, 'conv_blocks'):
+            bn = module.conv_blocks[0]
+            if isinstance(bn, nn.BatchNorm2d):
+                module.l1[0] = _fold_linear_bn(module.l1[0], bn, module.init_size**2)
+                module.conv_blocks[0] = nn.Identity()
+    return model
+
+class ChannelsLast(nn.Module):
+    ''' feeds 4D inputs in channels-last layout to a converted network
+    '''
+    def __init__(self, model):
+        super(ChannelsLast, self).__init__()
+        self.model = model
+
+    def forward(self, inputs):
+        if inputs.dim() == 4:
+            inputs = inputs.contiguous(memory_format=torch.channels_last)
+        return self.model(inputs)
+
+def optimize_module(model, example_inputs, channels_last=True, jit=True):
+    ''' inference copy of model: bn folded, channels-last weights, traced and frozen
+    example_inputs: input used for tracing, e.g. images [bz, 3, 224, 224] or the detail latent code
+    '''
+    model = fold_batchnorm(copy.deepcopy(model).eval())
+    if channels_last:
+        model = ChannelsLast(model.to(memory_format=torch.channels_last))
+    for param in model.parameters():
+        param.requires_grad_(False)
+    if jit:
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example_inputs)
+        model = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+    return model
+
+def max_abs_diff(model, reference, inputs):
+    ''' numerical equivalence of two networks on the same inputs
+    '''
+    with torch.no_grad():
+        return (model(inputs).float() - reference(inputs).float()).abs().max().item()
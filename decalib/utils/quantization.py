@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+''' Post-training int8 quantization of ResnetEncoder for cpu inference
+The resnet backbone is quantized statically (fx graph mode, the residual adds included),
+with activation ranges calibrated on face crops. The Linear heads are quantized dynamically.
+Quantized encoders are saved as state dicts, loading rebuilds the structure with quantized_encoder.
+'''
+import copy
+import warnings
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from ..datasets import datasets
+
+def _prepare_backbone(backbone, backend, image_size):
+    torch.backends.quantized.engine = backend
+    example_inputs = (torch.randn(1, 3, image_size, image_size),)
+    return prepare_fx(copy.deepcopy(backbone).cpu().eval(), get_default_qconfig_mapping(backend), example_inputs)
+
+def _convert(encoder, prepared):
+    quantized = copy.deepcopy(encoder).cpu().eval()
+    quantized.encoder = convert_fx(prepared)
+    quantized.layers = quantize_dynamic(quantized.layers, {nn.Linear}, dtype=torch.qint8)
+    return quantized
+
+def calibration_batches(inputpath, batch_size=8, max_images=64, face_detector='fan'):
+    ''' face crops of TestData(inputpath), as cpu batches [bz, 3, 224, 224]
+    '''
+    testdata = datasets.TestData(inputpath, iscrop=True, face_detector=face_detector)
+    images = [testdata[i]['image'] for i in range(min(len(testdata), max_images))]
+    return [torch.stack(images[i:i+batch_size]) for i in range(0, len(images), batch_size)]
+
+def quantize_encoder(encoder, calibration, backend='fbgemm', image_size=224):
+    ''' int8 copy of a ResnetEncoder
+    calibration: list of image batches, the activation ranges of the backbone are observed on them
+    '''
+    prepared = _prepare_backbone(encoder.encoder, backend, image_size)
+    with torch.no_grad():
+        for images in calibration:
+            prepared(images.cpu())
+    return _convert(encoder, prepared)
+
+def quantized_encoder(encoder, backend='fbgemm', image_size=224):
+    ''' structure of quantize_encoder(encoder) with placeholder ranges, for loading a saved state dict
+    '''
+    prepared = _prepare_backbone(encoder.encoder, backend, image_size)
+    with warnings.catch_warnings():
+        # the observers have not seen data
+        warnings.simplefilter('ignore')
+        return _convert(encoder, prepared)
+
+def model_size(module):
+    ''' bytes of the state dict, packed int8 weights included
+    '''
+    size = 0
+    for value in module.state_dict().values():
+        if isinstance(value, torch.Tensor):
+            size += value.numel()*value.element_size()
+        elif isinstance(value, tuple):
+            # packed params of the dynamic Linear layers: (weight, bias)
+            size += sum(v.numel()*v.element_size() for v in value if isinstance(v, torch.Tensor))
+    return size
@@ -13,6 +13,16 @@
 # For comments or questions, please email us at deca@tue.mpg.de
 # For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
 
+import os
+import copy
+import json
+import threading
+from time import time
+try:
+    import fcntl
+except ImportError:
+    # no inter-process lock of the autotune cache (windows)
+    fcntl = None
 import numpy as np
 import torch
 import torch.nn as nn
@@ -20,6 +30,15 @@ import torch.nn.functional as F
 from skimage.io import imread
 import imageio
 from . import util
+from .topology import Topology
+
+available_rasterizers = []
+
+def check_rasterizer(rasterizer_type, device):
+    ''' the standard rasterizer is a cuda kernel, it has no cpu path
+    '''
+    if rasterizer_type == 'standard' and torch.device(device).type != 'cuda':
+        raise ValueError(f"the standard rasterizer runs on cuda only, use rasterizer_type 'pytorch3d' or 'auto' on {device}")
 
 def set_rasterizer(type = 'pytorch3d'):
     if type == 'pytorch3d':
@@ -44,6 +63,20 @@ def set_rasterizer(type = 'pytorch3d'):
         # If JIT does not work, try manually installation first
         # 1. see instruction here: pixielib/utils/rasterizer/INSTALL.md
         # 2. add this: "from .rasterizer.standard_rasterize_cuda import standard_rasterize" here
+    elif type == 'auto':
+        # load every rasterizer that works in this environment, AutoRasterizer picks one per shape
+        global available_rasterizers
+        available_rasterizers = []
+        for rasterizer_type in ['standard', 'pytorch3d']:
+            try:
+                set_rasterizer(rasterizer_type)
+                available_rasterizers.append(rasterizer_type)
+            except Exception as e:
+                print(f'rasterizer {rasterizer_type} is not available: {e}')
+        global load_obj
+        from .util import load_obj
+        if len(available_rasterizers) == 0:
+            raise RuntimeError('no rasterizer is available, please install pytorch3d or check rasterizer/INSTALL.md')
 
 class StandardRasterizer(nn.Module):
     """ Alg: https://www.scratchapixel.com/lessons/3d-basic-rendering/rasterization-practical-implementation
@@ -114,7 +147,7 @@ class Pytorch3dRasterizer(nn.Module):
         can only render squared image now
     """
 
-    def __init__(self, image_size=224):
+    def __init__(self, image_size=224, bin_size=None, max_faces_per_bin=None):
         """
         use fixed raster_settings for rendering faces
         """
@@ -123,8 +156,8 @@ class Pytorch3dRasterizer(nn.Module):
             'image_size': image_size,
             'blur_radius': 0.0,
             'faces_per_pixel': 1,
-            'bin_size': None,
-            'max_faces_per_bin':  None,
+            'bin_size': bin_size,
+            'max_faces_per_bin':  max_faces_per_bin,
             'perspective_correct': False,
         }
         raster_settings = util.dict2obj(raster_settings)
@@ -170,47 +203,178 @@ class Pytorch3dRasterizer(nn.Module):
         # import ipdb; ipdb.set_trace()
         return pixel_vals
 
+def rasterizer_key(device, batch_size, h, w, num_faces):
+    ''' key of the autotune cache, the fastest rasterizer depends on the gpu model, batch size, resolution and mesh size
+    '''
+    device = torch.device(device)
+    if device.type == 'cuda':
+        device_name = torch.cuda.get_device_name(device)
+    else:
+        device_name = device.type
+    return f'{device_name}_{batch_size}_{h}x{w}_{num_faces}f'
+
+# the cache file is shared by every AutoRasterizer, of this process and of others (see update_cache)
+_cache_lock = threading.Lock()
+
+def update_cache(cache_path, choices):
+    ''' merges choices into the json cache file, and returns the merged entries
+    The file is re-read under a lock (also between processes where fcntl exists) and replaced atomically,
+    so that concurrent writers keep each other's entries and readers never see a partial file.
+    '''
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    with _cache_lock, open(cache_path + '.lock', 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        merged = load_cache(cache_path)
+        merged.update(choices)
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(merged, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, cache_path)
+    return merged
+
+def load_cache(cache_path):
+    if cache_path is None or not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        print(f'ignore the invalid rasterizer cache {cache_path}')
+        return {}
+
+class AutoRasterizer(nn.Module):
+    """ Dispatches to the fastest available rasterizer
+    Candidates (standard, pytorch3d with several bin sizes) are timed on the first call with a new
+    (device, batch size, resolution), the winner is cached in memory and in a json file on disk.
+    Notice:
+        call set_rasterizer('auto') first
+    """
+    def __init__(self, image_size=224, cache_path=None, n_repeat=3):
+        super().__init__()
+        self.image_size = image_size
+        self.cache_path = cache_path
+        self.n_repeat = n_repeat
+        self.rasterizers = {}
+        self.choices = {}
+        # tuning and the caches are shared by the threads rendering with this rasterizer
+        self.lock = threading.RLock()
+        self.choices = load_cache(cache_path)
+
+    def candidates(self, num_faces):
+        settings = []
+        if 'standard' in available_rasterizers:
+            settings.append({'type': 'standard'})
+        if 'pytorch3d' in available_rasterizers:
+            # bin_size None: pytorch3d heuristic, 0: naive rasterization without binning
+            settings.append({'type': 'pytorch3d', 'bin_size': None, 'max_faces_per_bin': None})
+            settings.append({'type': 'pytorch3d', 'bin_size': 0, 'max_faces_per_bin': None})
+            for bin_size in [16, 32, 64]:
+                settings.append({'type': 'pytorch3d', 'bin_size': bin_size, 'max_faces_per_bin': num_faces})
+        return settings
+
+    def get_rasterizer(self, setting):
+        name = json.dumps(setting, sort_keys=True)
+        with self.lock:
+            if name not in self.rasterizers:
+                if setting['type'] == 'standard':
+                    self.rasterizers[name] = StandardRasterizer(self.image_size)
+                else:
+                    self.rasterizers[name] = Pytorch3dRasterizer(self.image_size, bin_size=setting['bin_size'], max_faces_per_bin=setting['max_faces_per_bin'])
+            return self.rasterizers[name]
+
+    def tune(self, vertices, faces, attributes, h=None, w=None):
+        ''' time every candidate on the given inputs, return the fastest setting
+        '''
+        device = vertices.device
+        best_setting = None; best_time = None
+        with torch.no_grad():
+            for setting in self.candidates(faces.shape[1]):
+                rasterizer = self.get_rasterizer(setting)
+                try:
+                    rasterizer(vertices, faces, attributes, h, w) # warm up
+                    if device.type == 'cuda':
+                        torch.cuda.synchronize(device)
+                    start = time()
+                    for _ in range(self.n_repeat):
+                        rasterizer(vertices, faces, attributes, h, w)
+                    if device.type == 'cuda':
+                        torch.cuda.synchronize(device)
+                    run_time = (time() - start)/self.n_repeat
+                except Exception as e:
+                    print(f'skip rasterizer {setting}: {e}')
+                    continue
+                if best_time is None or run_time < best_time:
+                    best_setting = setting; best_time = run_time
+        if best_setting is None:
+            raise RuntimeError('none of the rasterizers {} works on {}'.format(available_rasterizers, device))
+        return best_setting
+
+    def save_cache(self):
+        if self.cache_path is None:
+            return
+        # entries tuned meanwhile by other rasterizers are kept, and picked up here
+        merged = update_cache(self.cache_path, self.choices)
+        merged.update(self.choices)
+        self.choices = merged
+
+    def forward(self, vertices, faces, attributes=None, h=None, w=None):
+        key = rasterizer_key(vertices.device, vertices.shape[0], h or self.image_size, w or h or self.image_size, faces.shape[1])
+        if key not in self.choices:
+            with self.lock:
+                if key not in self.choices:
+                    self.choices[key] = self.tune(vertices, faces, attributes, h, w)
+                    print(f'rasterizer for {key}: {self.choices[key]}')
+                    self.save_cache()
+        return self.get_rasterizer(self.choices[key])(vertices, faces, attributes, h, w)
+
+def create_rasterizers(rasterizer_type, image_size, uv_size, rasterizer_cache_path=None):
+    ''' image and uv rasterizers of the given type, call set_rasterizer(rasterizer_type) first
+    '''
+    if rasterizer_type == 'pytorch3d':
+        return Pytorch3dRasterizer(image_size), Pytorch3dRasterizer(uv_size)
+    elif rasterizer_type == 'standard':
+        return StandardRasterizer(image_size), StandardRasterizer(uv_size)
+    elif rasterizer_type == 'auto':
+        return AutoRasterizer(image_size, cache_path=rasterizer_cache_path), AutoRasterizer(uv_size, cache_path=rasterizer_cache_path)
+    else:
+        raise NotImplementedError(f'unknown rasterizer type {rasterizer_type}')
+
+def shift_depth(vertices, offset):
+    ''' vertices with z + offset, as a new tensor: the callers' vertices are never written to
+    '''
+    return torch.cat([vertices[:,:,:2], vertices[:,:,2:] + offset], dim=-1)
+
 class SRenderY(nn.Module):
-    def __init__(self, image_size, obj_filename, uv_size=256, rasterizer_type='pytorch3d'):
+    def __init__(self, image_size, obj_filename, uv_size=256, rasterizer_type='pytorch3d', rasterizer_cache_path=None, topology=None,
+                lod_levels=[]):
         super(SRenderY, self).__init__()
         self.image_size = image_size
         self.uv_size = uv_size
-        if rasterizer_type == 'pytorch3d':
-            self.rasterizer = Pytorch3dRasterizer(image_size)
-            self.uv_rasterizer = Pytorch3dRasterizer(uv_size)
-            verts, faces, aux = load_obj(obj_filename)
-            uvcoords = aux.verts_uvs[None, ...]      # (N, V, 2)
-            uvfaces = faces.textures_idx[None, ...] # (N, F, 3)
-            faces = faces.verts_idx[None,...]
-        elif rasterizer_type == 'standard':
-            self.rasterizer = StandardRasterizer(image_size)
-            self.uv_rasterizer = StandardRasterizer(uv_size)
-            verts, uvcoords, faces, uvfaces = load_obj(obj_filename)
-            verts = verts[None, ...]
-            uvcoords = uvcoords[None, ...]
-            faces = faces[None, ...]
-            uvfaces = uvfaces[None, ...]
-        else:
-            NotImplementedError
-
-        # faces
+        self.rasterizer_type = rasterizer_type
+        self.rasterizer, self.uv_rasterizer = create_rasterizers(rasterizer_type, image_size, uv_size, rasterizer_cache_path)
+        # head topology, shared with FLAME when given
+        if topology is None:
+            topology = Topology.from_obj(obj_filename)
+        self.topology = topology
+        # dense mesh on the uv grid, for detail normals
         dense_triangles = util.generate_triangles(uv_size, uv_size)
-        self.register_buffer('dense_faces', torch.from_numpy(dense_triangles).long()[None,:,:])
-        self.register_buffer('faces', faces)
-        self.register_buffer('raw_uvcoords', uvcoords)
+        self.dense_topology = Topology(torch.from_numpy(dense_triangles), num_verts=uv_size*uv_size)
+        # decimated head meshes for previews, [max render size, grid size], used up to max render size
+        lod_levels = sorted(lod_levels)
+        self.lod_sizes = [max_size for max_size, _ in lod_levels]
+        self.lod_topologies = nn.ModuleList([topology.decimate(grid_size) for _, grid_size in lod_levels])
 
         # uv coords
+        uvcoords = topology.uvcoords[None,...]
         uvcoords = torch.cat([uvcoords, uvcoords[:,:,0:1]*0.+1.], -1) #[bz, ntv, 3]
         uvcoords = uvcoords*2 - 1; uvcoords[...,1] = -uvcoords[...,1]
-        face_uvcoords = util.face_vertices(uvcoords, uvfaces)
+        face_uvcoords = util.face_vertices(uvcoords, topology.uvfaces[None,...])
         self.register_buffer('uvcoords', uvcoords)
-        self.register_buffer('uvfaces', uvfaces)
         self.register_buffer('face_uvcoords', face_uvcoords)
 
         # shape colors, for rendering shape overlay
-        colors = torch.tensor([180, 180, 180])[None, None, :].repeat(1, faces.max()+1, 1).float()/255.
-        face_colors = util.face_vertices(colors, faces)
-        self.register_buffer('face_colors', face_colors)
+        self.register_buffer('shape_color', torch.tensor([180, 180, 180]).float()/255.)
 
         ## SH factors for lighting
         pi = np.pi
@@ -219,6 +383,63 @@ class SRenderY(nn.Module):
                            (pi/4)*(3)*(np.sqrt(5/(12*pi))), (pi/4)*(3/2)*(np.sqrt(5/(12*pi))), (pi/4)*(1/2)*(np.sqrt(5/(4*pi)))]).float()
         self.register_buffer('constant_factor', constant_factor)
     
+    def with_rasterizer(self, rasterizer_type, rasterizer_cache_path=None):
+        ''' renderer with other rasterizers, sharing the topologies and buffers of this one
+        '''
+        render = copy.copy(self)
+        # own registries, the modules and tensors in them stay shared
+        render._modules = self._modules.copy()
+        render._buffers = self._buffers.copy()
+        render._parameters = self._parameters.copy()
+        render.rasterizer_type = rasterizer_type
+        render.rasterizer, render.uv_rasterizer = create_rasterizers(rasterizer_type, self.image_size, self.uv_size, rasterizer_cache_path)
+        return render
+
+    def select_topology(self, h=None, w=None):
+        ''' the coarsest level of detail that still looks like the full mesh at this render size
+        '''
+        size = max(h or self.image_size, w or h or self.image_size)
+        for max_size, topology in zip(self.lod_sizes, self.lod_topologies):
+            if size <= max_size:
+                return topology
+        return self.topology
+
+    @property
+    def faces(self):
+        return self.topology.faces[None,...]
+
+    @property
+    def uvfaces(self):
+        return self.topology.uvfaces[None,...]
+
+    @property
+    def raw_uvcoords(self):
+        return self.topology.uvcoords[None,...]
+
+    @property
+    def dense_faces(self):
+        return self.dense_topology.faces[None,...]
+
+    @property
+    def face_colors(self):
+        return self.shape_color[None,None,None,:].expand(1, self.topology.num_faces, 3, -1)
+
+    def autotune(self, batch_sizes=[1]):
+        ''' pick the rasterizers for the given batch sizes ahead of the first rendering
+        only used when rasterizer_type is 'auto', results are cached on disk
+        '''
+        if self.rasterizer_type != 'auto':
+            return
+        # template mesh fitted into the image
+        template = self.topology.template[None,...]
+        template = template - template.mean(1, keepdim=True)
+        template = template/template.abs().max()*0.8
+        for batch_size in batch_sizes:
+            vertices = template.expand(batch_size, -1, -1).clone(); vertices[:,:,2] = vertices[:,:,2] + 10
+            attributes = self.topology.face_vertices(vertices)
+            self.rasterizer(vertices, self.faces.expand(batch_size, -1, -1), attributes)
+            self.uv_rasterizer(self.uvcoords.expand(batch_size, -1, -1), self.uvfaces.expand(batch_size, -1, -1), attributes)
+
     def forward(self, vertices, transformed_vertices, albedos, lights=None, h=None, w=None, light_type='point', background=None):
         '''
         -- Texture Rendering
@@ -233,11 +454,11 @@ class SRenderY(nn.Module):
         '''
         batch_size = vertices.shape[0]
         ## rasterizer near 0 far 100. move mesh so minz larger than 0
-        transformed_vertices[:,:,2] = transformed_vertices[:,:,2] + 10
+        transformed_vertices = shift_depth(transformed_vertices, 10)
         # attributes
-        face_vertices = util.face_vertices(vertices, self.faces.expand(batch_size, -1, -1))
-        normals = util.vertex_normals(vertices, self.faces.expand(batch_size, -1, -1)); face_normals = util.face_vertices(normals, self.faces.expand(batch_size, -1, -1))
-        transformed_normals = util.vertex_normals(transformed_vertices, self.faces.expand(batch_size, -1, -1)); transformed_face_normals = util.face_vertices(transformed_normals, self.faces.expand(batch_size, -1, -1))
+        face_vertices = self.topology.face_vertices(vertices)
+        normals = self.topology.vertex_normals(vertices); face_normals = self.topology.face_vertices(normals)
+        transformed_normals = self.topology.vertex_normals(transformed_vertices); transformed_face_normals = self.topology.face_vertices(transformed_normals)
         
         attributes = torch.cat([self.face_uvcoords.expand(batch_size, -1, -1, -1), 
                                 transformed_face_normals.detach(), 
@@ -343,9 +564,10 @@ class SRenderY(nn.Module):
         return shading.mean(1)
 
     def render_shape(self, vertices, transformed_vertices, colors = None, images=None, detail_normal_images=None, 
-                lights=None, return_grid=False, uv_detail_normals=None, h=None, w=None):
+                lights=None, return_grid=False, uv_detail_normals=None, h=None, w=None, use_lod=True):
         '''
         -- rendering shape with detail normal map
+        use_lod: render a decimated mesh when the output is small (see lod_levels), not with per-face colors
         '''
         batch_size = vertices.shape[0]
         # set lighting
@@ -361,23 +583,32 @@ class SRenderY(nn.Module):
             )[None,:,:].expand(batch_size, -1, -1).float()
             light_intensities = torch.ones_like(light_positions).float()*1.7
             lights = torch.cat((light_positions, light_intensities), 2).to(vertices.device)
-        transformed_vertices[:,:,2] = transformed_vertices[:,:,2] + 10
+        transformed_vertices = shift_depth(transformed_vertices, 10)
+
+        if use_lod and colors is None:
+            topology = self.select_topology(h, w)
+        else:
+            topology = self.topology
+        if topology is self.topology:
+            face_uvcoords = self.face_uvcoords
+        else:
+            face_uvcoords = self.uvcoords[:, topology.uvfaces]
 
         # Attributes
-        face_vertices = util.face_vertices(vertices, self.faces.expand(batch_size, -1, -1))
-        normals = util.vertex_normals(vertices, self.faces.expand(batch_size, -1, -1)); face_normals = util.face_vertices(normals, self.faces.expand(batch_size, -1, -1))
-        transformed_normals = util.vertex_normals(transformed_vertices, self.faces.expand(batch_size, -1, -1)); transformed_face_normals = util.face_vertices(transformed_normals, self.faces.expand(batch_size, -1, -1))
+        face_vertices = topology.face_vertices(vertices)
+        normals = topology.vertex_normals(vertices); face_normals = topology.face_vertices(normals)
+        transformed_normals = topology.vertex_normals(transformed_vertices); transformed_face_normals = topology.face_vertices(transformed_normals)
         if colors is None:
-            colors = self.face_colors.expand(batch_size, -1, -1, -1)
+            colors = self.shape_color[None,None,None,:].expand(batch_size, topology.num_faces, 3, -1)
         attributes = torch.cat([colors, 
                         transformed_face_normals.detach(), 
                         face_vertices.detach(), 
                         face_normals,
-                        self.face_uvcoords.expand(batch_size, -1, -1, -1)], 
+                        face_uvcoords.expand(batch_size, -1, -1, -1)], 
                         -1)
         # rasterize
         # import ipdb; ipdb.set_trace()
-        rendering = self.rasterizer(transformed_vertices, self.faces.expand(batch_size, -1, -1), attributes, h, w)
+        rendering = self.rasterizer(transformed_vertices, topology.faces.expand(batch_size, -1, -1), attributes, h, w)
 
         ####
         alpha_images = rendering[:, -1, :, :][:, None, :, :].detach()
@@ -410,21 +641,22 @@ class SRenderY(nn.Module):
         else:
             return shape_images
     
-    def render_depth(self, transformed_vertices):
+    def render_depth(self, transformed_vertices, use_lod=True):
         '''
         -- rendering depth
         '''
         batch_size = transformed_vertices.shape[0]
+        topology = self.select_topology() if use_lod else self.topology
 
-        transformed_vertices[:,:,2] = transformed_vertices[:,:,2] - transformed_vertices[:,:,2].min()
-        z = -transformed_vertices[:,:,2:].repeat(1,1,3).clone()
+        transformed_vertices = shift_depth(transformed_vertices, -transformed_vertices[:,:,2].min())
+        z = -transformed_vertices[:,:,2:].repeat(1,1,3)
         z = z-z.min()
         z = z/z.max()
         # Attributes
-        attributes = util.face_vertices(z, self.faces.expand(batch_size, -1, -1))
+        attributes = topology.face_vertices(z)
         # rasterize
-        transformed_vertices[:,:,2] = transformed_vertices[:,:,2] + 10
-        rendering = self.rasterizer(transformed_vertices, self.faces.expand(batch_size, -1, -1), attributes)
+        transformed_vertices = shift_depth(transformed_vertices, 10)
+        rendering = self.rasterizer(transformed_vertices, topology.faces.expand(batch_size, -1, -1), attributes)
 
         ####
         alpha_images = rendering[:, -1, :, :][:, None, :, :].detach()
@@ -439,7 +671,7 @@ class SRenderY(nn.Module):
         batch_size = colors.shape[0]
 
         # Attributes
-        attributes = util.face_vertices(colors, self.faces.expand(batch_size, -1, -1))
+        attributes = self.topology.face_vertices(colors)
         # rasterize
         rendering = self.rasterizer(transformed_vertices, self.faces.expand(batch_size, -1, -1), attributes)
         ####
@@ -454,6 +686,6 @@ class SRenderY(nn.Module):
         uv_vertices: [bz, 3, h, w]
         '''
         batch_size = vertices.shape[0]
-        face_vertices = util.face_vertices(vertices, self.faces.expand(batch_size, -1, -1))
+        face_vertices = self.topology.face_vertices(vertices)
         uv_vertices = self.uv_rasterizer(self.uvcoords.expand(batch_size, -1, -1), self.uvfaces.expand(batch_size, -1, -1), face_vertices)[:, :3]
         return uv_vertices
\ No newline at end of file
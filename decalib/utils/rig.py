@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+''' Per-identity FLAME blendshape rigs, numpy only (no torch)
+A rig animates one reconstructed identity with a single matrix-vector product per frame:
+    vertices = neutral + basis @ [exp, (R_jaw - I).ravel()]
+    vertices = R_global (vertices - root) + root
+basis holds the expression blend shapes and a linearized jaw: the jaw skinning around the jaw joint
+plus the jaw pose correctives, both linear in R_jaw - I. Compared to FLAME, the jaw joint is taken
+from the neutral mesh and the products of jaw rotation with expression are dropped.
+'''
+import numpy as np
+
+RIG_VERSION = 1
+
+def batch_rodrigues(rot_vecs, epsilon=1e-8):
+    ''' axis-angle [N, 3] -> rotation matrices [N, 3, 3], same as lbs.batch_rodrigues
+    '''
+    rot_vecs = np.asarray(rot_vecs, dtype=np.float32)
+    angle = np.linalg.norm(rot_vecs + epsilon, axis=1, keepdims=True)
+    rot_dir = rot_vecs/angle
+    cos = np.cos(angle)[:,:,None]
+    sin = np.sin(angle)[:,:,None]
+    rx, ry, rz = rot_dir[:,0], rot_dir[:,1], rot_dir[:,2]
+    zeros = np.zeros_like(rx)
+    K = np.stack([zeros, -rz, ry, rz, zeros, -rx, -ry, rx, zeros], axis=1).reshape(-1, 3, 3)
+    return np.eye(3, dtype=np.float32)[None] + sin*K + (1 - cos)*np.matmul(K, K)
+
+def save_rig(filename, vertices, basis, root, faces, dtype=np.float16):
+    '''
+    vertices: [nv, 3], neutral mesh of the identity
+    basis: [nv*3, n_exp+9], expression blend shapes and linearized jaw
+    root: [3], root joint, center of the global rotation
+    faces: [nf, 3]
+    dtype: storage type of the basis, float16 halves the file size
+    '''
+    np.savez(filename,
+             version=np.array(RIG_VERSION),
+             vertices=np.asarray(vertices, dtype=np.float32),
+             basis=np.asarray(basis, dtype=dtype),
+             root=np.asarray(root, dtype=np.float32),
+             faces=np.asarray(faces, dtype=np.int32))
+
+def load_rig(filename):
+    with np.load(filename) as data:
+        rig = {key: data[key] for key in data.files}
+    assert int(rig['version']) == RIG_VERSION, f'unsupported rig version {int(rig["version"])}'
+    rig['basis'] = rig['basis'].astype(np.float32)
+    rig['n_exp'] = rig['basis'].shape[1] - 9
+    return rig
+
+def rig_coefficients(exp, jaw_pose):
+    '''
+    exp: [N, n_exp]
+    jaw_pose: [N, 3], axis-angle
+    Returns: [N, n_exp+9]
+    '''
+    exp = np.asarray(exp, dtype=np.float32)
+    jaw = batch_rodrigues(jaw_pose) - np.eye(3, dtype=np.float32)
+    return np.concatenate([exp, jaw.reshape(-1, 9)], axis=1)
+
+def evaluate_rig(rig, exp, jaw_pose, global_pose=None):
+    ''' reference evaluator, batched over frames
+    exp: [N, n_exp]
+    jaw_pose: [N, 3], axis-angle
+    global_pose: [N, 3], axis-angle, optional
+    Returns: vertices [N, nv, 3]
+    '''
+    coefficients = rig_coefficients(exp, jaw_pose)
+    vertices = rig['vertices'][None] + np.matmul(coefficients, rig['basis'].T).reshape(coefficients.shape[0], -1, 3)
+    if global_pose is not None:
+        R = batch_rodrigues(global_pose)
+        root = rig['root']
+        vertices = np.matmul(vertices - root, R.transpose(0, 2, 1)) + root
+    return vertices
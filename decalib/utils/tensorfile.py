@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+''' Flat, memory-mappable file of named arrays
+layout: magic (8 bytes) | header length (uint64) | json header | arrays, each aligned to 64 bytes
+header: {'arrays': {name: {'dtype', 'shape', 'offset', 'sha1'}}, 'metadata': {...}}
+Loading maps the file and returns numpy views, only the pages of the arrays that are used get read.
+'''
+import os
+import json
+import struct
+import hashlib
+import numpy as np
+
+MAGIC = b'DECATNS1'
+ALIGN = 64
+
+def _aligned(n):
+    return (n + ALIGN - 1)//ALIGN*ALIGN
+
+def save_arrays(path, arrays, metadata=None):
+    '''
+    arrays: dict of name -> numpy array
+    metadata: json serializable dict, stored in the header
+    '''
+    entries = {}
+    offset = 0
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    for name, array in arrays.items():
+        entries[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset,
+                         'sha1': hashlib.sha1(array.tobytes()).hexdigest()}
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({'arrays': entries, 'metadata': metadata or {}}).encode()
+    # data starts aligned
+    header = header + b' '*(_aligned(len(MAGIC) + 8 + len(header)) - len(MAGIC) - 8 - len(header))
+    data_start = len(MAGIC) + 8 + len(header)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + entries[name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+def read_header(path):
+    ''' Returns: header dict and the file offset of the first array
+    '''
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a tensor file')
+        header_length = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_length).decode())
+    return header, len(MAGIC) + 8 + header_length
+
+def load_arrays(path, names=None, verify=False):
+    '''
+    names: arrays to load, all if None. Names ending with '/' select every array with that prefix
+    verify: check the sha1 of the loaded arrays (reads them completely)
+    Returns: dict of name -> numpy array, copy-on-write views of the mapped file
+    '''
+    header, data_start = read_header(path)
+    entries = header['arrays']
+    if names is not None:
+        selected = [name for name in entries if any(name == key or (key.endswith('/') and name.startswith(key)) for key in names)]
+    else:
+        selected = list(entries)
+    arrays = {}
+    if len(entries) == 0:
+        return arrays
+    mm = np.memmap(path, dtype=np.uint8, mode='c')
+    for name in selected:
+        entry = entries[name]
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape'])) if len(entry['shape']) > 0 else 1
+        array = np.ndarray(entry['shape'], dtype=dtype, buffer=mm, offset=data_start + entry['offset']) if count > 0 \
+                    else np.zeros(entry['shape'], dtype=dtype)
+        if verify and hashlib.sha1(array.tobytes()).hexdigest() != entry['sha1']:
+            raise ValueError(f'{name} in {path} is corrupted')
+        arrays[name] = array
+    return arrays
+
+def load_metadata(path):
+    return read_header(path)[0]['metadata']
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from . import util
+
+class Topology(nn.Module):
+    """ Mesh connectivity shared by FLAME, SRenderY and the detail mesh
+    Everything that only depends on the faces is built once here:
+        faces: [nf, 3]
+        uvcoords: [ntv, 2], uvfaces: [nf, 3] (optional)
+        template: [nv, 3], vertices of the mesh file (optional)
+        incidence: sparse [nv, nf], 1 where the vertex belongs to the face
+    Batched meshes are handled by indexing and a single sparse matmul, no batch offsets
+    are rebuilt per call. Treat it as read-only, it is shared between modules.
+    """
+    def __init__(self, faces, num_verts=None, uvcoords=None, uvfaces=None, template=None):
+        super(Topology, self).__init__()
+        faces = faces.long()
+        if num_verts is None:
+            num_verts = int(faces.max()) + 1
+        self.num_verts = num_verts
+        self.num_faces = faces.shape[0]
+        self.register_buffer('faces', faces, persistent=False)
+        # face -> vertex incidence, vertex normals are the sum of the normals of its faces
+        rows = faces.reshape(-1)
+        cols = torch.arange(self.num_faces)[:,None].expand(-1, 3).reshape(-1)
+        incidence = torch.sparse_coo_tensor(torch.stack([rows, cols]), torch.ones(rows.shape[0]),
+                                            (num_verts, self.num_faces)).coalesce()
+        self.register_buffer('incidence', incidence, persistent=False)
+        if uvcoords is not None:
+            self.register_buffer('uvcoords', uvcoords.float(), persistent=False)
+            self.register_buffer('uvfaces', uvfaces.long(), persistent=False)
+        else:
+            self.uvcoords = None
+            self.uvfaces = None
+        if template is not None:
+            self.register_buffer('template', template.float(), persistent=False)
+        else:
+            self.template = None
+
+    @classmethod
+    def from_obj(cls, obj_filename, cache_dir=None):
+        verts, uvcoords, faces, uvfaces = util.load_obj(obj_filename, cache_dir=cache_dir)
+        return cls(faces, num_verts=verts.shape[0], uvcoords=uvcoords, uvfaces=uvfaces, template=verts)
+
+    def decimate(self, grid_size):
+        ''' Lower level of detail by vertex clustering on the template mesh
+        Vertices in the same cell of a grid_size^3 grid collapse to the vertex closest to the cell mean.
+        The decimated faces index the original vertices, so the same (posed) vertex tensor
+        renders at every level of detail.
+        Returns:
+            Topology with the decimated faces and matching uv faces
+        '''
+        assert self.template is not None, 'decimation needs the template vertices'
+        verts = self.template.cpu().numpy()
+        faces = self.faces.cpu().numpy()
+        # cluster vertices on a regular grid
+        vmin = verts.min(0); extent = (verts.max(0) - vmin).max()
+        cell = np.clip(np.floor((verts - vmin)/extent*grid_size), 0, grid_size-1).astype(np.int64)
+        cell_id = (cell[:,0]*grid_size + cell[:,1])*grid_size + cell[:,2]
+        _, cluster = np.unique(cell_id, return_inverse=True)
+        n_clusters = cluster.max() + 1
+        mean = np.zeros([n_clusters, 3]); np.add.at(mean, cluster, verts)
+        mean = mean/np.bincount(cluster)[:,None]
+        dist = ((verts - mean[cluster])**2).sum(1)
+        order = np.lexsort((dist, cluster))
+        first = order[np.r_[True, cluster[order][1:] != cluster[order][:-1]]]
+        representative = np.zeros(n_clusters, dtype=np.int64); representative[cluster[first]] = first
+        vertex_map = representative[cluster]
+        # collapse faces, drop degenerate, duplicated and flipped ones
+        lod_faces = vertex_map[faces]
+        keep = (lod_faces[:,0] != lod_faces[:,1]) & (lod_faces[:,1] != lod_faces[:,2]) & (lod_faces[:,2] != lod_faces[:,0])
+        normals = np.cross(verts[faces[:,1]] - verts[faces[:,0]], verts[faces[:,2]] - verts[faces[:,0]])
+        lod_normals = np.cross(verts[lod_faces[:,1]] - verts[lod_faces[:,0]], verts[lod_faces[:,2]] - verts[lod_faces[:,0]])
+        keep = keep & ((normals*lod_normals).sum(1) > 0)
+        face_idx = np.where(keep)[0]
+        _, unique_idx = np.unique(np.sort(lod_faces[face_idx], 1), axis=0, return_index=True)
+        face_idx = face_idx[np.sort(unique_idx)]
+        lod_faces = lod_faces[face_idx]
+        # uv: corners that kept their vertex keep their uv, collapsed corners take a uv of the representative
+        uvfaces = None
+        if self.uvfaces is not None:
+            uvfaces = self.uvfaces.cpu().numpy()
+            vertex_uv = np.zeros(self.num_verts, dtype=np.int64)
+            vertex_uv[faces.reshape(-1)[::-1]] = uvfaces.reshape(-1)[::-1]
+            uvfaces = np.where(lod_faces == faces[face_idx], uvfaces[face_idx], vertex_uv[lod_faces])
+            uvfaces = torch.from_numpy(uvfaces)
+        return Topology(torch.from_numpy(lod_faces), num_verts=self.num_verts,
+                        uvcoords=None if self.uvcoords is None else self.uvcoords.cpu(), uvfaces=uvfaces,
+                        template=self.template.cpu())
+
+    def face_vertices(self, vertices):
+        """
+        :param vertices: [batch size, number of vertices, D]
+        :return: [batch size, number of faces, 3, D]
+        """
+        return vertices[:, self.faces]
+
+    def vertex_normals(self, vertices):
+        """
+        :param vertices: [batch size, number of vertices, 3]
+        :return: [batch size, number of vertices, 3]
+        """
+        bs, nv = vertices.shape[:2]
+        face_vertices = self.face_vertices(vertices)
+        # the cross product is the same at the three corners of a triangle
+        face_normals = torch.cross(face_vertices[:,:,1] - face_vertices[:,:,0], face_vertices[:,:,2] - face_vertices[:,:,0], dim=-1)
+        face_normals = face_normals.permute(1,0,2).reshape(self.num_faces, bs*3)
+        normals = torch.sparse.mm(self.incidence, face_normals.to(self.incidence.dtype))
+        normals = normals.reshape(nv, bs, 3).permute(1,0,2).to(vertices.dtype)
+        normals = F.normalize(normals, eps=1e-6, dim=2)
+        return normals
+
+class DenseMesh(nn.Module):
+    """ Detailed mesh from the coarse mesh and the displacement map, batched torch version of util.upsample_mesh
+    Every dense vertex is a barycentric combination of three coarse vertices, this interpolation
+    is built once from dense_template as a sparse matrix [number of dense vertices, nv].
+    """
+    def __init__(self, dense_template, num_verts):
+        super(DenseMesh, self).__init__()
+        valid_pixel_ids = dense_template['valid_pixel_ids']
+        faces = torch.from_numpy(dense_template['valid_pixel_3d_faces'].astype(np.int64))
+        b_coords = torch.from_numpy(dense_template['valid_pixel_b_coords'].astype(np.float32))
+        self.num_dense_verts = faces.shape[0]
+        self.img_size = int(dense_template['img_size'])
+        rows = torch.arange(self.num_dense_verts)[:,None].expand(-1, 3).reshape(-1)
+        interpolation = torch.sparse_coo_tensor(torch.stack([rows, faces.reshape(-1)]), b_coords.reshape(-1),
+                                                (self.num_dense_verts, num_verts)).coalesce()
+        self.register_buffer('interpolation', interpolation, persistent=False)
+        # uv pixel of every dense vertex, flattened
+        x_coords = dense_template['x_coords'][valid_pixel_ids].astype(np.int64)
+        y_coords = dense_template['y_coords'][valid_pixel_ids].astype(np.int64)
+        self.register_buffer('pixel_ids', torch.from_numpy(y_coords*self.img_size + x_coords), persistent=False)
+        self.register_buffer('faces', torch.from_numpy(dense_template['f'].astype(np.int64)), persistent=False)
+
+    def forward(self, vertices, normals, displacement_map, texture_map=None):
+        """
+        :param vertices: [batch size, nv, 3], coarse mesh
+        :param normals: [batch size, nv, 3]
+        :param displacement_map: [batch size, 1, img_size, img_size]
+        :param texture_map: [batch size, C, img_size, img_size], optional
+        :return: dense vertices [batch size, number of dense vertices, 3], dense colors [batch size, number of dense vertices, C] or None
+        """
+        bs, nv = vertices.shape[:2]
+        # positions and normals interpolated by one sparse matmul
+        coarse = torch.cat([vertices, normals], dim=2).permute(1,0,2).reshape(nv, bs*6)
+        dense = torch.sparse.mm(self.interpolation, coarse.to(self.interpolation.dtype)).to(vertices.dtype)
+        dense = dense.reshape(self.num_dense_verts, bs, 6).permute(1,0,2)
+        dense_points, dense_normals = dense[:,:,:3], F.normalize(dense[:,:,3:], dim=2)
+        displacements = displacement_map.reshape(bs, -1)[:, self.pixel_ids]
+        dense_vertices = dense_points + displacements[:,:,None]*dense_normals
+        dense_colors = None
+        if texture_map is not None:
+            dense_colors = texture_map.reshape(bs, texture_map.shape[1], -1)[:, :, self.pixel_ids].permute(0,2,1)
+        return dense_vertices, dense_colors
@@ -51,7 +51,8 @@ class Trainer(object):
         self.image_size = self.cfg.dataset.image_size
         self.uv_size = self.cfg.model.uv_size
 
-        # deca model
+        # deca model, every component is needed for training
+        model.warmup()
         self.deca = model
         self.E_flame = self.deca.E_flame
         self.flametex = self.deca.flametex
@@ -19,6 +19,11 @@ import torch.nn.functional as F
 import math
 from collections import OrderedDict
 import os
+import json
+import struct
+import hashlib
+import shutil
+import tempfile
 from scipy.ndimage import morphology
 from skimage.io import imsave
 import cv2
@@ -60,6 +65,13 @@ def upsample_mesh(vertices, normals, faces, displacement_map, texture_map, dense
     dense_vertices = pixel_3d_points + offsets
     return dense_vertices, dense_colors, dense_faces
 
+def _write_rows(f, row_format, array, chunk_size=65536):
+    ''' formats the rows of a 2D array with one %-format per chunk of rows, instead of one call per row
+    '''
+    for start in range(0, array.shape[0], chunk_size):
+        chunk = array[start:start+chunk_size]
+        f.write((row_format*chunk.shape[0]) % tuple(chunk.ravel().tolist()))
+
 # borrowed from https://github.com/YadiraF/PRNet/blob/master/utils/write.py
 def write_obj(obj_name,
               vertices,
@@ -70,6 +82,7 @@ def write_obj(obj_name,
               uvfaces=None,
               inverse_face_order=False,
               normal_map=None,
+              precision=6,
               ):
     ''' Save 3D face model with texture. 
     Ref: https://github.com/patrikhuber/eos/blob/bd00155ebae4b1a13b08bf5a991694d682abbada/include/eos/core/Mesh.hpp
@@ -80,6 +93,7 @@ def write_obj(obj_name,
         faces: shape = (ntri, 3)
         texture: shape = (uv_size, uv_size, 3)
         uvcoords: shape = (nver, 2) max value<=1
+        precision: number of decimals of vertices, float colors and uv coords
     '''
     if os.path.splitext(obj_name)[-1] != '.obj':
         obj_name = obj_name + '.obj'
@@ -94,44 +108,31 @@ def write_obj(obj_name,
         faces = faces[:, [2, 1, 0]]
         if uvfaces is not None:
             uvfaces = uvfaces[:, [2, 1, 0]]
+    float_format = f'%.{precision}f'
 
     # write obj
     with open(obj_name, 'w') as f:
         # first line: write mtlib(material library)
-        # f.write('# %s\n' % os.path.basename(obj_name))
-        # f.write('#\n')
-        # f.write('\n')
         if texture is not None:
             f.write('mtllib %s\n\n' % os.path.basename(mtl_name))
 
         # write vertices
         if colors is None:
-            for i in range(vertices.shape[0]):
-                f.write('v {} {} {}\n'.format(vertices[i, 0], vertices[i, 1], vertices[i, 2]))
+            _write_rows(f, 'v ' + ' '.join([float_format]*3) + '\n', vertices)
         else:
-            for i in range(vertices.shape[0]):
-                f.write('v {} {} {} {} {} {}\n'.format(vertices[i, 0], vertices[i, 1], vertices[i, 2], colors[i, 0], colors[i, 1], colors[i, 2]))
+            # integer colors (e.g. uint8) stay integers
+            color_format = '%d' if np.issubdtype(colors.dtype, np.integer) else float_format
+            _write_rows(f, 'v ' + ' '.join([float_format]*3 + [color_format]*3) + '\n', np.concatenate([vertices, colors], axis=1))
 
         # write uv coords
         if texture is None:
-            for i in range(faces.shape[0]):
-                f.write('f {} {} {}\n'.format(faces[i, 2], faces[i, 1], faces[i, 0]))
+            _write_rows(f, 'f %d %d %d\n', faces[:, [2, 1, 0]])
         else:
-            for i in range(uvcoords.shape[0]):
-                f.write('vt {} {}\n'.format(uvcoords[i,0], uvcoords[i,1]))
+            _write_rows(f, 'vt ' + ' '.join([float_format]*2) + '\n', uvcoords)
             f.write('usemtl %s\n' % material_name)
             # write f: ver ind/ uv ind
             uvfaces = uvfaces + 1
-            for i in range(faces.shape[0]):
-                f.write('f {}/{} {}/{} {}/{}\n'.format(
-                    #  faces[i, 2], uvfaces[i, 2],
-                    #  faces[i, 1], uvfaces[i, 1],
-                    #  faces[i, 0], uvfaces[i, 0]
-                    faces[i, 0], uvfaces[i, 0],
-                    faces[i, 1], uvfaces[i, 1],
-                    faces[i, 2], uvfaces[i, 2]
-                )
-                )
+            _write_rows(f, 'f %d/%d %d/%d %d/%d\n', np.stack([faces, uvfaces], axis=2).reshape(-1, 6))
             # write mtl
             with open(mtl_name, 'w') as f:
                 f.write('newmtl %s\n' % material_name)
@@ -142,64 +143,218 @@ def write_obj(obj_name,
                     name, _ = os.path.splitext(obj_name)
                     normal_name = f'{name}_normals.png'
                     f.write(f'disp {normal_name}')
-                    # out_normal_map = normal_map / (np.linalg.norm(
-                    #     normal_map, axis=-1, keepdims=True) + 1e-9)
-                    # out_normal_map = (out_normal_map + 1) * 0.5
-
                     cv2.imwrite(
                         normal_name,
-                        # (out_normal_map * 255).astype(np.uint8)[:, :, ::-1]
                         normal_map
                     )
             cv2.imwrite(texture_name, texture)
 
 
+def _glb_pad(data, pad_byte=b'\x00'):
+    return data + pad_byte*((4 - len(data) % 4) % 4)
+
+def write_glb(glb_name,
+              vertices,
+              faces,
+              colors=None,
+              normals=None,
+              texture=None,
+              uvcoords=None,
+              uvfaces=None,
+              normal_map=None,
+              quantize=False,
+              ):
+    ''' Save a mesh as one binary glTF (.glb) file, texture and normal map embedded as png
+    Args:
+        glb_name: str
+        vertices: shape = (nver, 3)
+        faces: shape = (ntri, 3), counter-clockwise
+        colors: shape = (nver, 3), uint8 rgb, optional
+        normals: shape = (nver, 3), optional
+        texture: shape = (uv_size, uv_size, 3), bgr as for write_obj, needs uvcoords and uvfaces
+        uvcoords: shape = (nuv, 2), obj convention (v up)
+        uvfaces: shape = (ntri, 3)
+        normal_map: shape = (uv_size, uv_size, 3), object space normals, glTF materials only support
+            tangent space normal maps, so it is stored in material.extras['objectSpaceNormalTexture']
+        quantize: int16 positions and int8 normals (KHR_mesh_quantization), uv coords are always uint16
+    '''
+    if os.path.splitext(glb_name)[-1] != '.glb':
+        glb_name = glb_name + '.glb'
+    vertices = np.asarray(vertices, dtype=np.float32)
+    faces = np.asarray(faces, dtype=np.int64)
+    if texture is not None:
+        # glTF has one index per corner, split vertices with several uv coords
+        corners = np.stack([faces.reshape(-1), np.asarray(uvfaces, dtype=np.int64).reshape(-1)], axis=1)
+        corners, inverse = np.unique(corners, axis=0, return_inverse=True)
+        faces = inverse.reshape(-1, 3)
+        vertices = vertices[corners[:,0]]
+        if colors is not None:
+            colors = colors[corners[:,0]]
+        if normals is not None:
+            normals = normals[corners[:,0]]
+        uvs = np.asarray(uvcoords, dtype=np.float32)[corners[:,1]]
+        uvs = np.stack([uvs[:,0], 1 - uvs[:,1]], axis=1)
+
+    views, accessors, binary = [], [], []
+    offset = [0]
+    def add_accessor(array, component_type, accessor_type, count, target=None, normalized=False, stride=None, bounds=False):
+        data = _glb_pad(np.ascontiguousarray(array).tobytes())
+        view = {'buffer': 0, 'byteOffset': offset[0], 'byteLength': len(data)}
+        if target is not None:
+            view['target'] = target
+        if stride is not None:
+            view['byteStride'] = stride
+        views.append(view); binary.append(data); offset[0] += len(data)
+        accessor = {'bufferView': len(views)-1, 'componentType': component_type, 'count': count, 'type': accessor_type}
+        if normalized:
+            accessor['normalized'] = True
+        if bounds:
+            accessor['min'] = array[:, :3].min(0).tolist(); accessor['max'] = array[:, :3].max(0).tolist()
+        accessors.append(accessor)
+        return len(accessors) - 1
+
+    ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER = 34962, 34963
+    BYTE, UNSIGNED_BYTE, SHORT, UNSIGNED_SHORT, UNSIGNED_INT, FLOAT = 5120, 5121, 5122, 5123, 5125, 5126
+    nv = vertices.shape[0]
+    node = {'mesh': 0}
+    attributes = {}
+    if quantize:
+        # positions on a uniform int16 grid, dequantized by the node transform
+        center = (vertices.min(0) + vertices.max(0))/2
+        scale = max(float(np.abs(vertices - center).max())/32767, 1e-12)
+        positions = np.zeros([nv, 4], dtype=np.int16)
+        positions[:, :3] = np.round((vertices - center)/scale)
+        attributes['POSITION'] = add_accessor(positions, SHORT, 'VEC3', nv, ARRAY_BUFFER, stride=8, bounds=True)
+        node['translation'] = center.tolist(); node['scale'] = [scale]*3
+    else:
+        attributes['POSITION'] = add_accessor(vertices, FLOAT, 'VEC3', nv, ARRAY_BUFFER, bounds=True)
+    if normals is not None:
+        normals = np.asarray(normals, dtype=np.float32)
+        normals = normals/np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+        if quantize:
+            packed_normals = np.zeros([nv, 4], dtype=np.int8)
+            packed_normals[:, :3] = np.round(normals*127)
+            attributes['NORMAL'] = add_accessor(packed_normals, BYTE, 'VEC3', nv, ARRAY_BUFFER, normalized=True, stride=4)
+        else:
+            attributes['NORMAL'] = add_accessor(normals, FLOAT, 'VEC3', nv, ARRAY_BUFFER)
+    if colors is not None:
+        rgba = np.full([nv, 4], 255, dtype=np.uint8); rgba[:, :3] = colors
+        attributes['COLOR_0'] = add_accessor(rgba, UNSIGNED_BYTE, 'VEC4', nv, ARRAY_BUFFER, normalized=True)
+    if texture is not None:
+        uvs = np.round(np.clip(uvs, 0, 1)*65535).astype(np.uint16)
+        attributes['TEXCOORD_0'] = add_accessor(uvs, UNSIGNED_SHORT, 'VEC2', nv, ARRAY_BUFFER, normalized=True)
+    if nv < 65536:
+        indices = add_accessor(faces.astype(np.uint16), UNSIGNED_SHORT, 'SCALAR', faces.size, ELEMENT_ARRAY_BUFFER)
+    else:
+        indices = add_accessor(faces.astype(np.uint32), UNSIGNED_INT, 'SCALAR', faces.size, ELEMENT_ARRAY_BUFFER)
+
+    gltf = {
+        'asset': {'version': '2.0', 'generator': 'DECA'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [node],
+        'meshes': [{'primitives': [{'attributes': attributes, 'indices': indices, 'mode': 4}]}],
+    }
+    if texture is not None:
+        images = [texture] + ([normal_map] if normal_map is not None else [])
+        gltf['images'], gltf['textures'] = [], []
+        for image in images:
+            data = _glb_pad(cv2.imencode('.png', image)[1].tobytes())
+            views.append({'buffer': 0, 'byteOffset': offset[0], 'byteLength': len(data)})
+            binary.append(data); offset[0] += len(data)
+            gltf['images'].append({'bufferView': len(views)-1, 'mimeType': 'image/png'})
+            gltf['textures'].append({'source': len(gltf['images'])-1, 'sampler': 0})
+        gltf['samplers'] = [{'magFilter': 9729, 'minFilter': 9729}]
+        material = {'pbrMetallicRoughness': {'baseColorTexture': {'index': 0}, 'metallicFactor': 0.0, 'roughnessFactor': 1.0}}
+        if normal_map is not None:
+            material['extras'] = {'objectSpaceNormalTexture': 1}
+        gltf['materials'] = [material]
+        gltf['meshes'][0]['primitives'][0]['material'] = 0
+    if quantize:
+        gltf['extensionsUsed'] = gltf['extensionsRequired'] = ['KHR_mesh_quantization']
+    gltf['bufferViews'] = views
+    gltf['accessors'] = accessors
+    gltf['buffers'] = [{'byteLength': offset[0]}]
+
+    json_chunk = _glb_pad(json.dumps(gltf, separators=(',', ':')).encode(), b' ')
+    binary_chunk = b''.join(binary)
+    with open(glb_name, 'wb') as f:
+        f.write(struct.pack('<III', 0x46546C67, 2, 12 + 8 + len(json_chunk) + 8 + len(binary_chunk)))
+        f.write(struct.pack('<II', len(json_chunk), 0x4E4F534A)); f.write(json_chunk)
+        f.write(struct.pack('<II', len(binary_chunk), 0x004E4942)); f.write(binary_chunk)
+
+def _parse_obj(obj_filename):
+    ''' vectorized obj parsing: the lines of each kind are joined and converted by numpy in one go
+    Returns numpy arrays verts [nv, 3], uvcoords [nuv, 2], faces [nf, 3], uv_faces [nf, 3] (0-based)
+    '''
+    with open(obj_filename, 'r') as f:
+        lines = f.read().splitlines()
+    v_lines = [line[2:] for line in lines if line.startswith('v ')]
+    vt_lines = [line[3:] for line in lines if line.startswith('vt ')]
+    f_lines = [line[2:] for line in lines if line.startswith('f ')]
+
+    def parse_rows(rows, n_values, dtype, name):
+        if len(rows) == 0:
+            return np.zeros([0, n_values], dtype=dtype)
+        n_cols = len(rows[0].split())
+        values = np.array(' '.join(rows).split(), dtype=dtype)
+        if n_cols < n_values or values.size != n_cols*len(rows):
+            raise ValueError(f'{name} lines of {obj_filename} do not all have {n_values} values')
+        return values.reshape(-1, n_cols)[:, :n_values]
+    verts = parse_rows(v_lines, 3, np.float32, 'vertex')
+    uvcoords = parse_rows(vt_lines, 2, np.float32, 'texture')
+
+    # corners are v, v/vt, v/vt/vn or v//vn
+    faces = np.zeros([0, 3], dtype=np.int64); uv_faces = np.zeros([0, 3], dtype=np.int64)
+    if len(f_lines) > 0:
+        corners = ' '.join(f_lines)
+        first = f_lines[0].split()[0]
+        if '//' in first:
+            n_fields, has_uv = 2, False
+        else:
+            n_fields = first.count('/') + 1
+            has_uv = n_fields > 1
+        fields = np.array(corners.replace('//', '/').replace('/', ' ').split(), dtype=np.int64)
+        if fields.size != n_fields*3*len(f_lines):
+            raise ValueError(f'faces of {obj_filename} must be triangles with the same corner format')
+        fields = fields.reshape(-1, 3, n_fields)
+        faces = fields[:, :, 0] - 1
+        if has_uv:
+            uv_faces = fields[:, :, 1] - 1
+    return verts, uvcoords, faces, uv_faces
+
+def _file_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
 ## load obj,  similar to load_obj from pytorch3d
-def load_obj(obj_filename):
+def load_obj(obj_filename, cache_dir=None):
     """ Ref: https://github.com/facebookresearch/pytorch3d/blob/25c065e9dafa90163e7cec873dbb324a637c68b7/pytorch3d/io/obj_io.py
     Load a mesh from a file-like object.
+    cache_dir: if given, the parsed arrays are stored there as .npy, keyed by the hash of the file,
+        and later loads memory-map them instead of parsing
     """
-    with open(obj_filename, 'r') as f:
-        lines = [line.strip() for line in f]
-
-    verts, uvcoords = [], []
-    faces, uv_faces = [], []
-    # startswith expects each line to be a string. If the file is read in as
-    # bytes then first decode to strings.
-    if lines and isinstance(lines[0], bytes):
-        lines = [el.decode("utf-8") for el in lines]
-
-    for line in lines:
-        tokens = line.strip().split()
-        if line.startswith("v "):  # Line is a vertex.
-            vert = [float(x) for x in tokens[1:4]]
-            if len(vert) != 3:
-                msg = "Vertex %s does not have 3 values. Line: %s"
-                raise ValueError(msg % (str(vert), str(line)))
-            verts.append(vert)
-        elif line.startswith("vt "):  # Line is a texture.
-            tx = [float(x) for x in tokens[1:3]]
-            if len(tx) != 2:
-                raise ValueError(
-                    "Texture %s does not have 2 values. Line: %s" % (str(tx), str(line))
-                )
-            uvcoords.append(tx)
-        elif line.startswith("f "):  # Line is a face.
-            # Update face properties info.
-            face = tokens[1:]
-            face_list = [f.split("/") for f in face]
-            for vert_props in face_list:
-                # Vertex index.
-                faces.append(int(vert_props[0]))
-                if len(vert_props) > 1:
-                    if vert_props[1] != "":
-                        # Texture index is present e.g. f 4/1/1.
-                        uv_faces.append(int(vert_props[1]))
-
-    verts = torch.tensor(verts, dtype=torch.float32)
-    uvcoords = torch.tensor(uvcoords, dtype=torch.float32)
-    faces = torch.tensor(faces, dtype=torch.long); faces = faces.reshape(-1, 3) - 1
-    uv_faces = torch.tensor(uv_faces, dtype=torch.long); uv_faces = uv_faces.reshape(-1, 3) - 1
+    names = ['verts', 'uvcoords', 'faces', 'uv_faces']
+    if cache_dir is not None:
+        stem = os.path.splitext(os.path.basename(obj_filename))[0]
+        cache_path = os.path.join(cache_dir, f'{stem}_{_file_hash(obj_filename)[:16]}')
+        if os.path.exists(cache_path):
+            # copy-on-write memory map, the tensors share the pages of the cache files
+            arrays = [np.load(os.path.join(cache_path, f'{name}.npy'), mmap_mode='c') for name in names]
+        else:
+            arrays = _parse_obj(obj_filename)
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = tempfile.mkdtemp(dir=cache_dir)
+            for name, array in zip(names, arrays):
+                np.save(os.path.join(tmp_path, f'{name}.npy'), array)
+            try:
+                os.rename(tmp_path, cache_path)
+            except OSError:
+                # written by another process in the meantime
+                shutil.rmtree(tmp_path, ignore_errors=True)
+    else:
+        arrays = _parse_obj(obj_filename)
+    verts, uvcoords, faces, uv_faces = [torch.from_numpy(array) for array in arrays]
     return (
         verts,
         uvcoords,
@@ -524,6 +679,27 @@ def copy_state_dict(cur_state_dict, pre_state_dict, prefix='', load_name=None):
             # print('copy param {} failed'.format(k))
             continue
 
+def share_state_dict(model, state_dict):
+    ''' points the parameters and buffers of model to the tensors of state_dict, without copying
+    e.g. to weights in shared memory, every process using them maps the same pages
+    strict like load_state_dict: raises RuntimeError on missing or unexpected keys and on shape mismatches
+    '''
+    model_state = model.state_dict()
+    missing = [key for key in model_state if key not in state_dict]
+    unexpected = [key for key in state_dict if key not in model_state]
+    mismatched = [f'{key}: {tuple(state_dict[key].shape)} for {tuple(value.shape)}' for key, value in model_state.items()
+                  if key in state_dict and state_dict[key].shape != value.shape]
+    if len(missing) + len(unexpected) + len(mismatched) > 0:
+        raise RuntimeError(f'cannot share the state dict with {model.__class__.__name__}: missing keys {missing}, '
+                           f'unexpected keys {unexpected}, size mismatches {mismatched}')
+    for key, value in state_dict.items():
+        module_name, _, name = key.rpartition('.')
+        module = model.get_submodule(module_name) if module_name else model
+        if module._parameters.get(name) is not None:
+            module._parameters[name].data = value
+        elif name in module._buffers:
+            module._buffers[name] = value
+
 def check_mkdir(path):
     if not os.path.exists(path):
         print('creating %s' % path)
@@ -629,35 +805,125 @@ def plot_verts(image, kpts, color = 'r'):
     return image
 
 def tensor_vis_landmarks(images, landmarks, gt_landmarks=None, color = 'g', isScale=True):
-    # visualize landmarks
-    vis_landmarks = []
-    images = images.cpu().numpy()
-    predicted_landmarks = landmarks.detach().cpu().numpy()
+    # visualize landmarks, drawn on the device of images (see draw_landmarks)
+    images = images.detach()
+    predicted_landmarks = landmarks.detach().to(images.device)
+    if isScale:
+        predicted_landmarks = scale_landmarks(predicted_landmarks, images.shape[2], images.shape[3])
+    vis_landmarks = draw_landmarks(images, predicted_landmarks, color=color, connect=predicted_landmarks.shape[1]==68)
     if gt_landmarks is not None:
-        gt_landmarks_np = gt_landmarks.detach().cpu().numpy()
-    for i in range(images.shape[0]):
-        image = images[i]
-        image = image.transpose(1,2,0)[:,:,[2,1,0]].copy(); image = (image*255)
-        if isScale:
-            predicted_landmark = predicted_landmarks[i]
-            predicted_landmark[...,0] = predicted_landmark[...,0]*image.shape[1]/2 + image.shape[1]/2
-            predicted_landmark[...,1] = predicted_landmark[...,1]*image.shape[0]/2 + image.shape[0]/2
-        else:
-            predicted_landmark = predicted_landmarks[i]
-        if predicted_landmark.shape[0] == 68:
-            image_landmarks = plot_kpts(image, predicted_landmark, color)
-            if gt_landmarks is not None:
-                image_landmarks = plot_verts(image_landmarks, gt_landmarks_np[i]*image.shape[0]/2 + image.shape[0]/2, 'r')
-        else:
-            image_landmarks = plot_verts(image, predicted_landmark, color)
-            if gt_landmarks is not None:
-                image_landmarks = plot_verts(image_landmarks, gt_landmarks_np[i]*image.shape[0]/2 + image.shape[0]/2, 'r')
-        vis_landmarks.append(image_landmarks)
-
-    vis_landmarks = np.stack(vis_landmarks)
-    vis_landmarks = torch.from_numpy(vis_landmarks[:,:,:,[2,1,0]].transpose(0,3,1,2))/255.#, dtype=torch.float32)
+        gt_landmarks = gt_landmarks.detach().to(images.device)*images.shape[2]/2 + images.shape[2]/2
+        vis_landmarks = draw_landmarks(vis_landmarks, gt_landmarks, color='r', connect=False)
     return vis_landmarks
 
+# RGB colors for drawing on [0,1] image tensors, as plot_kpts (connected) and plot_verts draw them:
+# their cv2 tuples are BGR, e.g. 'r' shows blue
+kpt_colors = {
+    'r': (0., 0., 1.),
+    'g': (0., 1., 0.),
+    'b': (0., 0., 1.),
+}
+vert_colors = {
+    'r': (0., 0., 1.),
+    'g': (0., 1., 0.),
+    'b': (1., 0., 0.),
+    'y': (1., 1., 0.),
+}
+# plot_kpts with a visibility value
+visible_color = (0., 1., 0.)
+invisible_color = (1., 0., 0.)
+
+def scale_landmarks(landmarks, h, w):
+    ''' landmarks from [-1, 1] to pixel coordinates
+    '''
+    landmarks = landmarks.clone()
+    landmarks[...,0] = landmarks[...,0]*w/2 + w/2
+    landmarks[...,1] = landmarks[...,1]*h/2 + h/2
+    return landmarks
+
+def stamp_points(canvas, points, colors, radius=1):
+    ''' Draw filled discs into a batch of images, in place
+    Args:
+        canvas: [bz, 3, h, w]
+        points: [bz, n, 2], pixel coordinates (x, y)
+        colors: [bz, n, 3], RGB
+        radius: disc radius in pixels
+    '''
+    bz, _, h, w = canvas.shape
+    device = canvas.device
+    offsets = torch.arange(-radius, radius+1, device=device)
+    offset_y, offset_x = torch.meshgrid(offsets, offsets, indexing='ij')
+    inside = (offset_x**2 + offset_y**2) <= radius**2
+    offset_x = offset_x[inside]; offset_y = offset_y[inside]
+    # NaN and huge coordinates end up outside of the image
+    points = torch.nan_to_num(points, nan=-1e6).clamp(-1e6, 1e6)
+    # [bz, n, k], truncated like the int() casts for cv2
+    x = points[...,0].long()[:,:,None] + offset_x[None,None,:]
+    y = points[...,1].long()[:,:,None] + offset_y[None,None,:]
+    valid = (x >= 0) & (x < w) & (y >= 0) & (y < h)
+    batch_idx = torch.arange(bz, device=device)[:,None,None].expand_as(x)
+    colors = colors[:,:,None,:].expand(-1, -1, x.shape[-1], -1).to(canvas.dtype)
+    canvas.permute(0,2,3,1)[batch_idx[valid], y[valid], x[valid]] = colors[valid]
+    return canvas
+
+def draw_landmarks(images, landmarks, color='g', connect=True):
+    ''' Draw landmarks without leaving the device, same layout as plot_kpts/plot_verts
+    Args:
+        images: [bz, 3, h, w], range [0,1]
+        landmarks: [bz, n, 2 or 3 or 4], pixel coordinates, the 4th value is the visibility
+        connect: connect the 68 landmarks with lines, as plot_kpts
+    Returns:
+        images with landmarks: [bz, 3, h, w]
+    '''
+    canvas = images.clone()
+    bz, _, h, w = canvas.shape
+    device = canvas.device
+    n = landmarks.shape[1]
+    points = landmarks[...,:2].float()
+    if not connect:
+        colors = torch.tensor(vert_colors[color], device=device)[None,None,:].expand(bz, n, -1)
+        return stamp_points(canvas, points, colors, radius=2)
+    colors = torch.tensor(kpt_colors[color], device=device)[None,None,:].expand(bz, n, -1)
+    if landmarks.shape[-1] == 4:
+        visible = (landmarks[...,3:] > 0.5).float()
+        colors = visible*torch.tensor(visible_color, device=device) + (1-visible)*torch.tensor(invisible_color, device=device)
+    radius = max(int(min(h, w)/200), 1)
+    keep = torch.ones(n, dtype=torch.bool, device=device)
+    keep[torch.from_numpy(end_list).long().to(device)] = False
+    # lines from point i to i+1, except at the end of each contour
+    start = points[:,:-1][:,keep[:-1]]; end = points[:,1:][:,keep[:-1]]
+    # one step per pixel, bounded by the image size: NaN or far away landmarks do not blow up the number of steps
+    lengths = torch.nan_to_num((end - start).norm(dim=-1), nan=0., posinf=0.)
+    n_steps = int(lengths.max().clamp(max=h + w).ceil().item()) + 1
+    t = torch.linspace(0, 1, n_steps, device=device)[None,None,:,None]
+    line_points = (start[:,:,None,:] + (end - start)[:,:,None,:]*t).reshape(bz, -1, 2)
+    line_colors = torch.ones_like(line_points[...,:1]).expand(-1, -1, 3)
+    stamp_points(canvas, line_points, line_colors, radius=radius//2)
+    # a cv2 circle of radius r and thickness 2r covers a disc of radius 2r
+    return stamp_points(canvas, points[:,keep], colors[:,keep], radius=2*radius)
+
+def tensor2grid(visdict, size=224, dim=2):
+    '''
+    tile images into one uint8 BGR image. Resizing, tiling and conversion run on the device,
+    only the final image is copied to cpu.
+    image range should be [0,1]
+    dim: 2 for horizontal. 1 for vertical
+    '''
+    assert dim == 1 or dim==2
+    device = next(iter(visdict.values())).device
+    grids = []
+    for key in visdict:
+        _,_,h,w = visdict[key].shape
+        if dim == 2:
+            new_h = size; new_w = int(w*size/h)
+        elif dim == 1:
+            new_h = int(h*size/w); new_w = size
+        grids.append(torchvision.utils.make_grid(F.interpolate(visdict[key].detach().to(device), [new_h, new_w])))
+    grid = torch.cat(grids, dim)
+    grid_image = (grid*255.).clamp(0, 255).to(torch.uint8)
+    grid_image = grid_image[[2,1,0]].permute(1,2,0).contiguous()
+    return grid_image.cpu().numpy()
+
 
 ############### for training
 def load_local_mask(image_size=256, mode='bbx'):
@@ -686,18 +952,7 @@ def visualize_grid(visdict, savepath=None, size=224, dim=1, return_gird=True):
     image range should be [0,1]
     dim: 2 for horizontal. 1 for vertical
     '''
-    assert dim == 1 or dim==2
-    grids = {}
-    for key in visdict:
-        _,_,h,w = visdict[key].shape
-        if dim == 2:
-            new_h = size; new_w = int(w*size/h)
-        elif dim == 1:
-            new_h = int(h*size/w); new_w = size
-        grids[key] = torchvision.utils.make_grid(F.interpolate(visdict[key], [new_h, new_w]).detach().cpu())
-    grid = torch.cat(list(grids.values()), dim)
-    grid_image = (grid.numpy().transpose(1,2,0).copy()*255)[:,:,[2,1,0]]
-    grid_image = np.minimum(np.maximum(grid_image, 0), 255).astype(np.uint8)
+    grid_image = tensor2grid(visdict, size=size, dim=dim)
     if savepath:
         cv2.imwrite(savepath, grid_image)
     if return_gird:
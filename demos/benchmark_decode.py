@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+import os, sys
+import argparse
+from time import time
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from decalib.deca import DECA
+from decalib.utils.config import cfg as deca_cfg
+
+def main(args):
+    device = args.device
+    torch.manual_seed(0)
+    deca_cfg.model.decode_memory_budget = args.budget
+    deca = DECA(config=deca_cfg, device=device)
+    images = torch.rand(args.batch_size, 3, deca.image_size, deca.image_size, device=device)
+    with torch.no_grad():
+        codedict = deca.encode(images)
+    for stage, memory in deca.decode_memory().items():
+        print(f'  {stage:8s} {memory/2**20:8.1f} MB per sample')
+
+    if device == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+    start = time()
+    with torch.no_grad():
+        opdict, visdict = deca.decode(codedict)
+    elapsed = time() - start
+    peak = f', peak {torch.cuda.max_memory_allocated()/2**20:.0f} MB' if device == 'cuda' else ''
+    print(f'decoded {args.batch_size} samples with return_vis in {elapsed:.2f} s{peak}')
+
+    # chunked results equal the unchunked ones
+    n = min(args.batch_size, args.n_check)
+    deca.cfg.model.decode_memory_budget = 1e9
+    reference_codedict = {key: value[:n] for key, value in codedict.items()}
+    if device == 'cuda':
+        torch.cuda.synchronize()
+        allocated = torch.cuda.memory_allocated()
+        torch.cuda.reset_peak_memory_stats()
+    with torch.no_grad():
+        reference, _ = deca.decode(reference_codedict)
+    if device == 'cuda':
+        # the estimate has to bound the measured peak, or chunks overflow the budget
+        measured = (torch.cuda.max_memory_allocated() - allocated)/n
+        estimated = sum(deca.decode_memory().values())
+        print(f'peak per sample: measured {measured/2**20:.1f} MB, estimated {estimated/2**20:.1f} MB ({estimated/measured:.2f}x)')
+        assert measured <= estimated, 'decode_memory underestimates the peak memory of decode'
+    for key, value in reference.items():
+        diff = (opdict[key][:n] - value).abs().max().item()
+        assert diff < 1e-5, f'{key} of the chunked decode differs by {diff}'
+    print(f'chunked outputs match unchunked decoding on {n} samples')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DECA: memory-aware chunked decoding of large batches')
+
+    parser.add_argument('--device', default='cuda', type=str,
+                        help='set device, cpu for using cpu' )
+    parser.add_argument('--batch_size', default=256, type=int,
+                        help='samples decoded in one call' )
+    parser.add_argument('--budget', default=0, type=float,
+                        help='cfg.model.decode_memory_budget in MB, 0 for 80%% of the free cuda memory' )
+    parser.add_argument('--n_check', default=4, type=int,
+                        help='samples compared with unchunked decoding' )
+    main(parser.parse_args())
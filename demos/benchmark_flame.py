@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+import os, sys
+import argparse
+import tempfile
+from time import time
+import torch
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from decalib.models.FLAME import FLAME
+from decalib.models.lbs import lbs
+from decalib.models.flame_numpy import FLAMENumpy
+from decalib.utils.config import cfg as deca_cfg
+from decalib.utils import rig
+
+def flame_lbs(flame, shape, exp, pose):
+    ''' reference: the general lbs with the full joint regression and all pose correctives
+    '''
+    batch_size = shape.shape[0]
+    betas = torch.cat([shape, exp], dim=1)
+    full_pose = torch.cat([pose[:, :3], flame.neck_pose.expand(batch_size, -1), pose[:, 3:], flame.eye_pose.expand(batch_size, -1)], dim=1)
+    template_vertices = flame.v_template.unsqueeze(0).expand(batch_size, -1, -1)
+    vertices, _ = lbs(betas, full_pose, template_vertices,
+                      flame.shapedirs, flame.posedirs,
+                      flame.J_regressor, flame.parents,
+                      flame.lbs_weights, dtype=flame.dtype)
+    return vertices
+
+def timeit(func, n_repeat, device):
+    func()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    start = time()
+    for _ in range(n_repeat):
+        func()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    return (time() - start)/n_repeat*1000
+
+def main(args):
+    device = args.device
+    model_cfg = deca_cfg.model
+    flame = FLAME(model_cfg).to(device)
+    torch.manual_seed(0)
+    bz = args.batch_size
+    shape = torch.randn(bz, model_cfg.n_shape, device=device)
+    exp = torch.randn(bz, model_cfg.n_exp, device=device)
+    pose = torch.randn(bz, model_cfg.n_pose, device=device)*0.2
+
+    with torch.no_grad():
+        # parity
+        vertices_ref = flame_lbs(flame, shape, exp, pose)
+        vertices, landmarks2d, landmarks3d = flame(shape_params=shape, expression_params=exp, pose_params=pose)
+        error = (vertices - vertices_ref).abs().max().item()
+        print(f'FLAME vs general lbs, max vertex error: {error:.2e}')
+        identity = flame.bind_identity(shape)
+        vertices_id, _, _ = flame(expression_params=exp, pose_params=pose, identity=identity)
+        error_id = (vertices_id - vertices_ref).abs().max().item()
+        print(f'FLAME with bound identity vs general lbs, max vertex error: {error_id:.2e}')
+        lmk2d, lmk3d = flame.forward_landmarks(shape_params=shape, expression_params=exp, pose_params=pose)
+        error_lmk = max((lmk2d - landmarks2d).abs().max().item(), (lmk3d - landmarks3d).abs().max().item())
+        print(f'FLAME landmarks only vs full mesh, max landmark error: {error_lmk:.2e}')
+        assert error < args.tolerance and error_id < args.tolerance, 'FLAME fast path does not match the general lbs'
+        assert error_lmk < args.tolerance, 'landmark-only FLAME does not match the full mesh'
+        # the rig is an approximation, report its error for the identity of the first code
+        flame_rig = flame.rig(shape[:1])
+        flame_rig = {key: flame_rig[key][0].cpu().numpy() for key in flame_rig}
+        rig_vertices = rig.evaluate_rig(flame_rig, exp.cpu().numpy(), pose[:,3:].cpu().numpy(), pose[:,:3].cpu().numpy())
+        vertices_rig_ref, _, _ = flame(expression_params=exp, pose_params=pose, identity=flame.bind_identity(shape[:1]))
+        error_rig = np.abs(rig_vertices - vertices_rig_ref.cpu().numpy()).max(axis=(1,2))
+        print(f'blendshape rig vs FLAME, vertex error: mean {error_rig.mean():.2e}, max {error_rig.max():.2e}')
+        # torch-free decoder
+        # exported to a temporary file, cfg.model.flame_numpy_path is a shipped asset
+        with tempfile.TemporaryDirectory() as folder:
+            flame_numpy_path = os.path.join(folder, 'flame_numpy.npz')
+            flame.save_numpy(flame_numpy_path)
+            start = time()
+            flame_np = FLAMENumpy(flame_numpy_path)
+            t_load_np = (time() - start)*1000
+        shape_np, exp_np, pose_np = shape.cpu().numpy(), exp.cpu().numpy(), pose.cpu().numpy()
+        vertices_np, landmarks2d_np, landmarks3d_np = flame_np(shape_np, exp_np, pose_np)
+        error_np = max(np.abs(vertices_np - vertices.cpu().numpy()).max(),
+                       np.abs(landmarks2d_np - landmarks2d.cpu().numpy()).max(),
+                       np.abs(landmarks3d_np - landmarks3d.cpu().numpy()).max())
+        print(f'numpy FLAME vs FLAME, max vertex/landmark error: {error_np:.2e}')
+        assert error_np < args.tolerance, 'numpy FLAME does not match FLAME'
+
+        # speed
+        t_ref = timeit(lambda: flame_lbs(flame, shape, exp, pose), args.n_repeat, device)
+        t_fast = timeit(lambda: flame(shape_params=shape, expression_params=exp, pose_params=pose), args.n_repeat, device)
+        t_id = timeit(lambda: flame(expression_params=exp, pose_params=pose, identity=identity), args.n_repeat, device)
+        t_lmk = timeit(lambda: flame.forward_landmarks(shape_params=shape, expression_params=exp, pose_params=pose), args.n_repeat, device)
+    t_np = timeit(lambda: flame_np(shape_np, exp_np, pose_np), args.n_repeat, 'cpu')
+    print(f'batch size {bz} on {device}:')
+    print(f'  general lbs:            {t_ref:.2f} ms')
+    print(f'  FLAME (incl. landmarks): {t_fast:.2f} ms')
+    print(f'  FLAME, bound identity:   {t_id:.2f} ms')
+    print(f'  FLAME, landmarks only:   {t_lmk:.2f} ms')
+    print(f'  numpy FLAME (cpu):       {t_np:.2f} ms, loading the asset {t_load_np:.2f} ms')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DECA: check and time the FLAME fast paths against the general lbs')
+
+    parser.add_argument('--device', default='cuda', type=str,
+                        help='set device, cpu for using cpu' )
+    parser.add_argument('--batch_size', default=32, type=int,
+                        help='number of random FLAME codes' )
+    parser.add_argument('--n_repeat', default=20, type=int,
+                        help='number of timed runs' )
+    parser.add_argument('--tolerance', default=1e-5, type=float,
+                        help='max allowed vertex difference' )
+    main(parser.parse_args())
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+import os, sys
+import argparse
+import copy
+from time import time
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from decalib.deca import DECA
+from decalib.datasets import datasets
+from decalib.utils.config import cfg as deca_cfg
+from decalib.utils import inference
+
+def timeit(func, n_repeat, device):
+    with torch.no_grad():
+        func()
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        start = time()
+        for _ in range(n_repeat):
+            func()
+        if device == 'cuda':
+            torch.cuda.synchronize()
+    return (time() - start)/n_repeat*1000
+
+def load_images(args, device):
+    ''' face crops of inputpath, random images if there are none
+    '''
+    images = []
+    if args.inputpath:
+        testdata = datasets.TestData(args.inputpath, iscrop=True, face_detector=args.detector)
+        images = [testdata[i]['image'] for i in range(min(len(testdata), args.batch_size))]
+    if len(images) == 0:
+        return torch.rand(args.batch_size, 3, deca_cfg.dataset.image_size, deca_cfg.dataset.image_size, device=device)
+    return torch.stack(images).to(device)
+
+def main(args):
+    device = args.device
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    deca = DECA(config=deca_cfg, device=device)
+    deca.warmup(['E_flame', 'E_detail', 'D_detail'])
+    reference = {name: copy.deepcopy(getattr(deca, name)) for name in ['E_flame', 'E_detail', 'D_detail']}
+    images = load_images(args, device)
+    with torch.no_grad():
+        detailcode = reference['E_detail'](images)
+    inputs = {'E_flame': images, 'E_detail': images,
+              'D_detail': torch.cat([torch.randn(images.shape[0], deca.n_cond, device=device)*0.1, detailcode], dim=1)}
+
+    start = time()
+    deca.optimize_for_inference(channels_last=args.channels_last, jit=args.jit)
+    print(f'optimize_for_inference: {time() - start:.2f} s')
+    print(f'{"network":10s} {"max abs diff":>14s} {"eager ms":>10s} {"optimized ms":>14s}')
+    for name in ['E_flame', 'E_detail', 'D_detail']:
+        optimized = getattr(deca, name)
+        diff = inference.max_abs_diff(optimized, reference[name], inputs[name])
+        # outputs are codes/displacements of order 1e-3..1, folded weights only change rounding
+        assert diff < args.tolerance, f'{name} differs from the eager network by {diff}'
+        t_eager = timeit(lambda: reference[name](inputs[name]), args.n_repeat, device)
+        t_optimized = timeit(lambda: optimized(inputs[name]), args.n_repeat, device)
+        print(f'{name:10s} {diff:14.2e} {t_eager:10.2f} {t_optimized:14.2f}')
+    # end to end, the coarse and detail codes
+    t_encode = timeit(lambda: deca.encode(images), args.n_repeat, device)
+    print(f'encode (optimized), batch {images.shape[0]}: {t_encode:.2f} ms')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DECA: equivalence and latency of the inference-optimized networks')
+
+    parser.add_argument('-i', '--inputpath', default='TestSamples/examples', type=str,
+                        help='images for the equivalence check, random images if empty' )
+    parser.add_argument('--detector', default='fan', type=str,
+                        help='detector for cropping face, check decalib/detectors.py for details' )
+    parser.add_argument('--device', default='cpu', type=str,
+                        help='set device, cpu for using cpu' )
+    parser.add_argument('--batch_size', default=4, type=int,
+                        help='number of images' )
+    parser.add_argument('--n_repeat', default=20, type=int,
+                        help='number of timed runs' )
+    parser.add_argument('--threads', default=0, type=int,
+                        help='intra-op threads, torch default if 0' )
+    parser.add_argument('--channels_last', default=True, type=lambda x: x.lower() in ['true', '1'],
+                        help='convert the networks to channels-last' )
+    parser.add_argument('--jit', default=True, type=lambda x: x.lower() in ['true', '1'],
+                        help='trace and freeze the networks' )
+    parser.add_argument('--tolerance', default=1e-3, type=float,
+                        help='largest accepted absolute difference to the eager networks' )
+    main(parser.parse_args())
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+import os, sys
+import argparse
+import tempfile
+from time import time
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from decalib.utils import util
+
+def write_obj_loop(obj_name, vertices, faces, colors=None, texture=None, uvcoords=None, uvfaces=None,
+                   inverse_face_order=False, normal_map=None):
+    ''' reference: the previous util.write_obj, one str.format per line
+    '''
+    mtl_name = obj_name.replace('.obj', '.mtl')
+    texture_name = obj_name.replace('.obj', '.png')
+    material_name = 'FaceTexture'
+    faces = faces.copy()
+    faces += 1
+    if inverse_face_order:
+        faces = faces[:, [2, 1, 0]]
+        if uvfaces is not None:
+            uvfaces = uvfaces[:, [2, 1, 0]]
+    with open(obj_name, 'w') as f:
+        if texture is not None:
+            f.write('mtllib %s\n\n' % os.path.basename(mtl_name))
+        if colors is None:
+            for i in range(vertices.shape[0]):
+                f.write('v {} {} {}\n'.format(vertices[i, 0], vertices[i, 1], vertices[i, 2]))
+        else:
+            for i in range(vertices.shape[0]):
+                f.write('v {} {} {} {} {} {}\n'.format(vertices[i, 0], vertices[i, 1], vertices[i, 2], colors[i, 0], colors[i, 1], colors[i, 2]))
+        if texture is None:
+            for i in range(faces.shape[0]):
+                f.write('f {} {} {}\n'.format(faces[i, 2], faces[i, 1], faces[i, 0]))
+        else:
+            for i in range(uvcoords.shape[0]):
+                f.write('vt {} {}\n'.format(uvcoords[i,0], uvcoords[i,1]))
+            f.write('usemtl %s\n' % material_name)
+            uvfaces = uvfaces + 1
+            for i in range(faces.shape[0]):
+                f.write('f {}/{} {}/{} {}/{}\n'.format(faces[i, 0], uvfaces[i, 0], faces[i, 1], uvfaces[i, 1], faces[i, 2], uvfaces[i, 2]))
+            with open(mtl_name, 'w') as f:
+                f.write('newmtl %s\n' % material_name)
+                f.write('map_Kd {}\n'.format(os.path.basename(texture_name)))
+                if normal_map is not None:
+                    name, _ = os.path.splitext(obj_name)
+                    normal_name = f'{name}_normals.png'
+                    f.write(f'disp {normal_name}')
+                    cv2.imwrite(normal_name, normal_map)
+            cv2.imwrite(texture_name, texture)
+
+def read_rows(obj_name, prefix):
+    with open(obj_name) as f:
+        rows = [line[len(prefix):].replace('/', ' ').split() for line in f if line.startswith(prefix)]
+    return np.array(rows, dtype=np.float64)
+
+def read_bytes(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def compare(obj_ref, obj_new, tolerance):
+    ''' same geometry within the printed precision, identical side files
+    '''
+    for prefix in ['v ', 'vt ', 'f ']:
+        rows_ref, rows_new = read_rows(obj_ref, prefix), read_rows(obj_new, prefix)
+        assert rows_ref.shape == rows_new.shape, f'different number of "{prefix.strip()}" lines'
+        if rows_ref.size > 0:
+            assert np.abs(rows_ref - rows_new).max() <= tolerance, f'"{prefix.strip()}" lines differ'
+    for ext in ['.mtl', '.png', '_normals.png']:
+        file_ref, file_new = obj_ref.replace('.obj', ext), obj_new.replace('.obj', ext)
+        assert os.path.exists(file_ref) == os.path.exists(file_new), f'{ext} written by only one writer'
+        if os.path.exists(file_ref):
+            # the mtl refers to the files by name
+            content_ref = read_bytes(file_ref).replace(os.path.splitext(obj_ref)[0].encode(), b'').replace(b'ref.png', b'.png')
+            content_new = read_bytes(file_new).replace(os.path.splitext(obj_new)[0].encode(), b'').replace(b'new.png', b'.png')
+            assert content_ref == content_new, f'{ext} differs'
+
+def timeit(func, n_repeat):
+    start = time()
+    for _ in range(n_repeat):
+        func()
+    return (time() - start)/n_repeat*1000
+
+def main(args):
+    np.random.seed(0)
+    # sizes of the detail mesh (_detail.obj) and the coarse FLAME mesh (.obj) saved by DECA.save_obj
+    nv, nf = args.num_verts, args.num_verts*2
+    vertices = np.random.randn(nv, 3).astype(np.float32)*0.1
+    faces = np.random.randint(0, nv, size=(nf, 3))
+    colors = np.random.randint(0, 256, size=(nv, 3)).astype(np.uint8)
+    coarse_vertices = vertices[:5023]
+    coarse_faces = np.random.randint(0, 5023, size=(9976, 3))
+    uvcoords = np.random.rand(5118, 2).astype(np.float32)
+    uvfaces = np.random.randint(0, 5118, size=(9976, 3))
+    texture = np.random.randint(0, 256, size=(256, 256, 3)).astype(np.uint8)
+    normal_map = np.random.randint(0, 256, size=(256, 256, 3)).astype(np.uint8)
+
+    detail = lambda write, name: write(name, vertices, faces, colors=colors, inverse_face_order=True)
+    coarse = lambda write, name: write(name, coarse_vertices, coarse_faces, texture=texture, uvcoords=uvcoords,
+                                       uvfaces=uvfaces, normal_map=normal_map)
+    write_obj = lambda *a, **kw: util.write_obj(*a, precision=args.precision, **kw)
+    with tempfile.TemporaryDirectory() as folder:
+        ref_name, new_name = os.path.join(folder, 'ref.obj'), os.path.join(folder, 'new.obj')
+        tolerance = 0.5*10**-args.precision + 1e-12
+        for name, save in [('detail mesh', detail), ('coarse mesh', coarse)]:
+            save(write_obj_loop, ref_name); save(write_obj, new_name)
+            compare(ref_name, new_name, tolerance)
+            t_ref = timeit(lambda: save(write_obj_loop, ref_name), args.n_repeat)
+            t_new = timeit(lambda: save(write_obj, new_name), args.n_repeat)
+            size_ref, size_new = os.path.getsize(ref_name)/2**20, os.path.getsize(new_name)/2**20
+            print(f'{name}: loop writer {t_ref:.1f} ms ({size_ref:.1f} MB), bulk writer {t_new:.1f} ms ({size_new:.1f} MB), {t_ref/t_new:.1f}x')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DECA: check and time the bulk obj writer against the loop writer')
+
+    parser.add_argument('--num_verts', default=60000, type=int,
+                        help='number of vertices of the detail mesh' )
+    parser.add_argument('--precision', default=6, type=int,
+                        help='decimals written by the bulk writer' )
+    parser.add_argument('--n_repeat', default=3, type=int,
+                        help='number of timed runs' )
+    main(parser.parse_args())
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+import os, sys
+import argparse
+from time import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from decalib.pool import InferencePool, available_cores
+from decalib.utils.config import cfg as deca_cfg
+
+def reconstruct(deca, data):
+    # detection and cropping happen in TestData, the results are not saved
+    deca.infer(data['image'][None,...])
+
+def throughput(pool, inputpath, sample_step):
+    ''' images/s once the workers are up: from the first finished image to the last
+    '''
+    first = None
+    n_images = 0
+    for imagepath, error, seconds, rank in pool.run(inputpath, sample_step=sample_step):
+        if error is not None:
+            raise RuntimeError(f'{imagepath} failed in worker {rank}:\n{error}')
+        if first is None:
+            first = time()
+        else:
+            n_images += 1
+    if n_images == 0:
+        raise RuntimeError('at least two images are needed to measure the throughput')
+    return n_images/(time() - first)
+
+def main(args):
+    deca_cfg.model.use_tex = False
+    deca_cfg.rasterizer_type = args.rasterizer_type
+    n_cores = len(available_cores())
+    counts = [n for n in [1, 2, 4, 8, 16, 32, 64] if n*args.threads <= n_cores]
+    print(f'{n_cores} cores, {args.threads} threads per worker')
+    base = None
+    n_failed = 0
+    for n_workers in counts:
+        pool = InferencePool(deca_cfg, reconstruct, n_workers=n_workers, threads_per_worker=args.threads,
+                             iscrop=True, face_detector=args.detector)
+        speed = throughput(pool, args.inputpath, args.sample_step)
+        base = base or speed
+        efficiency = speed/(base*n_workers)
+        print(f'{n_workers:3d} workers: {speed:7.2f} images/s, speedup {speed/base:5.2f}, efficiency {efficiency:.0%}')
+        if efficiency < args.min_efficiency:
+            n_failed += 1
+    if n_failed > 0:
+        print(f'scaling below {args.min_efficiency:.0%} of linear for {n_failed} worker counts')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DECA: throughput of the cpu inference pool against the number of workers')
+
+    parser.add_argument('-i', '--inputpath', default='TestSamples/examples', type=str,
+                        help='path to the test data, enough images to keep every worker busy' )
+    parser.add_argument('--sample_step', default=10, type=int,
+                        help='sample images from video data for every step' )
+    parser.add_argument('--detector', default='fan', type=str,
+                        help='detector for cropping face, check decalib/detectors.py for details' )
+    parser.add_argument('--rasterizer_type', default='pytorch3d', type=str,
+                        help='rasterizer type: pytorch3d or auto, the workers run on cpu' )
+    parser.add_argument('--threads', default=4, type=int,
+                        help='intra-op threads (and cores) per worker' )
+    parser.add_argument('--min_efficiency', default=0.8, type=float,
+                        help='throughput relative to linear scaling from one worker below which the benchmark fails' )
+    main(parser.parse_args())
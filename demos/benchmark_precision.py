@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+import os, sys
+import argparse
+from time import time
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from decalib.deca import DECA
+from decalib.datasets import datasets
+from decalib.utils.config import cfg as deca_cfg
+
+def reconstruct(deca, images):
+    with torch.no_grad():
+        codedict = deca.encode(images)
+        opdict = deca.decode(codedict, return_vis=False)
+    return opdict
+
+def main(args):
+    device = args.device
+    deca_cfg.model.use_tex = False
+    deca = DECA(config=deca_cfg, device=device)
+    testdata = datasets.TestData(args.inputpath, iscrop=True, face_detector=args.detector)
+    images = torch.stack([testdata[i]['image'] for i in range(len(testdata))]).to(device)
+    print(f'{len(testdata)} images from {args.inputpath}')
+
+    deca.precision = 'fp32'
+    reference = [reconstruct(deca, images[i:i+args.batch_size]) for i in range(0, images.shape[0], args.batch_size)]
+    failed = []
+    print(f'{"precision":10s} {"vertex mm (mean/max)":>22s} {"lmk2d px (mean/max)":>22s} {"displacement (max)":>19s} {"ms/image":>9s}')
+    for precision in ['fp32'] + args.precisions:
+        deca.precision = precision
+        vertex_error, lmk_error, dis_error = [], [], []
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        start = time()
+        for batch, i in enumerate(range(0, images.shape[0], args.batch_size)):
+            opdict = reconstruct(deca, images[i:i+args.batch_size])
+            # FLAME is in meters, landmarks in [-1,1] of the cropped image
+            vertex_error.append((opdict['verts'] - reference[batch]['verts']).norm(dim=-1).flatten()*1000)
+            lmk_error.append((opdict['landmarks2d'] - reference[batch]['landmarks2d']).norm(dim=-1).flatten()*deca.image_size/2)
+            dis_error.append((opdict['displacement_map'] - reference[batch]['displacement_map']).abs().flatten())
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        elapsed = (time() - start)/images.shape[0]*1000
+        vertex_error, lmk_error, dis_error = torch.cat(vertex_error), torch.cat(lmk_error), torch.cat(dis_error)
+        print(f'{precision:10s} {vertex_error.mean():10.3f} / {vertex_error.max():9.3f} {lmk_error.mean():10.3f} / {lmk_error.max():9.3f} {dis_error.max():19.2e} {elapsed:9.1f}')
+        if vertex_error.max() > args.max_vertex_error or lmk_error.max() > args.max_landmark_error:
+            failed.append(precision)
+    if len(failed) > 0:
+        print(f'{", ".join(failed)} exceed the error limits (--max_vertex_error {args.max_vertex_error} mm, --max_landmark_error {args.max_landmark_error} px)')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DECA: accuracy and speed of reduced-precision inference against fp32')
+
+    parser.add_argument('-i', '--inputpath', default='TestSamples/examples', type=str,
+                        help='path to the test data, can be image folder, image path, image list, video' )
+    parser.add_argument('--detector', default='fan', type=str,
+                        help='detector for cropping face, check decalib/detectors.py for details' )
+    parser.add_argument('--device', default='cuda', type=str,
+                        help='set device, cpu for using cpu' )
+    parser.add_argument('--batch_size', default=8, type=int,
+                        help='images per batch' )
+    parser.add_argument('--precisions', default=['bf16', 'fp16'], nargs='+', type=str,
+                        help='reduced precisions to compare, fp32 is the reference' )
+    parser.add_argument('--max_vertex_error', default=1.0, type=float,
+                        help='largest accepted vertex error against fp32, in mm' )
+    parser.add_argument('--max_landmark_error', default=1.0, type=float,
+                        help='largest accepted 2D landmark error against fp32, in pixels of the crop' )
+    main(parser.parse_args())
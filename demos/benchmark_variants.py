@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+import os, sys
+import argparse
+import gc
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from decalib.deca import DECA
+from decalib.utils.renderer import check_rasterizer
+from decalib.utils.config import cfg as deca_cfg
+
+def rss():
+    # current resident memory in MB (linux)
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/2**20
+
+def main(args):
+    device = args.device
+    # the standard rasterizer is cuda only
+    rasterizer_type = args.rasterizer_type or ('standard' if torch.device(device).type == 'cuda' else 'pytorch3d')
+    check_rasterizer(rasterizer_type, device)
+    check_rasterizer(deca_cfg.rasterizer_type, device)
+    torch.manual_seed(0)
+    images = torch.rand(2, 3, deca_cfg.dataset.image_size, deca_cfg.dataset.image_size, device=device)
+    start = rss()
+    base = DECA(config=deca_cfg, device=device)
+    base.warmup()
+    _, base_opdict = base.infer(images)
+    print(f'base DECA: +{rss() - start:.1f} MB')
+
+    variants = {
+        'no texture': {'use_tex': False},
+        'extract texture': {'use_tex': False, 'extract_tex': True},
+        'coarse only': {'use_detail': False},
+        rasterizer_type + ' rasterizer': {'rasterizer_type': rasterizer_type},
+    }
+    for name, options in variants.items():
+        gc.collect()
+        start = rss()
+        variant = base.variant(**options)
+        variant.warmup()
+        _, opdict = variant.infer(images)
+        grown = rss() - start
+        assert variant.E_flame is base.E_flame and variant.flame is base.flame, 'the networks are not shared'
+        assert torch.equal(opdict['verts'], base_opdict['verts']), f'{name}: the coarse shape differs from the base DECA'
+        print(f'variant {name:20s} {options}: +{grown:.1f} MB after inference')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DECA: memory of variants sharing the weights and assets of one instance')
+
+    parser.add_argument('--device', default='cpu', type=str,
+                        help='set device, cpu for using cpu' )
+    parser.add_argument('--rasterizer_type', default=None, type=str,
+                        help='rasterizer of the last variant, differs from cfg.rasterizer_type to check renderer sharing. '
+                             'standard on cuda, pytorch3d on cpu by default' )
+    main(parser.parse_args())
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+import os, sys
+import argparse
+from time import time
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from decalib.utils.config import cfg as deca_cfg
+from decalib.utils import assets, tensorfile
+
+def main(args):
+    model_cfg = deca_cfg.model
+    bundle_path = args.bundle_path or model_cfg.asset_bundle_path
+    start = time()
+    compiled = assets.compile_assets(model_cfg, bundle_path)
+    print(f'compiled {len(compiled)} arrays into {bundle_path} ({os.path.getsize(bundle_path)/2**20:.1f} MB) in {time() - start:.2f} s')
+
+    # check the bundle against the source files
+    start = time()
+    mapped = tensorfile.load_arrays(bundle_path, verify=True)
+    t_bundle = time() - start
+    start = time()
+    source = assets.build_assets(model_cfg)
+    t_source = time() - start
+    assert set(mapped) == set(source), 'the bundle does not contain every asset'
+    for name in source:
+        assert np.array_equal(mapped[name], source[name]), f'{name} differs from the source files'
+    assert assets.bundle_is_valid(model_cfg, bundle_path)
+    print(f'loading: source files {t_source*1000:.1f} ms, bundle (verified) {t_bundle*1000:.1f} ms')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DECA: compile the static assets into one memory-mapped bundle')
+
+    parser.add_argument('--bundle_path', default='', type=str,
+                        help='output path, cfg.model.asset_bundle_path by default' )
+    main(parser.parse_args())
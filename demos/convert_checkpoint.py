@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+import os, sys
+import argparse
+import resource
+from time import time
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from decalib.utils.config import cfg as deca_cfg
+from decalib.utils import checkpoint
+
+def max_rss():
+    # MB, linux reports kB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+
+def main(args):
+    model_path = args.model_path or deca_cfg.pretrained_modelpath
+    tensor_path = args.tensor_path or deca_cfg.pretrained_tensorpath
+    start = time()
+    index = checkpoint.convert_checkpoint(model_path, tensor_path)
+    print(f'converted {model_path} into {tensor_path} ({os.path.getsize(tensor_path)/2**20:.1f} MB) in {time() - start:.2f} s')
+    for module, keys in index.items():
+        print(f'  {module}: {len(keys)} tensors')
+    assert checkpoint.is_converted(model_path, tensor_path)
+
+    modules = ['E_flame'] if args.coarse_only else list(index)
+    rss = max_rss()
+    start = time()
+    state_dicts = checkpoint.load_modules(tensor_path, modules)
+    # touch every tensor, as copying into the networks would
+    n_bytes = 0
+    for state_dict in state_dicts.values():
+        for value in state_dict.values():
+            value.clone()
+            n_bytes += value.numel()*value.element_size()
+    t_mapped = time() - start
+    rss_mapped = max_rss() - rss
+
+    rss = max_rss()
+    start = time()
+    reference = torch.load(model_path, map_location='cpu')
+    t_torch = time() - start
+    rss_torch = max_rss() - rss
+    for module in modules:
+        assert set(state_dicts[module]) == set(reference[module]), f'{module} has different parameters'
+        for key, value in reference[module].items():
+            assert torch.equal(state_dicts[module][key], value.cpu()), f'{module}/{key} differs from the checkpoint'
+    print(f'loading {", ".join(modules)} ({n_bytes/2**20:.1f} MB): torch.load {t_torch*1000:.1f} ms (+{rss_torch:.1f} MB peak rss), '
+          f'mapped {t_mapped*1000:.1f} ms (+{rss_mapped:.1f} MB peak rss)')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DECA: convert the pretrained model to a memory-mapped tensor file')
+
+    parser.add_argument('--model_path', default='', type=str,
+                        help='torch checkpoint, cfg.pretrained_modelpath by default' )
+    parser.add_argument('--tensor_path', default='', type=str,
+                        help='output path, cfg.pretrained_tensorpath by default' )
+    parser.add_argument('--coarse_only', default=False, type=lambda x: x.lower() in ['true', '1'],
+                        help='time loading only E_flame, as with cfg.model.use_detail False' )
+    main(parser.parse_args())
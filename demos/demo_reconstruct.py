@@ -24,11 +24,62 @@ import torch
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from decalib.deca import DECA
+from decalib.pool import InferencePool
 from decalib.datasets import datasets 
 from decalib.utils import util
 from decalib.utils.config import cfg as deca_cfg
 from decalib.utils.tensor_cropper import transform_points
 
+def reconstruct(deca, data, args):
+    ''' reconstruct and save one TestData sample, also run by the workers of --workers
+    '''
+    savefolder = args.savefolder
+    device = deca.device
+    name = data['imagename']
+    images = data['image'].to(device)[None,...]
+    with torch.no_grad():
+        codedict = deca.encode(images)
+        opdict, visdict = deca.decode(codedict) #tensor
+        if args.render_orig:
+            tform = data['tform'][None, ...]
+            tform = torch.inverse(tform).transpose(1,2).to(device)
+            original_image = data['original_image'][None, ...].to(device)
+            _, orig_visdict = deca.decode(codedict, render_orig=True, original_image=original_image, tform=tform)    
+            orig_visdict['inputs'] = original_image            
+
+    if args.saveDepth or args.saveKpt or args.saveObj or args.saveGlb or args.saveRig or args.saveMat or args.saveImages:
+        os.makedirs(os.path.join(savefolder, name), exist_ok=True)
+    # -- save results
+    if args.saveDepth:
+        depth_image = deca.render.render_depth(opdict['trans_verts']).repeat(1,3,1,1)
+        visdict['depth_images'] = depth_image
+        cv2.imwrite(os.path.join(savefolder, name, name + '_depth.jpg'), util.tensor2image(depth_image[0]))
+    if args.saveKpt:
+        np.savetxt(os.path.join(savefolder, name, name + '_kpt2d.txt'), opdict['landmarks2d'][0].cpu().numpy())
+        np.savetxt(os.path.join(savefolder, name, name + '_kpt3d.txt'), opdict['landmarks3d'][0].cpu().numpy())
+    if args.saveObj:
+        deca.save_obj(os.path.join(savefolder, name, name + '.obj'), opdict)
+    if args.saveGlb:
+        deca.save_glb(os.path.join(savefolder, name, name + '.glb'), opdict, quantize=args.quantizeGlb)
+    if args.saveRig:
+        deca.save_rig(os.path.join(savefolder, name, name + '_rig.npz'), codedict)
+    if args.saveMat:
+        opdict = util.dict_tensor2npy(opdict)
+        savemat(os.path.join(savefolder, name, name + '.mat'), opdict)
+    if args.saveVis:
+        cv2.imwrite(os.path.join(savefolder, name + '_vis.jpg'), deca.visualize(visdict))
+        if args.render_orig:
+            cv2.imwrite(os.path.join(savefolder, name + '_vis_original_size.jpg'), deca.visualize(orig_visdict))
+    if args.saveImages:
+        for vis_name in ['inputs', 'rendered_images', 'albedo_images', 'shape_images', 'shape_detail_images', 'landmarks2d']:
+            if vis_name not in visdict.keys():
+                continue
+            image = util.tensor2image(visdict[vis_name][0])
+            cv2.imwrite(os.path.join(savefolder, name, name + '_' + vis_name +'.jpg'), util.tensor2image(visdict[vis_name][0]))
+            if args.render_orig:
+                image = util.tensor2image(orig_visdict[vis_name][0])
+                cv2.imwrite(os.path.join(savefolder, name, 'orig_' + name + '_' + vis_name +'.jpg'), util.tensor2image(orig_visdict[vis_name][0]))
+
 def main(args):
     # if args.rasterizer_type != 'standard':
     #     args.render_orig = False
@@ -36,56 +87,32 @@ def main(args):
     device = args.device
     os.makedirs(savefolder, exist_ok=True)
 
-    # load test images 
-    testdata = datasets.TestData(args.inputpath, iscrop=args.iscrop, face_detector=args.detector, sample_step=args.sample_step)
-
     # run DECA
     deca_cfg.model.use_tex = args.useTex
-    deca_cfg.rasterizer_type = args.rasterizer_type
+    # the workers run on cpu, where the standard rasterizer does not
+    deca_cfg.rasterizer_type = args.rasterizer_type or ('standard' if args.workers == 1 else 'pytorch3d')
     deca_cfg.model.extract_tex = args.extractTex
+    if args.workers != 1:
+        # cpu worker processes sharing the weights, each detects, reconstructs and saves the images it pulls from a queue
+        pool = InferencePool(deca_cfg, reconstruct, handler_args=(args,), n_workers=args.workers or None,
+                             threads_per_worker=args.threads or None, iscrop=args.iscrop, face_detector=args.detector)
+        print(f'{pool.n_workers} workers on cores {pool.cores}')
+        start = time()
+        n_images = 0
+        for imagepath, error, seconds, rank in tqdm(pool.run(args.inputpath, sample_step=args.sample_step)):
+            n_images += 1
+            if error is not None:
+                print(f'{imagepath} failed in worker {rank}:\n{error}')
+        print(f'{n_images} images in {time() - start:.1f} s, {n_images/(time() - start):.2f} images/s')
+        print(f'-- please check the results in {savefolder}')
+        return
+
+    # load test images 
+    testdata = datasets.TestData(args.inputpath, iscrop=args.iscrop, face_detector=args.detector, sample_step=args.sample_step)
     deca = DECA(config = deca_cfg, device=device)
     # for i in range(len(testdata)):
     for i in tqdm(range(len(testdata))):
-        name = testdata[i]['imagename']
-        images = testdata[i]['image'].to(device)[None,...]
-        with torch.no_grad():
-            codedict = deca.encode(images)
-            opdict, visdict = deca.decode(codedict) #tensor
-            if args.render_orig:
-                tform = testdata[i]['tform'][None, ...]
-                tform = torch.inverse(tform).transpose(1,2).to(device)
-                original_image = testdata[i]['original_image'][None, ...].to(device)
-                _, orig_visdict = deca.decode(codedict, render_orig=True, original_image=original_image, tform=tform)    
-                orig_visdict['inputs'] = original_image            
-
-        if args.saveDepth or args.saveKpt or args.saveObj or args.saveMat or args.saveImages:
-            os.makedirs(os.path.join(savefolder, name), exist_ok=True)
-        # -- save results
-        if args.saveDepth:
-            depth_image = deca.render.render_depth(opdict['trans_verts']).repeat(1,3,1,1)
-            visdict['depth_images'] = depth_image
-            cv2.imwrite(os.path.join(savefolder, name, name + '_depth.jpg'), util.tensor2image(depth_image[0]))
-        if args.saveKpt:
-            np.savetxt(os.path.join(savefolder, name, name + '_kpt2d.txt'), opdict['landmarks2d'][0].cpu().numpy())
-            np.savetxt(os.path.join(savefolder, name, name + '_kpt3d.txt'), opdict['landmarks3d'][0].cpu().numpy())
-        if args.saveObj:
-            deca.save_obj(os.path.join(savefolder, name, name + '.obj'), opdict)
-        if args.saveMat:
-            opdict = util.dict_tensor2npy(opdict)
-            savemat(os.path.join(savefolder, name, name + '.mat'), opdict)
-        if args.saveVis:
-            cv2.imwrite(os.path.join(savefolder, name + '_vis.jpg'), deca.visualize(visdict))
-            if args.render_orig:
-                cv2.imwrite(os.path.join(savefolder, name + '_vis_original_size.jpg'), deca.visualize(orig_visdict))
-        if args.saveImages:
-            for vis_name in ['inputs', 'rendered_images', 'albedo_images', 'shape_images', 'shape_detail_images', 'landmarks2d']:
-                if vis_name not in visdict.keys():
-                    continue
-                image = util.tensor2image(visdict[vis_name][0])
-                cv2.imwrite(os.path.join(savefolder, name, name + '_' + vis_name +'.jpg'), util.tensor2image(visdict[vis_name][0]))
-                if args.render_orig:
-                    image = util.tensor2image(orig_visdict[vis_name][0])
-                    cv2.imwrite(os.path.join(savefolder, name, 'orig_' + name + '_' + vis_name +'.jpg'), util.tensor2image(orig_visdict[vis_name][0]))
+        reconstruct(deca, testdata[i], args)
     print(f'-- please check the results in {savefolder}')
         
 if __name__ == '__main__':
@@ -97,6 +124,11 @@ if __name__ == '__main__':
                         help='path to the output directory, where results(obj, txt files) will be stored.')
     parser.add_argument('--device', default='cuda', type=str,
                         help='set device, cpu for using cpu' )
+    parser.add_argument('--workers', default=1, type=int,
+                        help='cpu worker processes sharing the model weights, 0 for one per --threads cores. ignores --device, '
+                             'needs the pytorch3d (default with workers) or auto rasterizer' )
+    parser.add_argument('--threads', default=0, type=int,
+                        help='intra-op threads (and cores) per worker, 4 by default with --workers 0, otherwise the cores divided by the workers' )
     # process test images
     parser.add_argument('--iscrop', default=True, type=lambda x: x.lower() in ['true', '1'],
                         help='whether to crop input image, set false only when the test image are well cropped' )
@@ -105,8 +137,9 @@ if __name__ == '__main__':
     parser.add_argument('--detector', default='fan', type=str,
                         help='detector for cropping face, check decalib/detectors.py for details' )
     # rendering option
-    parser.add_argument('--rasterizer_type', default='standard', type=str,
-                        help='rasterizer type: pytorch3d or standard' )
+    parser.add_argument('--rasterizer_type', default=None, type=str,
+                        help='rasterizer type: pytorch3d, standard (cuda only) or auto (pick the fastest one for each batch size and resolution). '
+                             'standard by default, pytorch3d with --workers' )
     parser.add_argument('--render_orig', default=True, type=lambda x: x.lower() in ['true', '1'],
                         help='whether to render results in original image size, currently only works when rasterizer_type=standard')
     # save
@@ -124,6 +157,13 @@ if __name__ == '__main__':
     parser.add_argument('--saveObj', default=False, type=lambda x: x.lower() in ['true', '1'],
                         help='whether to save outputs as .obj, detail mesh will end with _detail.obj. \
                             Note that saving objs could be slow' )
+    parser.add_argument('--saveGlb', default=False, type=lambda x: x.lower() in ['true', '1'],
+                        help='whether to save outputs as binary glTF (.glb) with embedded texture, detail mesh will end with _detail.glb' )
+    parser.add_argument('--quantizeGlb', default=False, type=lambda x: x.lower() in ['true', '1'],
+                        help='whether to quantize glb positions (int16) and normals (int8), needs KHR_mesh_quantization in the viewer' )
+    parser.add_argument('--saveRig', default=False, type=lambda x: x.lower() in ['true', '1'],
+                        help='whether to save the blendshape rig of the identity as _rig.npz, \
+                            animate it without torch with decalib/utils/rig.py' )
     parser.add_argument('--saveMat', default=False, type=lambda x: x.lower() in ['true', '1'],
                         help='whether to save outputs as .mat' )
     parser.add_argument('--saveImages', default=False, type=lambda x: x.lower() in ['true', '1'],
@@ -30,6 +30,9 @@ from decalib.utils import util
 from decalib.utils.rotation_converter import batch_euler2axis, deg2rad
 from decalib.utils.config import cfg as deca_cfg
 
+# the gif shows every view at 0.6 x 224 pixels, the views are rendered at about that size, with the decimated mesh
+PREVIEW_SIZE = 128
+
 def main(args):
     savefolder = args.savefolder
     device = args.device
@@ -49,6 +52,8 @@ def main(args):
         with torch.no_grad():
             codedict = deca.encode(images)
             opdict, visdict = deca.decode(codedict) #tensor
+            # identity stays fixed below, only pose and expression change
+            codedict = deca.bind_identity(codedict)
         ### show shape with different views and expressions
         visdict_list = []
         max_yaw = 30
@@ -63,7 +68,7 @@ def main(args):
             codedict['pose'][:,:3] = global_pose
             codedict['cam'][:,:] = 0.
             codedict['cam'][:,0] = 8
-            _, visdict_view = deca.decode(codedict)   
+            _, visdict_view = deca.decode(codedict, vis_size=PREVIEW_SIZE)   
             visdict = {x:visdict[x] for x in ['inputs', 'shape_detail_images']}         
             visdict['pose'] = visdict_view['shape_detail_images']
             visdict_list.append(visdict)
@@ -79,7 +84,7 @@ def main(args):
             euler_pose[:,2] = 0#(torch.rand((self.batch_size))*60 - 30)*(2./euler_pose[:,1].abs())
             jaw_pose = batch_euler2axis(deg2rad(euler_pose[:,:3].cuda())) 
             codedict['pose'][:,3:] = jaw_pose
-            _, visdict_view = deca.decode(codedict)     
+            _, visdict_view = deca.decode(codedict, vis_size=PREVIEW_SIZE)     
             visdict_list[i]['exp'] = visdict_view['shape_detail_images']
             count = i
 
@@ -90,7 +95,7 @@ def main(args):
             # transfer exp code
             codedict['pose'][:,3:] = exp_codedict['pose'][:,3:]
             codedict['exp'] = exp_codedict['exp']
-            _, exp_visdict = deca.decode(codedict)
+            _, exp_visdict = deca.decode(codedict, vis_size=PREVIEW_SIZE)
             visdict_list[i+count]['exp'] = exp_visdict['shape_detail_images']
 
         visdict_list_list.append(visdict_list)
@@ -122,7 +127,7 @@ if __name__ == '__main__':
                         help='set device, cpu for using cpu' )
     # rendering option
     parser.add_argument('--rasterizer_type', default='standard', type=str,
-                        help='rasterizer type: pytorch3d or standard' )
+                        help='rasterizer type: pytorch3d, standard or auto (pick the fastest one for each batch size and resolution)' )
     # process test images
     parser.add_argument('--iscrop', default=True, type=lambda x: x.lower() in ['true', '1'],
                         help='whether to crop input image, set false only when the test image are well cropped' )
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+import os, sys
+import argparse
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from decalib.deca import DECA
+from decalib.utils import util
+from decalib.utils.config import cfg as deca_cfg
+
+def as_tuple(outputs):
+    return tuple(outputs) if isinstance(outputs, (tuple, list)) else (outputs,)
+
+def max_diff(outputs, reference):
+    return max((output.float() - ref.float()).abs().max().item() for output, ref in zip(as_tuple(outputs), as_tuple(reference)))
+
+def random_inputs(example_inputs, batch_size):
+    # another batch size than the traced one, checks that the batch dimension is dynamic
+    return tuple(torch.randn(batch_size, *x.shape[1:], device=x.device)*0.1 for x in example_inputs)
+
+def check_deca(deca, graphs, batch_size):
+    ''' the eager graphs against DECA.encode and decode, which they replace
+    Returns: name -> max abs diff
+    '''
+    images = torch.rand(batch_size, 3, deca.image_size, deca.image_size, device=deca.device)
+    with torch.no_grad():
+        codedict = deca.encode(images)
+        opdict = deca.decode(codedict, vis_lmk=False, return_vis=False)
+        codes = dict(zip(graphs['E_flame'][3], graphs['E_flame'][0](images)))
+        vertices, landmarks2d, landmarks3d = graphs['FLAME'][0](codedict['shape'], codedict['exp'], codedict['pose'])
+    # projected like decode
+    landmarks2d = util.batch_orth_proj(landmarks2d, codedict['cam'])[:,:,:2]
+    landmarks2d = torch.cat([landmarks2d[:,:,:1], -landmarks2d[:,:,1:]], dim=2)
+    diffs = {
+        'E_flame': max_diff([codes[key] for key in codes], [codedict[key] for key in codes]),
+        'FLAME': max_diff([vertices, landmarks2d, landmarks3d], [opdict['verts'], opdict['landmarks2d'], opdict['landmarks3d_world']]),
+    }
+    if 'D_detail' in graphs:
+        with torch.no_grad():
+            detail = graphs['E_detail'][0](images)
+            displacement = graphs['D_detail'][0](codedict['pose'], codedict['exp'], codedict['detail'])
+        diffs['E_detail'] = max_diff(detail, codedict['detail'])
+        diffs['D_detail'] = max_diff(displacement, opdict['displacement_map'] - deca.fixed_uv_dis[None,None,:,:])
+    return diffs
+
+def main(args):
+    device = args.device
+    torch.manual_seed(0)
+    deca_cfg.model.use_tex = False
+    deca = DECA(config=deca_cfg, device=device)
+    graphs = deca.graphs()
+    failed = []
+    for name, diff in check_deca(deca, graphs, args.batch_size).items():
+        print(f'{name:9s} eager graph against DECA encode/decode: max abs diff {diff:.2e}')
+        if diff > args.tolerance:
+            failed.append(f'{name} eager')
+    paths = deca.export_graphs(args.savefolder, formats=args.formats)
+    for name, (graph, example_inputs, input_names, output_names) in graphs.items():
+        inputs = random_inputs(example_inputs, args.batch_size)
+        with torch.no_grad():
+            reference = graph(*inputs)
+        if 'torchscript' in paths[name]:
+            loaded = torch.jit.load(paths[name]['torchscript'], map_location=device)
+            with torch.no_grad():
+                diff = max_diff(loaded(*inputs), reference)
+            print(f'{name:9s} torchscript {paths[name]["torchscript"]}: max abs diff {diff:.2e}')
+            if diff > args.tolerance:
+                failed.append(f'{name} torchscript')
+        if 'onnx' in paths[name]:
+            try:
+                import onnxruntime
+            except ImportError:
+                print(f'{name:9s} onnx {paths[name]["onnx"]}: written, install onnxruntime for the parity check')
+                continue
+            session = onnxruntime.InferenceSession(paths[name]['onnx'], providers=['CPUExecutionProvider'])
+            outputs = session.run(None, {input_name: x.cpu().numpy() for input_name, x in zip(input_names, inputs)})
+            diff = max_diff([torch.from_numpy(output) for output in outputs], [ref.cpu() for ref in as_tuple(reference)])
+            print(f'{name:9s} onnx {paths[name]["onnx"]}: max abs diff {diff:.2e}')
+            if diff > args.tolerance:
+                failed.append(f'{name} onnx')
+
+    if args.compile:
+        # the same graphs on the compiled modules
+        references = {}
+        for name, (graph, example_inputs, _, _) in graphs.items():
+            inputs = random_inputs(example_inputs, args.batch_size)
+            with torch.no_grad():
+                references[name] = (inputs, graph(*inputs))
+        deca.compile_for_inference(mode=args.compile_mode)
+        for name, (graph, _, _, _) in deca.graphs().items():
+            inputs, reference = references[name]
+            with torch.no_grad():
+                diff = max_diff(graph(*inputs), reference)
+            print(f'{name:9s} torch.compile ({args.compile_mode}): max abs diff {diff:.2e}')
+            if diff > args.tolerance:
+                failed.append(f'{name} torch.compile')
+    if len(failed) > 0:
+        print(f'parity check failed (--tolerance {args.tolerance}): {", ".join(failed)}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DECA: export the encoders, detail generator and FLAME, and check parity with eager')
+
+    parser.add_argument('-s', '--savefolder', default='TestSamples/graphs', type=str,
+                        help='path to the exported graphs' )
+    parser.add_argument('--device', default='cpu', type=str,
+                        help='set device, cpu for using cpu' )
+    parser.add_argument('--formats', default=['torchscript', 'onnx'], nargs='+', type=str,
+                        help='export formats: torchscript, onnx' )
+    parser.add_argument('--batch_size', default=3, type=int,
+                        help='batch size of the parity check, differs from the traced batch size 1' )
+    parser.add_argument('--compile', default=True, type=lambda x: x.lower() in ['true', '1'],
+                        help='check the torch.compile mode as well' )
+    parser.add_argument('--compile_mode', default='default', type=str,
+                        help='torch.compile mode: default, reduce-overhead, max-autotune' )
+    parser.add_argument('--tolerance', default=1e-4, type=float,
+                        help='largest accepted absolute difference to eager' )
+    main(parser.parse_args())
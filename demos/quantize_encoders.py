@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+import os, sys
+import argparse
+from time import time
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from decalib.deca import DECA
+from decalib.utils.config import cfg as deca_cfg
+from decalib.utils import quantization
+
+def timeit(func, images, n_repeat):
+    with torch.no_grad():
+        func(images)
+        start = time()
+        for _ in range(n_repeat):
+            func(images)
+    return (time() - start)/n_repeat*1000
+
+def main(args):
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    deca_cfg.model.use_tex = False
+    deca = DECA(config=deca_cfg, device='cpu')
+    deca.warmup(['E_flame', 'E_detail'])
+    fp32 = {name: getattr(deca, name) for name in ['E_flame', 'E_detail']}
+
+    # calibrate, quantize and save
+    calibration = quantization.calibration_batches(args.calibration_path, batch_size=args.batch_size, max_images=args.max_calibration_images, face_detector=args.detector)
+    print(f'calibration: {sum(images.shape[0] for images in calibration)} crops from {args.calibration_path}')
+    start = time()
+    deca.quantize(calibration, backend=args.backend)
+    deca.save_quantized(args.savepath)
+    print(f'quantized in {time() - start:.1f} s, saved to {args.savepath}')
+
+    # load through DECA, as a deployment would
+    deca_cfg.quantized_modelpath = args.savepath
+    quantized = DECA(config=deca_cfg, device='cpu')
+
+    eval_images = torch.cat(quantization.calibration_batches(args.inputpath, batch_size=args.batch_size, max_images=args.max_eval_images, face_detector=args.detector))
+    with torch.no_grad():
+        reference = {name: encoder(eval_images) for name, encoder in fp32.items()}
+        codedict = quantized.encode(eval_images)
+        fp32_codedict = quantized.decompose_code(reference['E_flame'], quantized.param_dict)
+        landmarks2d = quantized.decode_landmarks(codedict)['landmarks2d']
+        fp32_landmarks2d = quantized.decode_landmarks(fp32_codedict)['landmarks2d']
+    print(f'deviation from fp32 on {eval_images.shape[0]} crops of {args.inputpath}:')
+    for key in quantized.param_dict:
+        diff = (codedict[key] - fp32_codedict[key]).abs()
+        print(f'  {key:6s} mean {diff.mean():.2e}  max {diff.max():.2e}')
+    diff = (codedict['detail'] - reference['E_detail']).abs()
+    print(f'  {"detail":6s} mean {diff.mean():.2e}  max {diff.max():.2e}')
+    lmk_error = (landmarks2d - fp32_landmarks2d).norm(dim=-1)*quantized.image_size/2
+    print(f'  landmarks2d px: mean {lmk_error.mean():.3f}  max {lmk_error.max():.3f}')
+
+    for name in ['E_flame', 'E_detail']:
+        size_fp32 = quantization.model_size(fp32[name])/2**20
+        size_int8 = quantization.model_size(getattr(quantized, name))/2**20
+        t_fp32 = timeit(fp32[name], eval_images, args.n_repeat)
+        t_int8 = timeit(getattr(quantized, name), eval_images, args.n_repeat)
+        print(f'{name}: {size_fp32:.1f} MB -> {size_int8:.1f} MB, {t_fp32:.1f} ms -> {t_int8:.1f} ms per batch of {eval_images.shape[0]}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DECA: int8 quantization of the encoders for cpu inference')
+
+    parser.add_argument('--calibration_path', default='TestSamples/examples', type=str,
+                        help='images for calibrating the activation ranges, cropped with TestData' )
+    parser.add_argument('-i', '--inputpath', default='TestSamples/examples', type=str,
+                        help='images for the deviation report' )
+    parser.add_argument('-s', '--savepath', default='data/deca_model_int8.tar', type=str,
+                        help='path of the quantized encoders, set cfg.quantized_modelpath to use them' )
+    parser.add_argument('--detector', default='fan', type=str,
+                        help='detector for cropping face, check decalib/detectors.py for details' )
+    parser.add_argument('--backend', default='fbgemm', type=str,
+                        help='quantized engine, fbgemm for x86, qnnpack for arm' )
+    parser.add_argument('--batch_size', default=8, type=int,
+                        help='images per batch' )
+    parser.add_argument('--max_calibration_images', default=64, type=int,
+                        help='largest number of calibration images' )
+    parser.add_argument('--max_eval_images', default=32, type=int,
+                        help='largest number of images in the report' )
+    parser.add_argument('--n_repeat', default=10, type=int,
+                        help='number of timed runs' )
+    parser.add_argument('--threads', default=0, type=int,
+                        help='intra-op threads, torch default if 0' )
+    main(parser.parse_args())
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# Using this computer program means that you agree to the terms
+# in the LICENSE file included with this software distribution.
+# Any use not explicitly granted by the LICENSE is prohibited.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# For comments or questions, please email us at deca@tue.mpg.de
+# For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
+
+import os, sys
+import argparse
+from time import time, sleep
+from concurrent.futures import ThreadPoolExecutor
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from decalib.deca import DECA
+from decalib.utils.renderer import check_rasterizer
+from decalib.datasets import datasets
+from decalib.utils.config import cfg as deca_cfg
+
+NETWORKS = ['E_flame', 'E_detail', 'D_detail']
+KEYS = ['verts', 'trans_verts', 'landmarks2d', 'landmarks3d', 'displacement_map', 'uv_detail_normals', 'rendered_images']
+
+def snapshot(codedict, opdict):
+    outputs = {key: codedict[key].clone() for key in ['shape', 'exp', 'pose', 'cam', 'detail']}
+    outputs.update({key: opdict[key].clone() for key in KEYS if key in opdict})
+    return outputs
+
+def half_built(deca):
+    ''' networks already visible on the instance that are not ready: train mode means the weights were not loaded yet
+    '''
+    return [name for name in NETWORKS if name in deca._modules and deca._modules[name].training]
+
+def main(args):
+    device = args.device
+    check_rasterizer(args.rasterizer_type, device)
+    deca_cfg.model.use_tex = False
+    deca_cfg.rasterizer_type = args.rasterizer_type
+    # the components are created concurrently by the first requests, the lock must hold
+    deca = DECA(config=deca_cfg, device=device)
+    load_pretrained = deca._load_pretrained
+    def slow_load(module, network):
+        # widens the window in which another thread could see a network before its weights
+        sleep(args.load_delay)
+        load_pretrained(module, network)
+    deca._load_pretrained = slow_load
+    testdata = datasets.TestData(args.inputpath, iscrop=True, face_detector=args.detector)
+    images = [testdata[i]['image'].to(device)[None,...] for i in range(len(testdata))]
+    inputs = [image.clone() for image in images]
+
+    seen_half_built = set()
+    def request(i):
+        seen_half_built.update(half_built(deca))
+        codedict, opdict = deca.infer(images[i % len(images)])
+        return i % len(images), snapshot(codedict, opdict)
+
+    n_requests = args.n_requests*len(images)
+    start = time()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        concurrent = list(pool.map(request, range(n_requests)))
+    t_concurrent = time() - start
+    # sequential reference, on the warm model
+    reference = [request(i)[1] for i in range(len(images))]
+    # networks loaded without concurrency, train mode during the requests would have updated the batchnorm statistics
+    fresh = DECA(config=deca_cfg, device=device)
+    for name in NETWORKS:
+        if name in deca._modules:
+            for key, value in getattr(fresh, name).state_dict().items():
+                if not torch.equal(getattr(deca, name).state_dict()[key], value):
+                    seen_half_built.add(name)
+                    print(f'{name}.{key} was modified by the requests')
+                    break
+
+    n_failed = 0
+    for index, outputs in concurrent:
+        for key, value in reference[index].items():
+            if not torch.equal(outputs[key], value):
+                n_failed += 1
+                print(f'request on image {index}: {key} differs from the sequential result by {(outputs[key] - value).abs().max().item():.2e}')
+    for image, original in zip(images, inputs):
+        assert torch.equal(image, original), 'an input image was modified'
+    print(f'{n_requests} requests on {len(images)} images with {args.threads} threads in {t_concurrent:.1f} s')
+    if len(seen_half_built) > 0:
+        print(f'requests ran on half-built networks: {sorted(seen_half_built)}')
+    if n_failed > 0:
+        print(f'{n_failed} outputs differ from sequential inference')
+    if n_failed > 0 or len(seen_half_built) > 0:
+        sys.exit(1)
+    print('all outputs are identical to sequential inference')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DECA: concurrent inference from a thread pool on one model, compared with sequential inference')
+
+    parser.add_argument('-i', '--inputpath', default='TestSamples/examples', type=str,
+                        help='path to the test data, can be image folder, image path, image list, video' )
+    parser.add_argument('--detector', default='fan', type=str,
+                        help='detector for cropping face, check decalib/detectors.py for details' )
+    parser.add_argument('--device', default='cpu', type=str,
+                        help='set device, cpu for using cpu' )
+    parser.add_argument('--rasterizer_type', default='pytorch3d', type=str,
+                        help='rasterizer type: pytorch3d, standard (cuda only) or auto' )
+    parser.add_argument('--threads', default=8, type=int,
+                        help='threads of the pool' )
+    parser.add_argument('--n_requests', default=4, type=int,
+                        help='requests per image' )
+    parser.add_argument('--load_delay', default=1.0, type=float,
+                        help='seconds added to the weight loading of every network, so that the first requests overlap it' )
+    main(parser.parse_args())
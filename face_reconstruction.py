@@ -11,30 +11,38 @@ from PIL import Image
 import shutil
 
 class FaceReconstructor:
-    def __init__(self, device='cuda'):
+    def __init__(self, device='cuda', warmup=False, deca=None):
         """
         Initialize the 3D face reconstruction model.
 
         Args:
             device: Device to run the model on ('cuda' or 'cpu')
+            warmup: Create all model components now instead of on first use, for long-running services
+            deca: DECA instance to share the weights and assets with, the reconstructor uses a variant of it
         """
         # Add parent directory to path for DECA imports
         sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
         from decalib.deca import DECA
         from decalib.utils.config import cfg as deca_cfg
 
-        # Configure DECA
-        deca_cfg.model.use_tex = False
-        deca_cfg.rasterizer_type = 'standard'
-        deca_cfg.model.extract_tex = True
-
-        # Initialize DECA
-        self.device = device
-        self.deca = DECA(config=deca_cfg, device=device)
+        # Initialize DECA, configured on a copy: the global config stays untouched
+        options = {'use_tex': False, 'rasterizer_type': 'standard', 'extract_tex': True}
+        if deca is not None:
+            self.device = deca.device
+            self.deca = deca.variant(**options)
+        else:
+            deca_cfg = deca_cfg.clone()
+            deca_cfg.model.use_tex = options['use_tex']
+            deca_cfg.rasterizer_type = options['rasterizer_type']
+            deca_cfg.model.extract_tex = options['extract_tex']
+            self.device = device
+            self.deca = DECA(config=deca_cfg, device=device)
+        if warmup:
+            self.deca.warmup()
 
     def reconstruct_from_image(self, input_image, save_folder='output',
                                save_depth=False, save_obj=True, save_vis=True,
-                               detector='fan', is_crop=True):
+                               detector='fan', is_crop=True, save_glb=False):
         """
         Reconstructs a 3D face model from a single image.
 
@@ -46,6 +54,7 @@ class FaceReconstructor:
             save_vis: Whether to save visualization
             detector: Face detector to use ('fan', 'mtcnn', etc.)
             is_crop: Whether to crop the face from the image
+            save_glb: Whether to save a single binary glTF file (quantized), e.g. for web viewers
 
         Returns:
             dict: Dictionary containing paths to generated files
@@ -53,8 +62,8 @@ class FaceReconstructor:
         from decalib.datasets import datasets
         from decalib.utils import util
 
-        # Create timestamp-based name
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        # Create timestamp-based name, unique across concurrent calls
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
         name = f"face_{timestamp}"
 
         # Create temporary directory for the input image
@@ -94,9 +103,7 @@ class FaceReconstructor:
         os.makedirs(image_save_folder, exist_ok=True)
 
         # Process with DECA
-        with torch.no_grad():
-            codedict = self.deca.encode(images)
-            opdict, visdict = self.deca.decode(codedict)
+        codedict, opdict, visdict = self.deca.infer(images, return_vis=True)
 
         # Initialize result paths
         result_paths = {}
@@ -107,6 +114,11 @@ class FaceReconstructor:
             self.deca.save_obj(obj_path, opdict)
             result_paths['obj_path'] = obj_path
 
+        if save_glb:
+            glb_path = os.path.join(image_save_folder, f"{image_name}.glb")
+            self.deca.save_glb(glb_path, opdict, quantize=True)
+            result_paths['glb_path'] = glb_path
+
         if save_depth:
             depth_image = self.deca.render.render_depth(opdict['trans_verts']).repeat(1, 3, 1, 1)
             visdict['depth_images'] = depth_image
@@ -127,7 +139,7 @@ class FaceReconstructor:
 
 # Standalone function version for easier integration
 def reconstruct_3d_face(input_image, save_folder='output', device='cuda',
-                        save_depth=False, save_obj=True, save_vis=True):
+                        save_depth=False, save_obj=True, save_vis=True, save_glb=False):
     """
     Reconstructs a 3D face model from a single image.
 
@@ -138,6 +150,7 @@ def reconstruct_3d_face(input_image, save_folder='output', device='cuda',
         save_depth: Whether to save depth image
         save_obj: Whether to save OBJ file
         save_vis: Whether to save visualization
+        save_glb: Whether to save a single binary glTF file
 
     Returns:
         dict: Dictionary containing paths to generated files
@@ -148,5 +161,6 @@ def reconstruct_3d_face(input_image, save_folder='output', device='cuda',
         save_folder=save_folder,
         save_depth=save_depth,
         save_obj=save_obj,
-        save_vis=save_vis
+        save_vis=save_vis,
+        save_glb=save_glb
     )
\ No newline at end of file
@@ -408,8 +408,9 @@ class ImageGeneratorGUI:
                 save_folder=output_folder,
                 device='cuda',
                 save_depth=False,
-                save_obj=True,
-                save_vis=True
+                save_obj=False,
+                save_vis=True,
+                save_glb=True
             )
             
             # result_paths = {
@@ -419,8 +420,8 @@ class ImageGeneratorGUI:
 
             yield 80, "Processing complete, loading results...", None, None, new_filename
 
-            # Get the paths from the result
-            obj_path = result_paths.get('obj_path')
+            # Get the paths from the result, the viewer loads the single .glb file
+            obj_path = result_paths.get('glb_path', result_paths.get('obj_path'))
             vis_path = result_paths.get('vis_path')
 
             # Update the filename input with the actual filename
@@ -449,8 +450,9 @@ class ImageGeneratorGUI:
                 timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
                 filename = f"reconstructed_3d_{timestamp}"
 
-            if not filename.lower().endswith('.obj'):
-                filename += ".obj"
+            extension = os.path.splitext(model_path)[1]
+            if not filename.lower().endswith(extension):
+                filename += extension
 
             # Full path to save
             full_path = os.path.join(folder_path, filename)
@@ -475,8 +477,9 @@ class ImageGeneratorGUI:
                 timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
                 filename = f"reconstructed_3d_{timestamp}"
 
-            if not filename.lower().endswith('.obj'):
-                filename += ".obj"
+            extension = os.path.splitext(model_path)[1]
+            if not filename.lower().endswith(extension):
+                filename += extension
 
             # Make the download component visible and return the file path
             return gr.update(value=model_path, visible=True), f"Click the download button above to save {filename}"